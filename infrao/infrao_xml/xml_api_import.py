@@ -18,14 +18,11 @@
 #  along with infrao-plugin.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-import requests
 import traceback
 
-from xml.etree import ElementTree as ET
-
 from ..qgis_plugin_tools.tools.settings import parse_value
 from ..qgis_plugin_tools.tools.resources import plugin_name, load_ui
-from qgis.core import QgsProject
+from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCsException, QgsProject
 from qgis.utils import iface
 
 from ..ui.init_db import Dialog as DLG
@@ -35,7 +32,10 @@ from ..ui.ask_credentials import DbAskCredentialsDialog
 from PyQt5.QtWidgets import QDialog, QFileDialog
 from PyQt5.QtCore import QSettings
 
-from .xml_tools.import_tools import xml_import
+from ..qgis_plugin_tools.widgets.progress_dialog import run_task_with_progress_dialog
+from .xml_tasks import XmlApiImportTask
+from .xml_tools.api_tools import CRS84, get_filter_parameters
+from .xml_tools.http_cache import create_session
 
 FORM_CLASS = load_ui('import_api.ui')
 LOGGER = logging.getLogger(plugin_name())
@@ -46,34 +46,30 @@ class ImportFromApiDialog(QDialog, FORM_CLASS):
         self.setupUi(self)
         self.iface = iface
         self.is_running = False
+        self.layer_crs = {}
         
         DLG.populate_dbComboBox(self)
         self.populate_apiComboBox()
-        self.populate_layerComboBox()
+        self.populate_layerListWidget()
 
         self.closeButton.clicked.connect(self.close)
         self.importButton.clicked.connect(self.execute)
-        self.apiComboBox.currentTextChanged.connect(self.populate_layerComboBox)
+        self.apiComboBox.currentTextChanged.connect(self.populate_layerListWidget)
         #self.filePathLineEdit.setText("") # Fill in a file path for quick testing
 
-    def get_layer_gml(self): # TODO: what if bad response
-        ogc_api_url = self.get_connection_url()
-
-        if ogc_api_url is None:
-            return None
-
-        selected_layer = self.layerComboBox.currentText()
+    def get_selected_layers(self):
+        selected_layers = [item.text() for item in self.layerListWidget.selectedItems()]
 
-        if not selected_layer.startswith("infrao:"):
-            iface.messageBar().pushMessage("Taso ei ole Infra-O taso.", level=1, duration=5)
+        if not selected_layers:
+            iface.messageBar().pushMessage("Valitse tuotavat tasot.", level=1, duration=5)
             return None
 
-        gml_url = f"{ogc_api_url}collections/{selected_layer}/items?f=application%2Fgml%2Bxml;version=3.2"
+        for selected_layer in selected_layers:
+            if not selected_layer.startswith("infrao:"):
+                iface.messageBar().pushMessage(f"Taso {selected_layer} ei ole Infra-O taso.", level=1, duration=5)
+                return None
 
-        response = requests.get(gml_url)
-
-        layer_gml = response.text
-        return layer_gml
+        return selected_layers
     
 
     def get_connection_url(self): # TODO: what if no connections
@@ -93,8 +89,37 @@ class ImportFromApiDialog(QDialog, FORM_CLASS):
         return ogc_api_url
 
 
-    def populate_layerComboBox(self): # TODO: what if no connections
-        self.layerComboBox.clear()
+    def get_bbox(self, crs_uri):
+        canvas = iface.mapCanvas()
+        crs = QgsCoordinateReferenceSystem.fromOgcWmsCrs(crs_uri)
+        transform = QgsCoordinateTransform(canvas.mapSettings().destinationCrs(), crs, QgsProject.instance())
+        extent = transform.transformBoundingBox(canvas.extent())
+
+        if crs.hasAxisInverted():
+            return (extent.yMinimum(), extent.xMinimum(), extent.yMaximum(), extent.xMaximum())
+        return (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+
+
+    def get_filters(self, layers):
+        filters = {}
+        for layer in layers:
+            bbox = None
+            crs_uri = self.layer_crs.get(layer, CRS84)
+            if self.bboxCheckBox.isChecked():
+                try:
+                    bbox = self.get_bbox(crs_uri)
+                except QgsCsException:
+                    msg = traceback.format_exc()
+                    LOGGER.info(msg)
+                    iface.messageBar().pushMessage(f"Kartan näkymää ei voitu muuntaa tason {layer} koordinaattijärjestelmään.", level=1, duration=5)
+                    return None
+            filters[layer] = get_filter_parameters(bbox, crs_uri, self.filterLineEdit.text().strip(), self.datetimeLineEdit.text().strip())
+        return filters
+
+
+    def populate_layerListWidget(self): # TODO: what if no connections
+        self.layerListWidget.clear()
+        self.layer_crs = {}
 
         ogc_api_url = self.get_connection_url()
 
@@ -107,7 +132,9 @@ class ImportFromApiDialog(QDialog, FORM_CLASS):
         collections_url = f'{ogc_api_url}/collections/'
 
         try:
-            response = requests.get(collections_url)
+            with create_session() as session:
+                response = session.get(collections_url, headers={"Accept": "application/json"})
+                collections = response.json().get('collections', []) if response.status_code == 200 else None
         except:
             msg = traceback.format_exc()
             LOGGER.info(msg)
@@ -116,17 +143,19 @@ class ImportFromApiDialog(QDialog, FORM_CLASS):
 
         layers = set()
 
-        if response.status_code == 200:
-            collections = response.json().get('collections', [])
+        if collections is not None:
             for collection in collections:
                 layer_name = collection.get('id')
                 layers.add(layer_name)
+                # Only services supporting other crs than CRS84 tell the storage crs of a collection.
+                if collection.get('storageCrs'):
+                    self.layer_crs[layer_name] = collection['storageCrs']
         else:
             iface.messageBar().pushMessage("Tasoja ei löytynyt. Tarkista linkki.", level=1, duration=5)
-            self.layerComboBox.addItem("<ei tasoja>")
+            self.layerListWidget.addItem("<ei tasoja>")
 
-        for layer in layers:
-            self.layerComboBox.addItem(layer)
+        for layer in sorted(layers):
+            self.layerListWidget.addItem(layer)
 
 
     def populate_apiComboBox(self):
@@ -155,14 +184,14 @@ class ImportFromApiDialog(QDialog, FORM_CLASS):
                 iface.messageBar().pushMessage("Ei voi viedä ilman käyttäjänimeä tai salasanaa.", level=1, duration=5)
                 return
             
-        gml_string = self.get_layer_gml()
+        ogc_api_url = self.get_connection_url()
+        selected_layers = self.get_selected_layers()
+
+        if ogc_api_url is None or selected_layers is None:
+            return
 
-        if gml_string is not None:
-            tree = ET.ElementTree(ET.fromstring(gml_string))
+        filters = self.get_filters(selected_layers)
 
-            try:
-                xml_import(conn_params, tree, True)
-            except FileNotFoundError:
-                iface.messageBar().pushMessage("Virheellinen tiedostopolku. Tietoja ei voitu tuoda.", level=1, duration=5)
-            except PermissionError:
-                iface.messageBar().pushMessage("Pääsy estetty hakemistoon. Tarkista tiedoston polku.", level=1, duration=5)
\ No newline at end of file
+        if filters is not None:
+            self.task = XmlApiImportTask(conn_params, ogc_api_url, selected_layers, filters)
+            run_task_with_progress_dialog(self.task, f"Tuodaan kohteita tasoilta {', '.join(selected_layers)}", self, show_abort_button=True, abort_btn_text="Keskeytä")
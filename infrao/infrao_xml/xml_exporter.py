@@ -29,7 +29,9 @@ from ..db.db_utils import get_db_connection_params
 from ..ui.ask_credentials import DbAskCredentialsDialog
 
 from ..qgis_plugin_tools.tools.resources import plugin_name, load_ui
-from .xml_tools.export_tools import AINEISTO_TILA, INFRAO_AINEISTOTOIMITUKSEN_TIEDOT, xml_export
+from ..qgis_plugin_tools.widgets.progress_dialog import run_task_with_progress_dialog
+from .xml_tasks import XmlExportTask
+from .xml_tools.export_tools import AINEISTO_TILA, INFRAO_AINEISTOTOIMITUKSEN_TIEDOT
 
 
 FORM_CLASS = load_ui('export.ui')
@@ -124,11 +126,6 @@ class ExportDialog(QDialog, FORM_CLASS):
             
         save_file = self.filePathLineEdit.value()
 
-        try:
-            xml_export(conn_params, save_file, self.shipment_information)
-            self.shipment_information = {}
-            iface.messageBar().pushMessage(f"Tiedosto tallennettu polkuun: {save_file}", level=3, duration=10)
-        except FileNotFoundError:
-            iface.messageBar().pushMessage("Virheellinen tiedostopolku. Tiedostoa ei voitu tallentaa", level=1, duration=5)
-        except PermissionError:
-            iface.messageBar().pushMessage("Pääsy estetty hakemistoon. Tarkista tallennuspolku.", level=1, duration=5)
\ No newline at end of file
+        self.task = XmlExportTask(conn_params, save_file, self.shipment_information, self.exportChanges.isChecked(), database_xml=self.exportDatabaseXml.isChecked())
+        self.shipment_information = {}
+        run_task_with_progress_dialog(self.task, f"Viedään kohteita tiedostoon {save_file}", self, show_abort_button=True, abort_btn_text="Keskeytä")
\ No newline at end of file
@@ -27,11 +27,10 @@ from ..ui.init_db import Dialog as DLG
 from ..db.db_utils import get_db_connection_params
 from ..ui.ask_credentials import DbAskCredentialsDialog
 
-from xml.etree import ElementTree as ET
-
 from PyQt5.QtWidgets import QDialog, QFileDialog
 
-from .xml_tools.import_tools import xml_import
+from ..qgis_plugin_tools.widgets.progress_dialog import run_task_with_progress_dialog
+from .xml_tasks import XmlImportTask
 
 
 FORM_CLASS = load_ui('import.ui')
@@ -72,10 +71,5 @@ class ImportDialog(QDialog, FORM_CLASS):
                 return
         open_file = self.filePathLineEdit.value()
 
-        tree = ET.parse(open_file)
-        try:
-            xml_import(conn_params, tree, False)
-        except FileNotFoundError:
-            iface.messageBar().pushMessage("Virheellinen tiedostopolku. Tietoja ei voitu tuoda.", level=1, duration=5)
-        except PermissionError:
-            iface.messageBar().pushMessage("Pääsy estetty hakemistoon. Tarkista tiedoston polku.", level=1, duration=5)
\ No newline at end of file
+        self.task = XmlImportTask(conn_params, open_file)
+        run_task_with_progress_dialog(self.task, f"Tuodaan kohteita tiedostosta {open_file}", self, show_abort_button=True, abort_btn_text="Keskeytä")
\ No newline at end of file
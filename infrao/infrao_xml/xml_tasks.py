@@ -0,0 +1,183 @@
+#  Gispo Ltd., hereby disclaims all copyright interest in the program infrao-plugin
+#  Copyright (C) 2023 Gispo Ltd (https://www.gispo.fi/).
+#
+#
+#  This file is part of infrao-plugin.
+#
+#  infrao-plugin is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  infrao-plugin is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with infrao-plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import os
+
+import requests
+from qgis.utils import iface
+
+from ..qgis_plugin_tools.tools.exceptions import TaskInterruptedException
+from ..qgis_plugin_tools.tools.resources import plugin_name
+from ..qgis_plugin_tools.tools.settings import get_setting
+from ..qgis_plugin_tools.tools.tasks import BaseTask
+
+from .xml_tools.api_tools import xml_api_import
+from .xml_tools.export_tools import xml_export
+from .xml_tools.import_tools import xml_import_stream
+
+
+LOGGER = logging.getLogger(plugin_name())
+
+# Plugin setting for the number of worker processes reading and writing features. Set it to 1 to turn the worker processes off.
+WORKERS_SETTING = "workers"
+
+IMPORT_ERROR_MESSAGES = {
+    FileNotFoundError: "Virheellinen tiedostopolku. Tietoja ei voitu tuoda.",
+    PermissionError: "Pääsy estetty hakemistoon. Tarkista tiedoston polku.",
+}
+
+API_IMPORT_ERROR_MESSAGES = {
+    requests.HTTPError: "Rajapinta palautti virheen. Tietoja ei voitu tuoda.",
+    requests.RequestException: "Yhteys OGC API Features- rajapintaan ei onnistunut. Tietoja ei voitu tuoda.",
+}
+
+EXPORT_ERROR_MESSAGES = {
+    FileNotFoundError: "Virheellinen tiedostopolku. Tiedostoa ei voitu tallentaa",
+    PermissionError: "Pääsy estetty hakemistoon. Tarkista tallennuspolku.",
+}
+
+
+def get_worker_count() -> int:
+    """
+    Gets the number of worker processes used by imports and exports.
+
+    Returns:
+        int: The value of the workers setting, by default the number of CPUs. 1 if the worker processes are turned off.
+    """
+    return max(int(get_setting(WORKERS_SETTING, os.cpu_count() or 1, int)), 1)
+
+
+def push_task_error(exception: Exception, error_messages: dict) -> bool:
+    """
+    Shows the message of a known task error in the message bar.
+
+    Args:
+        exception (Exception): The exception the task failed with.
+        error_messages (dict): Messages keyed by exception type.
+
+    Returns:
+        bool: True if the error was known and its message shown.
+    """
+    for exception_type, message in error_messages.items():
+        if isinstance(exception, exception_type):
+            iface.messageBar().pushMessage(message, level=1, duration=5)
+            return True
+    return False
+
+
+class XmlImportTask(BaseTask):
+    """
+    Imports a gml file to the database in the background.
+
+    Progress is reported while the file is read and a canceled import is rolled back. The features are read in workers
+    worker processes, by default the number of the workers setting, see get_worker_count.
+    The canvas is refreshed on the main thread once the import has finished.
+    """
+
+    error_messages = IMPORT_ERROR_MESSAGES
+
+    def __init__(self, conn_params: dict, source: str, workers: int = None):
+        super().__init__()
+        self.conn_params = conn_params
+        self.source = source
+        self.workers = get_worker_count() if workers is None else workers
+
+    @property
+    def name(self) -> str:
+        return "Infra-O tuonti"
+
+    def _run(self) -> bool:
+        xml_import_stream(self.conn_params, self.source, workers=self.workers, progress_callback=self.setProgress)
+        return True
+
+    def finished(self, result: bool) -> None:
+        if result:
+            # Refresh the QGIS canvas to see added features.
+            iface.mapCanvas().refreshAllLayers()
+            iface.messageBar().pushMessage(f"Kohteet tiedostosta {self.source} tuotu onnistuneesti tietokantaan.", level=3, duration=10)
+        elif isinstance(self.exception, TaskInterruptedException):
+            iface.messageBar().pushMessage("Tuonti keskeytettiin. Tietokantaan ei lisätty kohteita.", level=1, duration=5)
+        elif not push_task_error(self.exception, self.error_messages):
+            super().finished(result)
+
+
+class XmlApiImportTask(XmlImportTask):
+    """
+    Imports the features of collections of an OGC API Features service to the database in the background.
+
+    The collections are imported in a single transaction. The features are fetched page by page and each page is imported as soon as it arrives.
+    """
+
+    error_messages = API_IMPORT_ERROR_MESSAGES
+
+    def __init__(self, conn_params: dict, api_url: str, collections: list, filters: dict = None, workers: int = None):
+        super().__init__(conn_params, ", ".join(collections), workers)
+        self.api_url = api_url
+        self.collections = collections
+        self.filters = filters
+
+    def _run(self) -> bool:
+        xml_api_import(self.conn_params, self.api_url, self.collections, self.filters, workers=self.workers, progress_callback=self.setProgress)
+        return True
+
+    def finished(self, result: bool) -> None:
+        if result:
+            iface.mapCanvas().refreshAllLayers()
+            iface.messageBar().pushMessage(f"Kohteet tasoilta {self.source} tuotu onnistuneesti tietokantaan.", level=3, duration=10)
+        else:
+            super().finished(result)
+
+
+class XmlExportTask(BaseTask):
+    """
+    Exports the database to a gml file in the background.
+
+    Progress is reported per table and a canceled export doesn't write the file. With changes_only, only the features changed since the last shipment are exported.
+    The tables are exported in workers worker processes, by default the number of the workers setting, see get_worker_count.
+    With database_xml, the XML of the features is built by the database, see xml_export.
+    """
+
+    def __init__(self, conn_params: dict, save_file: str, shipment_information: dict, changes_only: bool = False, workers: int = None, database_xml: bool = False):
+        super().__init__()
+        self.conn_params = conn_params
+        self.save_file = save_file
+        self.shipment_information = shipment_information
+        self.changes_only = changes_only
+        self.workers = get_worker_count() if workers is None else workers
+        self.database_xml = database_xml
+        self.failed_tables = []
+
+    @property
+    def name(self) -> str:
+        return "Infra-O vienti"
+
+    def _run(self) -> bool:
+        self.failed_tables = xml_export(self.conn_params, self.save_file, self.shipment_information, progress_callback=self.setProgress, workers=self.workers, database_xml=self.database_xml, changes_only=self.changes_only)
+        return True
+
+    def finished(self, result: bool) -> None:
+        if result:
+            for table in self.failed_tables:
+                iface.messageBar().pushMessage(f"Ongelma taulun {table} viemisessä.", level=1, duration=10)
+            iface.messageBar().pushMessage(f"Tiedosto tallennettu polkuun: {self.save_file}", level=3, duration=10)
+        elif isinstance(self.exception, TaskInterruptedException):
+            iface.messageBar().pushMessage("Vienti keskeytettiin. Tiedostoa ei tallennettu.", level=1, duration=5)
+        elif not push_task_error(self.exception, EXPORT_ERROR_MESSAGES):
+            super().finished(result)
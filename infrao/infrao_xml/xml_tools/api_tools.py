@@ -0,0 +1,428 @@
+#  Gispo Ltd., hereby disclaims all copyright interest in the program infrao-plugin
+#  Copyright (C) 2023 Gispo Ltd (https://www.gispo.fi/).
+#
+#
+#  This file is part of infrao-plugin.
+#
+#  infrao-plugin is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  infrao-plugin is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with infrao-plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+from xml.etree import ElementTree as ET
+
+from ...qgis_plugin_tools.tools.resources import plugin_name
+from .http_cache import HttpCache, create_session
+from .import_tools import AREA_PART_TABLE_LIST, AREA_TABLE_LIST, CORE_NS_LONG, ELEMENT_TO_TABLE, IMPORT_BATCH_SIZE, PROGRESS_INTERVAL, READ_PROGRESS_SHARE, TABLE_LIST, iter_feature_elements, xml_import_features
+
+
+GML_MEDIA_TYPE = "application/gml+xml;version=3.2"
+CRS84 = "http://www.opengis.net/def/crs/OGC/1.3/CRS84"
+CQL2_TEXT = "cql2-text"
+ATOM_LINK = "{http://www.w3.org/2005/Atom}link"
+
+# Number of features requested per page.
+API_PAGE_SIZE = 1000
+# Number of pages fetched at the same time.
+API_MAX_WORKERS = 4
+# Seconds to wait for the server to respond.
+API_TIMEOUT = 60
+
+LOGGER = logging.getLogger(plugin_name())
+
+
+def set_query_parameters(url: str, **parameters) -> str:
+    """
+    Sets query parameters of a url, replacing the existing values of the parameters.
+
+    Args:
+        url (str): The url.
+        **parameters: The query parameters and their values.
+
+    Returns:
+        str: The url with the parameters.
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query.update({key: str(value) for key, value in parameters.items()})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def get_items_url(api_url: str, collection: str, parameters: dict = None) -> str:
+    """
+    Builds the url of the features (items) of a collection.
+
+    Args:
+        api_url (str): The landing page url of the OGC API Features service.
+        collection (str): The id of the collection.
+        parameters (dict, optional): Query parameters selecting the features, see get_filter_parameters.
+
+    Returns:
+        str: The url of the items.
+    """
+    return set_query_parameters(f"{api_url.rstrip('/')}/collections/{collection}/items", **(parameters or {}))
+
+
+def get_filter_parameters(bbox: Tuple[float, float, float, float] = None, bbox_crs: str = CRS84, cql_filter: str = None, datetime: str = None) -> dict:
+    """
+    Builds the query parameters selecting only some features of a collection.
+
+    The servers keep the parameters in the links to the next pages.
+
+    Args:
+        bbox (Tuple[float, float, float, float], optional): The bounding box the features intersect, in the axis order of bbox_crs.
+        bbox_crs (str): The URI of the coordinate reference system of bbox. Defaults to WGS 84 longitude/latitude.
+        cql_filter (str, optional): A CQL2 text filter expression.
+        datetime (str, optional): The instant or interval of the features, e.g. 2024-01-01T00:00:00Z/..
+
+    Returns:
+        dict: The query parameters.
+    """
+    parameters = {}
+    if bbox is not None:
+        parameters["bbox"] = ",".join(f"{value:.15g}" for value in bbox)
+        if bbox_crs != CRS84:
+            parameters["bbox-crs"] = bbox_crs
+    if cql_filter:
+        parameters["filter"] = cql_filter
+        parameters["filter-lang"] = CQL2_TEXT
+    if datetime:
+        parameters["datetime"] = datetime
+    return parameters
+
+
+def read_page_links(events: Iterator[Tuple[str, ET.Element]]) -> Tuple[str, int, int, list]:
+    """
+    Reads the next page link and the numbers of matched and returned features from the start of a page being parsed.
+
+    The events are read up to the first feature member. The next link is read from the next attribute of a WFS feature
+    collection or from an atom:link element with rel="next" before the first feature member.
+
+    Args:
+        events (Iterator[Tuple[str, ET.Element]]): The start and end events of the page, as returned by ET.iterparse.
+
+    Returns:
+        Tuple[str, int, int, list]: The url of the next page or None, the number of matched features and the number of features on the page or None if unknown, and the events read.
+    """
+    next_url = None
+    number_matched = None
+    number_returned = None
+    read_events = []
+    depth = 0
+    for event, element in events:
+        read_events.append((event, element))
+        if event == "end":
+            if element.tag == ATOM_LINK and element.get("rel") == "next":
+                next_url = element.get("href")
+            depth -= 1
+            continue
+        depth += 1
+        if depth == 1:
+            next_url = element.get("next")
+            matched = element.get("numberMatched")
+            number_matched = int(matched) if matched and matched.isdigit() else None
+            returned = element.get("numberReturned")
+            number_returned = int(returned) if returned and returned.isdigit() else None
+        elif depth == 2 and element.tag != ATOM_LINK:
+            break
+    return next_url, number_matched, number_returned, read_events
+
+
+class CollectionPage:
+    """
+    A page of features being streamed from the server.
+
+    The body of the response is parsed incrementally as the features are read, so only the features not yet read are kept in memory. The response is closed once all its features have been read or the page is closed.
+
+    Attributes:
+        next_url (str): The url of the next page or None.
+        number_matched (int): The number of features matched by the request or None if unknown.
+        number_returned (int): The number of features on the page or None if unknown.
+        features_read (int): The number of features read from the page so far.
+    """
+
+    def __init__(self, response: requests.Response, events: Iterator[Tuple[str, ET.Element]], next_url: str, number_matched: int, number_returned: int = None):
+        self.response = response
+        self.events = events
+        self.next_url = next_url
+        self.number_matched = number_matched
+        self.number_returned = number_returned
+        self.features_read = 0
+
+    def iter_features(self) -> Iterator[Tuple[str, ET.Element]]:
+        """
+        Streams the features of the page, see iter_feature_elements.
+
+        Yields:
+            A tuple containing the table name and the feature element.
+        """
+        try:
+            for feature in iter_feature_elements(self.events):
+                self.features_read += 1
+                yield feature
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.response.close()
+
+
+def open_page(session: requests.Session, url: str) -> CollectionPage:
+    """
+    Requests a page of features and reads the start of it.
+
+    The body is requested gzip compressed when the server supports it and is decompressed and parsed as it is read. The next page link is read from the Link header of the response (rel="next") or from the page itself.
+
+    Args:
+        session (requests.Session): The session the page is fetched with.
+        url (str): The url of the page.
+
+    Returns:
+        CollectionPage: The page, with its features not yet read.
+
+    Raises:
+        requests.HTTPError: If the server responds with an error.
+    """
+    response = session.get(url, headers={"Accept": GML_MEDIA_TYPE, "Accept-Encoding": "gzip"}, timeout=API_TIMEOUT, stream=True)
+    try:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        events = ET.iterparse(response.raw, events=("start", "end"))
+        next_url, number_matched, number_returned, read_events = read_page_links(events)
+    except Exception:
+        response.close()
+        raise
+    next_link = response.links.get("next")
+    if next_link is not None:
+        next_url = next_link["url"]
+    return CollectionPage(response, chain(read_events, events), next_url, number_matched, number_returned)
+
+
+def close_pages(futures: Iterable[Future]) -> None:
+    """
+    Closes the pages opened by futures which are not read, cancelling the pages not yet requested.
+
+    Args:
+        futures (Iterable[Future]): The futures of open_page.
+
+    Returns:
+        None
+    """
+    for future in futures:
+        if not future.cancel() and future.exception() is None:
+            future.result().close()
+
+
+def get_first_page_url(items_url: str, page_size: int) -> str:
+    """
+    Builds the url of the first page of GML features of a collection.
+
+    Args:
+        items_url (str): The url of the items of the collection.
+        page_size (int): Number of features requested per page.
+
+    Returns:
+        str: The url of the first page.
+    """
+    return set_query_parameters(items_url, f=GML_MEDIA_TYPE, limit=page_size)
+
+
+def iter_collection_pages(session: requests.Session, items_url: str, page_size: int = API_PAGE_SIZE, workers: int = API_MAX_WORKERS, first_page: CollectionPage = None) -> Iterator[CollectionPage]:
+    """
+    Requests all the pages of features of a collection in order.
+
+    If the first page tells the number of matched features and its next link pages with an offset, the rest of the
+    pages are requested by offset, at most workers pages at a time. The offsets are stepped by the number of features
+    on the first page, as servers may return fewer features than requested while their next links still step by the
+    requested limit. If the page doesn't tell the number of its features (numberReturned), the features are counted
+    as the first page is read. Otherwise the next links are followed and the next page is requested while the current
+    one is being read. Each page has to be read before the next one is yielded.
+
+    Args:
+        session (requests.Session): The session the pages are fetched with.
+        items_url (str): The url of the items of the collection.
+        page_size (int): Number of features requested per page.
+        workers (int): Number of pages requested at the same time.
+        first_page (CollectionPage, optional): The first page, if it has already been requested.
+
+    Yields:
+        CollectionPage: The pages with the number of matched features of the first page.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        page = first_page or open_page(session, get_first_page_url(items_url, page_size))
+        number_matched = page.number_matched
+        next_url = page.next_url
+        next_query = dict(parse_qsl(urlsplit(next_url).query)) if next_url else {}
+        if number_matched is not None and next_query.get("offset", "").isdigit():
+            offset = int(dict(parse_qsl(urlsplit(page.response.url).query)).get("offset", 0))
+            step = page.number_returned
+            if step is None:
+                yield page
+                step = page.features_read
+                page = None
+            if step > 0:
+                offsets = iter(range(offset + step, number_matched, step))
+                for offset in islice(offsets, workers - 1):
+                    pending.append(executor.submit(open_page, session, set_query_parameters(next_url, offset=offset)))
+                if page is not None:
+                    yield page
+                for offset in offsets:
+                    pending.append(executor.submit(open_page, session, set_query_parameters(next_url, offset=offset)))
+                    page = pending.popleft().result()
+                    page.number_matched = number_matched
+                    yield page
+                while pending:
+                    page = pending.popleft().result()
+                    page.number_matched = number_matched
+                    yield page
+            elif page is not None:
+                yield page
+        else:
+            while page is not None:
+                if page.next_url:
+                    pending.append(executor.submit(open_page, session, page.next_url))
+                yield page
+                page = pending.popleft().result() if pending else None
+                if page is not None:
+                    page.number_matched = number_matched
+    finally:
+        close_pages(pending)
+        executor.shutdown(cancel_futures=True)
+
+
+def sort_collections(collections: list) -> list:
+    """
+    Sorts collections in the order their tables are imported in: areas, area parts and the other tables.
+
+    Args:
+        collections (list): The ids of the collections, e.g. infrao:Katualue.
+
+    Returns:
+        list: The collections in import order. Collections which are not Infra-O features are last.
+    """
+    table_order = {table: i for i, (_, table) in enumerate(AREA_TABLE_LIST + AREA_PART_TABLE_LIST + TABLE_LIST)}
+
+    def get_order(collection):
+        table = ELEMENT_TO_TABLE.get(CORE_NS_LONG + collection.split(":", 1)[-1])
+        return table_order.get(table, len(table_order))
+
+    return sorted(collections, key=get_order)
+
+
+def iter_collections(session: requests.Session, items_urls: list, page_size: int = API_PAGE_SIZE, workers: int = API_MAX_WORKERS) -> Iterator[Iterator[CollectionPage]]:
+    """
+    Requests the pages of several collections, one collection after another.
+
+    The first pages of the next collections are requested while the current collection is being read, at most workers collections ahead.
+
+    Args:
+        session (requests.Session): The session the pages are fetched with.
+        items_urls (list): The urls of the items of the collections in the order they are read.
+        page_size (int): Number of features requested per page.
+        workers (int): Number of pages requested at the same time.
+
+    Yields:
+        Iterator[CollectionPage]: The pages of each collection, see iter_collection_pages.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+    first_pages = deque()
+    urls = iter(items_urls)
+    try:
+        for items_url in islice(urls, workers):
+            first_pages.append((items_url, executor.submit(open_page, session, get_first_page_url(items_url, page_size))))
+        while first_pages:
+            items_url, first_page = first_pages.popleft()
+            pages = iter_collection_pages(session, items_url, page_size, workers, first_page.result())
+            try:
+                yield pages
+            finally:
+                pages.close()
+            for next_items_url in islice(urls, 1):
+                first_pages.append((next_items_url, executor.submit(open_page, session, get_first_page_url(next_items_url, page_size))))
+    finally:
+        close_pages(future for _, future in first_pages)
+        executor.shutdown(cancel_futures=True)
+
+
+def iter_api_features(pages: Iterator[CollectionPage], progress_callback: Callable[[float], None] = None) -> Iterator[Tuple[str, ET.Element]]:
+    """
+    Streams the features of the pages of a collection.
+
+    Args:
+        pages (Iterator[CollectionPage]): The pages, see iter_collection_pages.
+        progress_callback (Callable, optional): Called with the percentage of the matched features read every PROGRESS_INTERVAL features, or with 0 if the number of matched features is not known, so a canceled import can still be stopped.
+
+    Yields:
+        A tuple containing the table name and the feature element.
+    """
+    feature_count = 0
+    for page in pages:
+        for feature in page.iter_features():
+            feature_count += 1
+            if progress_callback is not None and feature_count % PROGRESS_INTERVAL == 0:
+                progress_callback(min(100 * feature_count / page.number_matched, 100) if page.number_matched else 0)
+            yield feature
+
+
+def xml_api_import(conn_params: dict, api_url: str, collections: list, filters: dict = None, page_size: int = API_PAGE_SIZE, batch_size: int = IMPORT_BATCH_SIZE, transform_in_database: bool = False, workers: int = 1, progress_callback: Callable[[float], None] = None, cache: HttpCache = None):
+    """
+    Imports the features of collections of an OGC API Features service in a single transaction.
+
+    The collections are read in the order their tables are imported in, see sort_collections. The features are requested
+    as GML one page at a time and streamed to the import as the pages arrive, so the memory use does not depend on the
+    size of the collections, see xml_import_features. The first pages of the next collections are requested while the current one is read.
+    The pages are cached and revalidated, so an unchanged page costs a single request without a body, see CachingAdapter.
+
+    Args:
+        conn_params (dict): Connection parameters to the postgis database.
+        api_url (str): The landing page url of the OGC API Features service.
+        collections (list): The ids of the collections.
+        filters (dict, optional): The query parameters selecting the features of each collection, keyed by collection, see get_filter_parameters.
+        page_size (int): Number of features requested per page.
+        batch_size (int): Number of features per table kept in memory before adding them to the database.
+        transform_in_database (bool): True to transform the geometries to the database's coordinate system with PostGIS instead of while reading them.
+        workers (int): Number of worker processes reading the features, see xml_import_features.
+        progress_callback (Callable, optional): Called with the percentage of the import finished every PROGRESS_INTERVAL features and while the features left after reading the collections are added, see xml_import_features. If it raises an exception, the import is rolled back.
+        cache (HttpCache, optional): The cache of the pages. Defaults to the cache of the plugin.
+
+    Returns:
+        None
+    """
+    collections = sort_collections(collections)
+    filters = filters or {}
+    items_urls = [get_items_url(api_url, collection, filters.get(collection)) for collection in collections]
+
+    def read_features():
+        for i, pages in enumerate(iter_collections(session, items_urls, page_size)):
+            LOGGER.info(f"Haetaan kohteet osoitteesta {items_urls[i]}")
+            collection_progress = None
+            if progress_callback is not None:
+                collection_progress = lambda progress: progress_callback((i + progress / 100) * READ_PROGRESS_SHARE / len(collections))
+            yield from iter_api_features(pages, collection_progress)
+
+    # The first pages of the next collections and the pages of the current one are requested at the same time.
+    with create_session(cache, pool_size=2 * API_MAX_WORKERS) as session:
+        features = read_features()
+        try:
+            xml_import_features(conn_params, features, batch_size, transform_in_database, workers, progress_callback)
+        finally:
+            features.close()
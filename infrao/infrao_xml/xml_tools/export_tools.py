@@ -18,21 +18,31 @@
 #  along with infrao-plugin.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
 import traceback
-import uuid
-
+from datetime import datetime
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import IO, Callable, Iterator, Tuple
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
 import psycopg2
-from psycopg2.sql import SQL, Identifier, Placeholder
+from psycopg2.sql import SQL, Composable, Composed, Identifier, Literal, Placeholder
 from psycopg2.extras import DictCursor
 
 import time
 
 import xml.etree.ElementTree as ET
 
-from qgis.core import NULL
-from qgis.utils import iface
-
 from ...qgis_plugin_tools.tools.resources import plugin_name
+from .geometry import WKB_LINESTRING, WKB_MULTILINESTRING, WKB_MULTIPOINT, WKB_MULTIPOLYGON, WKB_POINT, WKB_POLYGON, is_empty_ewkb, is_empty_part, read_ewkb
+from .import_tools import get_python_executable
+from .koodistot import KOODISTOT_SCHEMA, Koodistot, get_koodistot
 
 
 
@@ -478,6 +488,37 @@ TIME_PERIOD = "gml:TimePeriod"
 BEGIN_POSITION = "gml:beginPosition"
 END_POSITION = "gml:endPosition"
 REFERENCE_IDENTIFIER = "gml:identifier"
+GML_MULTI_POINT = "gml:MultiPoint"
+GML_MULTI_CURVE = "gml:MultiCurve"
+GML_MULTI_SURFACE = "gml:MultiSurface"
+GML_POINT_MEMBER = "gml:pointMember"
+GML_CURVE_MEMBER = "gml:curveMember"
+GML_SURFACE_MEMBER = "gml:surfaceMember"
+
+# GML elements of the WKB geometry types, and the elements of the members of the multi geometries.
+GML_GEOMETRY_TAGS = {
+    WKB_POINT: GML_POINT,
+    WKB_LINESTRING: GML_LINESTRING,
+    WKB_POLYGON: GML_POLYGON,
+    WKB_MULTIPOINT: GML_MULTI_POINT,
+    WKB_MULTILINESTRING: GML_MULTI_CURVE,
+    WKB_MULTIPOLYGON: GML_MULTI_SURFACE,
+}
+GML_MEMBER_TAGS = {
+    WKB_MULTIPOINT: (GML_POINT_MEMBER, WKB_POINT),
+    WKB_MULTILINESTRING: (GML_CURVE_MEMBER, WKB_LINESTRING),
+    WKB_MULTIPOLYGON: (GML_SURFACE_MEMBER, WKB_POLYGON),
+}
+
+# infrao:Sijainti child elements of the WKB geometry types
+SIJAINTI_GEOMETRY_TAGS = {
+    WKB_POINT: "infrao:piste",
+    WKB_MULTIPOINT: "infrao:piste",
+    WKB_LINESTRING: "infrao:viiva",
+    WKB_MULTILINESTRING: "infrao:viiva",
+    WKB_POLYGON: "infrao:alue",
+    WKB_MULTIPOLYGON: "infrao:alue",
+}
 
 
 TABLE_NAMES = [ #TODO: add other tables
@@ -549,6 +590,9 @@ SCHEMA_TABLE_NAMES = { #TODO: change order -> areas last?
     ("kohteet", "ymparistotaide"): INFRAO_YMPARISTOTAIDE_TAGS,
 }
 
+# Code list (koodistot) tables referred to by the enumeration columns of the exported tables.
+ENUMERATION_TABLES = sorted({tag[1].removeprefix("cid_") for tags in SCHEMA_TABLE_NAMES.values() for tag in tags.values() if tag[1].startswith("cid_")})
+
 AREA_NAMES = {
     "viheralueenosa": INFRAO_ABSTRACT_VARUSTE["KUULUUVIHERALUEENOSAAN"][0],
     "katualueenosa": INFRAO_ABSTRACT_VARUSTE["KUULUUKATUALUEENOSAAN"][0],
@@ -589,8 +633,28 @@ PLAN_LINK_TABLES = [
     "viheralueenosa",
 ]
 
+# Prefix of the address (osoite) columns joined to the exported features.
+ADDRESS_COLUMN_PREFIX = "OSOITE_"
+
+# Number of rows fetched at a time from the server-side cursor of an exported table.
+EXPORT_FETCH_SIZE = 2000
+
+# Format of the coordinates written to gml:pos and gml:posList elements, matching the 15 significant digits of ST_AsGML.
+COORDINATE_FORMAT = "{:.15g}"
+
+# to_char format of the xsd:dateTime values written to the document.
+XSD_DATETIME_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS'
+
+# Upper limit for the default number of tables exported in parallel, each using its own database connection.
+EXPORT_MAX_WORKERS = 4
+
+# Table the inserts, updates and deletes of the feature tables are logged to, see V1.2.0__muutosloki.sql.
+CHANGE_LOG_TABLE = ("meta", "muutosloki")
+
 LOGGER = logging.getLogger(plugin_name())
 
+_worker_state = {}
+
 def get_decree_attachments(conn_params: dict) -> dict:
     """
     Fetches and attaches decrees (päätös) and their attachments (liite) to the corresponding part of street area (katualueenosa).
@@ -667,69 +731,65 @@ def get_plan_link(conn_params: dict) -> dict:
     """
     Fetches all the plan link infromation (suunnitelmalinkkitieto) features and matches them with the features they belong to.
 
+    The plan links of all the tables are fetched with a single query and indexed by the fid of the feature they belong to.
+
     Args:
         conn_params (dict): Connection parameters to the postgis database.
 
     Returns:
-        dict: Table names are the keys. Value is a list of dictionaries with the suunnitelmalinkkitieto feature data.
+        dict: Table names are the keys. Values are dictionaries where the fids of the features are the keys and the values are lists of dictionaries with the suunnitelmalinkkitieto feature data.
     """
-    plan_links_dict = {}
-    for table in PLAN_LINK_TABLES:
-        plan_links_dict[table] = {}
-        with(psycopg2.connect(**conn_params)) as conn:
-            with conn.cursor(cursor_factory=DictCursor) as curs:
-                query = SQL('''SELECT {sl_alias}.{suunnitelmakohdeid},
-                    {sl_alias}.{fid_table},
-                    {l_alias}.{kuvaus},
-                    {l_alias}.{linkkiliitteeseen},
-                    {l_alias}.{muokkaushetki},
-                    {l_alias}.{versionumero}
-                    FROM {linkit}.{suunnitelmalinkki} AS {sl_alias}
-                    JOIN {linkit}.{liite} AS {l_alias} ON {sl_alias}.{fid_liite} = {l_alias}.{fid}''').format(
-                        sl_alias=Identifier("slinkki"),
-                        suunnitelmakohdeid=Identifier("suunnitelmakohdeid"),
-                        fid_table=Identifier(f"fid_{table}"),
-                        l_alias=Identifier("l"),
-                        kuvaus=Identifier("kuvaus"),
-                        linkkiliitteeseen=Identifier("linkkiliitteeseen"),
-                        muokkaushetki=Identifier("muokkaushetki"),
-                        versionumero=Identifier("versionumero"),
-                        suunnitelmalinkki=Identifier("suunnitelmalinkki"),
-                        linkit=Identifier("linkit"),
-                        liite=Identifier("liite"),
-                        fid_liite=Identifier("fid_liite"),
-                        fid = Identifier("fid"))
-                try:
-                    curs.execute(query)
-                    results = curs.fetchall()
-                    results_dict = []
-                    for row in results:
-                        row_dict = dict(row)
-                        if row_dict[f"fid_{table}"] is not None:
-                            results_dict.append(dict(row))
-                    plan_links_dict[table] = results_dict
-                except:
-                    pass
+    plan_links_dict = {table: {} for table in PLAN_LINK_TABLES}
+    with(psycopg2.connect(**conn_params)) as conn:
+        with conn.cursor(cursor_factory=DictCursor) as curs:
+            query = SQL('''SELECT {sl_alias}.{suunnitelmakohdeid},
+                {l_alias}.{kuvaus},
+                {l_alias}.{linkkiliitteeseen},
+                {l_alias}.{muokkaushetki},
+                {l_alias}.{versionumero},
+                {fid_tables}
+                FROM {linkit}.{suunnitelmalinkki} AS {sl_alias}
+                JOIN {linkit}.{liite} AS {l_alias} ON {sl_alias}.{fid_liite} = {l_alias}.{fid}''').format(
+                    sl_alias=Identifier("slinkki"),
+                    suunnitelmakohdeid=Identifier("suunnitelmakohdeid"),
+                    fid_tables=SQL(", ").join(Identifier("slinkki", f"fid_{table}") for table in PLAN_LINK_TABLES),
+                    l_alias=Identifier("l"),
+                    kuvaus=Identifier("kuvaus"),
+                    linkkiliitteeseen=Identifier("linkkiliitteeseen"),
+                    muokkaushetki=Identifier("muokkaushetki"),
+                    versionumero=Identifier("versionumero"),
+                    suunnitelmalinkki=Identifier("suunnitelmalinkki"),
+                    linkit=Identifier("linkit"),
+                    liite=Identifier("liite"),
+                    fid_liite=Identifier("fid_liite"),
+                    fid = Identifier("fid"))
+            curs.execute(query)
+            for row in curs:
+                row_dict = dict(row)
+                fids = {table: row_dict.pop(f"fid_{table}") for table in PLAN_LINK_TABLES}
+                for table, fid in fids.items():
+                    if fid is not None:
+                        plan_links_dict[table].setdefault(fid, []).append(row_dict)
     return plan_links_dict
 
 
-def get_area_identifiers(conn_params: dict) -> dict:
+def get_area_identifiers(conn_params: dict) -> Tuple[dict, dict]:
     """
     Fetches information about what area different features belong to.
 
+    The information is returned as two indexes per area table, so that both the area of a feature and the features of an area can be looked up directly by identifier.
+
     Args:
         conn_params (dict): Connection parameters to the postgis database.
 
     Returns:
-        dict: Area table names are the keys. Values is a list of dictionaries where the identifier key has the id of the area the features belongs to, and the rest of the keys are the tables whose features can belong to the area. Those keys' values is a list of the features ids.
+        Tuple[dict, dict]: Area memberships and area contents. In both, area table names are the keys. In the memberships the values map the identifier of a feature to the identifier of the area it belongs to. In the contents the values map the identifier of an area to a dictionary, where the tables whose features belong to the area are the keys and the lists of the features' identifiers are the values.
     """
-    results_dicts = {"viheralueenosa": [],
-                     "katualueenosa": [],
-                     "viheralue": [],
-                     "katualue": [],}
+    area_memberships = {}
+    area_contents = {}
     with(psycopg2.connect(**conn_params)) as conn:
         with conn.cursor(cursor_factory=DictCursor) as curs:
-            for key in results_dicts:
+            for key in AREA_NAMES:
                 if "osa" in key:
                     query = SQL("SELECT {}.{}, ").format(Identifier(key), Identifier("identifier"))
                     for i, (schema, table) in enumerate(TABLE_NAMES):
@@ -748,25 +808,218 @@ def get_area_identifiers(conn_params: dict) -> dict:
                     query = SQL("SELECT {}.{}, (SELECT array_agg({}.{}) FROM {}.{} WHERE {}.{} = {}.{}) AS {} FROM {}.{}").format(Identifier(key), Identifier("identifier"), Identifier(f"{key}enosa"), Identifier("identifier"), Identifier(key), Identifier(f"{key}enosa"), Identifier(f"{key}enosa"), Identifier(f"fid_{key}"), Identifier(key), Identifier("fid"), Identifier(f"{key}enosa"), Identifier(key), Identifier(key))
                 curs.execute(query)
                 results = curs.fetchall()
-                results_dict = []
+                memberships = {}
+                contents = {}
                 for row in results:
-                    results_dict.append(dict(row))
-                results_dicts[key] = results_dict
-    return results_dicts
+                    row_dict = dict(row)
+                    area_identifier = row_dict.pop("identifier")
+                    contents[area_identifier] = {table: identifiers for table, identifiers in row_dict.items() if identifiers is not None}
+                    for identifiers in contents[area_identifier].values():
+                        for identifier in identifiers:
+                            memberships.setdefault(identifier, area_identifier)
+                area_memberships[key] = memberships
+                area_contents[key] = contents
+    return area_memberships, area_contents
+
+
+def get_shipment_snapshots(conn_params: dict) -> Tuple[str, str]:
+    """
+    Fetches the database snapshot the last exported shipment (aineistotoimituksentiedot) was read in and the current snapshot of the database.
+
+    Args:
+        conn_params (dict): Connection parameters to the postgis database.
+
+    Returns:
+        Tuple[str, str]: The snapshot of the last exported shipment, or None if nothing has been exported, and the current snapshot. Both are None if the database has no change log (muutosloki), see V1.2.0__muutosloki.sql.
+    """
+    with(psycopg2.connect(**conn_params)) as conn:
+        with conn.cursor() as curs:
+            curs.execute(SQL("SELECT to_regclass({})").format(Literal(f"{CHANGE_LOG_TABLE[0]}.{CHANGE_LOG_TABLE[1]}")))
+            if curs.fetchone()[0] is None:
+                return None, None
+            query = SQL("SELECT (SELECT {tilanne}::text FROM {}.{} WHERE {viety} AND {tilanne} IS NOT NULL ORDER BY {id} DESC LIMIT 1), pg_current_snapshot()::text").format(
+                Identifier("meta"),
+                Identifier("aineistotoimituksentiedot"),
+                tilanne=Identifier("tilanne"),
+                viety=Identifier("viety"),
+                id=Identifier("id"))
+            curs.execute(query)
+            last_snapshot, snapshot = curs.fetchone()
+    return last_snapshot, snapshot
+
+
+def get_logged_after_condition(alias: str, snapshot: str) -> Composed:
+    """
+    Builds the condition selecting the change log rows written by transactions that were not visible in a snapshot.
+
+    Transactions older than the oldest transaction of the snapshot (its xmin) were all visible, so the condition can use the index of the change log.
+
+    Args:
+        alias (str): Alias of the change log table.
+        snapshot (str): The snapshot as text, see get_shipment_snapshots.
+
+    Returns:
+        Composed: The condition.
+    """
+    return SQL("{transaktio} >= pg_snapshot_xmin({snapshot}::pg_snapshot) AND NOT pg_visible_in_snapshot({transaktio}, {snapshot}::pg_snapshot)").format(
+        transaktio=Identifier(alias, "transaktio"),
+        snapshot=Literal(snapshot))
+
+
+def get_changed_condition(schema: str, table: str, snapshot: str) -> Composed:
+    """
+    Builds the condition selecting the features of a table that have changed after a snapshot of the database.
+
+    Inserts, updates and deletes are recorded in the change log (muutosloki) by triggers with the transaction that made
+    them, see V1.2.0__muutosloki.sql. A feature has changed if a transaction that was not visible in the snapshot of the
+    previous shipment inserted or updated it. Features changed while the previous shipment was being read are exported
+    again, but no change is missed. Deleted features are written as tombstones, see get_deleted_features.
+
+    Only the rows of the feature tables are logged, so changes to addresses, plan links or decrees alone do not export the
+    feature. The xlink references of the exported features (e.g. #Katualueenosa.x) point to areas that are not included
+    in the document unless they have changed too.
+
+    Args:
+        schema (str): The name of the table's schema.
+        table (str): The name of the table.
+        snapshot (str): The snapshot of the previous shipment, see get_shipment_snapshots.
+
+    Returns:
+        Composed: WHERE clause for a query with the table aliased as t.
+    """
+    return SQL(" WHERE {fid} IN (SELECT {log_fid} FROM {log_schema}.{log_table} AS {l} WHERE {l_schema} = {schema} AND {l_table} = {table} AND {logged_after})").format(
+        fid=Identifier("t", "fid"),
+        log_fid=Identifier("l", "fid"),
+        log_schema=Identifier(CHANGE_LOG_TABLE[0]),
+        log_table=Identifier(CHANGE_LOG_TABLE[1]),
+        l=Identifier("l"),
+        l_schema=Identifier("l", "skeema"),
+        l_table=Identifier("l", "taulu"),
+        schema=Literal(schema),
+        table=Literal(table),
+        logged_after=get_logged_after_condition("l", snapshot))
+
+
+def get_deleted_features(schema: str, table: str, conn_params: dict, snapshot: str) -> list:
+    """
+    Fetches the features of a table deleted after a snapshot of the database from the change log.
+
+    Features both added and deleted after the snapshot were never shipped and are left out.
+
+    Args:
+        schema (str): The name of the table's schema.
+        table (str): The name of the table.
+        conn_params (dict): Connection parameters to the postgis database.
+        snapshot (str): The snapshot of the previous shipment, see get_shipment_snapshots.
+
+    Returns:
+        list: Tuples of the identifier of each deleted feature and the time it was deleted, ordered by identifier.
+    """
+    query = SQL("""
+        SELECT DISTINCT ON ({l_identifier}) {l_identifier}, {l_time}
+            FROM {log_schema}.{log_table} AS {l}
+            WHERE {l_schema} = {schema} AND {l_table} = {table} AND {l_operation} = 'DELETE' AND {l_identifier} IS NOT NULL AND {logged_after}
+                AND NOT EXISTS (SELECT 1 FROM {schema_name}.{table_name} AS {t} WHERE {t_fid} = {l_fid} OR {t_identifier} = {l_identifier})
+                AND NOT EXISTS (
+                    SELECT 1 FROM {log_schema}.{log_table} AS {i}
+                    WHERE {i_schema} = {schema} AND {i_table} = {table} AND {i_fid} = {l_fid} AND {i_operation} = 'INSERT' AND {inserted_after})
+            ORDER BY {l_identifier}, {l_time} DESC
+    """).format(
+        log_schema=Identifier(CHANGE_LOG_TABLE[0]),
+        log_table=Identifier(CHANGE_LOG_TABLE[1]),
+        schema_name=Identifier(schema),
+        table_name=Identifier(table),
+        schema=Literal(schema),
+        table=Literal(table),
+        l=Identifier("l"),
+        t=Identifier("t"),
+        i=Identifier("i"),
+        l_schema=Identifier("l", "skeema"),
+        l_table=Identifier("l", "taulu"),
+        l_fid=Identifier("l", "fid"),
+        l_identifier=Identifier("l", "identifier"),
+        l_operation=Identifier("l", "toiminto"),
+        l_time=Identifier("l", "muutoshetki"),
+        t_fid=Identifier("t", "fid"),
+        t_identifier=Identifier("t", "identifier"),
+        i_schema=Identifier("i", "skeema"),
+        i_table=Identifier("i", "taulu"),
+        i_fid=Identifier("i", "fid"),
+        i_operation=Identifier("i", "toiminto"),
+        logged_after=get_logged_after_condition("l", snapshot),
+        inserted_after=get_logged_after_condition("i", snapshot))
+    with(psycopg2.connect(**conn_params)) as conn:
+        with conn.cursor() as curs:
+            curs.execute(query)
+            return curs.fetchall()
+
+
+def get_tombstone_element(table: str, identifier: str, deleted_at: datetime) -> ET.Element:
+    """
+    Creates the element telling the receiver that a feature has been deleted.
+
+    The element only has the identifier of the feature and its loppuHetki, the time the feature was deleted.
+
+    Args:
+        table (str): The name of the table.
+        identifier (str): Identifier of the deleted feature.
+        deleted_at (datetime): The time the feature was deleted.
+
+    Returns:
+        ET.Element: The feature element.
+    """
+    element_name = ELEMENT_NAMES[table]
+    feature = ET.Element(f"{CORE_NS}:{element_name}", {GML_ID: f"{element_name}.{identifier}"})
+    ET.SubElement(feature, INFRAO_ABSTRACT_PAIKKATIETOPALVELUKOHDE["YKSILOINTITIETO"][0]).text = identifier
+    ET.SubElement(feature, INFRAO_ABSTRACT_PAIKKATIETOPALVELUKOHDE["LOPPUHETKI"][0]).text = deleted_at.strftime('%Y-%m-%dT%H:%M:%S')
+    return feature
+
 
+class FeatureRow:
+    """
+    Values of a single exported feature.
+
+    The values are stored as a list and looked up by their column name through a column index shared by all the rows of a table, which keeps the rows small compared to a dictionary per feature.
+    """
+    __slots__ = ("columns", "values")
+
+    def __init__(self, columns: dict, values: list):
+        """
+        Args:
+            columns (dict): Column names of the table mapped to their positions in values.
+            values (list): Values of the feature.
+        """
+        self.columns = columns
+        self.values = values
+
+    def __getitem__(self, key: str):
+        return self.values[self.columns[key]]
 
-def get_table_values(schema: str, table: str, element_tags: dict, conn_params: dict) -> list:
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.columns)
+
+    def get(self, key: str, default=None):
+        index = self.columns.get(key)
+        return default if index is None else self.values[index]
+
+
+def get_table_values(schema: str, table: str, element_tags: dict, conn_params: dict, koodistot: Koodistot, fetch_size: int = EXPORT_FETCH_SIZE, snapshot: str = None) -> Iterator[FeatureRow]:
     """
     Fetches the values from a table.
 
+    The rows are read through a server-side cursor fetch_size rows at a time and yielded one by one, so the whole table is never loaded into memory. Codes of the enumeration columns are replaced with their descriptions (selite) from the code lists. If the table has addresses, the address (osoite) of each feature is joined to the same query and its values are returned in the columns prefixed with ADDRESS_COLUMN_PREFIX.
+
     Args:
         schema (str): The name of the table's schema.
         table (str): The name of the table.
         element_tags (str): Dictionary containing the XML tag name and corresponding column in the table.
         conn_params (dict): Connection parameters to the postgis database.
+        koodistot (Koodistot): Code lists of the database.
+        fetch_size (int): Number of rows fetched from the server at a time.
+        snapshot (str, optional): If given, only the features changed after this database snapshot are fetched, see get_changed_condition.
 
-    Returns:
-        list: A list of dictionaries. Each dictionary contains the values of a single feature.
+    Yields:
+        FeatureRow: The values of a single feature.
     """
     columns = []
     cids = []
@@ -774,332 +1027,757 @@ def get_table_values(schema: str, table: str, element_tags: dict, conn_params: d
         if v[1] == "skip":
             columns.append((SQL("0"), Identifier(k)))
         elif v[1].startswith("geom") or v[0] in LOCATION_TAGS:
-            columns.append((SQL("ST_AsGML(3, {}, options=>4)").format(Identifier(v[1])), Identifier(k)))
+            columns.append((SQL("ST_AsEWKB({})").format(Identifier("t", v[1])), Identifier(k)))
         elif v[1].startswith("cid_"):
-            columns.append((SQL("{}.{}").format(Identifier(v[1].removeprefix("cid_")), Identifier("selite")), Identifier(k)))
-            cids.append(v[1])
+            columns.append((Identifier("t", v[1]), Identifier(k)))
+            cids.append((k, v[1]))
         else:
-            columns.append((Identifier(v[1]), Identifier(k)))
-    values = []
-    with(psycopg2.connect(**conn_params)) as conn:
-        conn.autocommit = True
-        with conn.cursor() as curs:
+            columns.append((Identifier("t", v[1]), Identifier(k)))
+
+    join = SQL("")
+    if any(v[1] == "fid_osoite" for v in element_tags.values()):
+        for column in INFRAO_OSOITE_TAGS:
+            if column.startswith("geom_"):
+                columns.append((SQL("ST_AsEWKB({})").format(Identifier("os", column)), Identifier(ADDRESS_COLUMN_PREFIX + column.upper())))
+            else:
+                columns.append((Identifier("os", column), Identifier(ADDRESS_COLUMN_PREFIX + column.upper())))
+        join = SQL(" LEFT JOIN {} AS {} ON {} = {}").format(Identifier("osoite", "osoite"), Identifier("os"), Identifier("os", "fid"), Identifier("t", "fid_osoite"))
+    conn = psycopg2.connect(**conn_params)
+    try:
+        with conn.cursor(name=f"export_{table}") as curs:
+            curs.itersize = fetch_size
             select_columns = SQL(',').join(SQL("{} AS {}").format(col, alias) for col, alias in columns)
-            query = SQL("SELECT {} from {}.{}").format(select_columns, Identifier(schema), Identifier(table))
-            if cids != []:
-                joins = SQL(' ').join(SQL( "INNER JOIN {}.{} ON {}.{} = {}.{}").format(Identifier("koodistot"), Identifier(cid.removeprefix("cid_")), Identifier(table), Identifier(cid), Identifier(cid.removeprefix("cid_")), Identifier("cid")) for cid in cids)
-                query = query + joins
+            where = get_changed_condition(schema, table, snapshot) if snapshot is not None else SQL("")
+            query = SQL("SELECT {} from {}.{} AS {}{}{}").format(select_columns, Identifier(schema), Identifier(table), Identifier("t"), join, where)
             curs.execute(query)
-            results = curs.fetchall()
-            field_names = [field[0].upper() for field in curs.description]
-            for row in results:
-                feature_values = {}
-                for i, name in enumerate(field_names):
-                    feature_values[name] = row[i]
+            field_names = None
+            for row in curs:
+                if field_names is None:
+                    field_names = {field[0].upper(): i for i, field in enumerate(curs.description)}
+                    cid_indexes = [(field_names[name.upper()], cid) for name, cid in cids]
+                    meta_indexes = [i for name, i in field_names.items() if name.startswith('META_')]
+                    metatieto_index = field_names["METATIETO"]
+                feature_values = list(row)
+                for i, cid in cid_indexes:
+                    feature_values[i] = koodistot.selite(cid, feature_values[i])
+
+                feature_values[metatieto_index] = not all(feature_values[i] is None for i in meta_indexes)
+
+                yield FeatureRow(field_names, feature_values)
+    finally:
+        conn.close()
+
+
+def format_coordinates(coordinates: np.ndarray) -> str:
+    """
+    Formats coordinates as the text of a gml:pos or gml:posList element.
+
+    Args:
+        coordinates (np.ndarray): Array of shape (number of points, 2 or 3).
+
+    Returns:
+        str: The coordinates with at most 15 significant digits separated by spaces.
+    """
+    return " ".join(map(COORDINATE_FORMAT.format, coordinates.ravel().tolist()))
 
-                feature_values["METATIETO"] = not all(meta_value is None for meta_key, meta_value in feature_values.items() if meta_key.startswith('META_'))
 
-                values.append(feature_values)
-    return values
+def add_gml_geometry(parent: ET.Element, geometry_type: int, srid: int, parts: list, gml_id: str = None) -> ET.Element:
+    """
+    Adds a GML geometry element built directly from the coordinate arrays of a geometry.
 
+    Args:
+        parent (ET.Element): The element the geometry is added to.
+        geometry_type (int): WKB type of the geometry as returned by read_ewkb.
+        srid (int): Srid of the geometry, or None to leave out the srsName.
+        parts (list): Coordinate arrays of the geometry as returned by read_ewkb.
+        gml_id (str, optional): gml:id of the geometry.
 
-def add_address(sijainti_element: ET.Element, xml_tag: str, conn_params: dict, schema: str, table: str, value) -> None:
+    Returns:
+        ET.Element: The geometry element.
+    """
+    attribs = {}
+    if srid:
+        attribs["srsName"] = f"EPSG:{srid}"
+    if gml_id is not None:
+        attribs[GML_ID] = gml_id
+    geometry_element = ET.SubElement(parent, GML_GEOMETRY_TAGS[geometry_type], attribs)
+
+    if geometry_type in GML_MEMBER_TAGS:
+        member_tag, member_type = GML_MEMBER_TAGS[geometry_type]
+        for part in parts:
+            if not is_empty_part(part):
+                add_gml_geometry(ET.SubElement(geometry_element, member_tag), member_type, None, [part])
+        return geometry_element
+
+    rings = parts[0]
+    dimension = {"srsDimension": "3"} if rings[0].shape[1] == 3 else {}
+    if geometry_type == WKB_POINT:
+        ET.SubElement(geometry_element, GML_POS, dimension).text = format_coordinates(rings[0])
+    elif geometry_type == WKB_LINESTRING:
+        ET.SubElement(geometry_element, GML_POS_LIST, dimension).text = format_coordinates(rings[0])
+    else:
+        for i, ring in enumerate(rings):
+            ring_element = ET.SubElement(ET.SubElement(geometry_element, GML_EXTERIOR if i == 0 else GML_INTERIOR), GML_LINEAR_RING)
+            ET.SubElement(ring_element, GML_POS_LIST, dimension).text = format_coordinates(ring)
+    return geometry_element
+
+
+def add_address(sijainti_element: ET.Element, xml_tag: str, row: FeatureRow, feature_gml_id: str) -> None:
     """
     Adds address elements to an existing XML element.
 
     Args:
         sijainti_element (ET.Element): The XML element the function adds child elements to.
         xml_tag (str): The XML tag of the element currently being added.
-        conn_params (dict): Connection parameters to the postgis database.
-        schema (str): The name of the table's schema.
-        table (str): The name of the table.
-        value: The value of the element currently being iterated over.
+        row (FeatureRow): The values of the feature, including the joined address columns.
+        feature_gml_id (str): gml:id of the feature, from which the gml:ids of the address geometries are derived.
 
     Returns:
         None
     """
     c_osoitetieto = ET.SubElement(sijainti_element, xml_tag)
     c_osoite = ET.SubElement(c_osoitetieto, INFRAO_OSOITE)
-    with(psycopg2.connect(**conn_params)) as conn:
-        conn.autocommit = True
-        with conn.cursor(cursor_factory=DictCursor) as curs:
-            query = SQL("""
-                SELECT {kunta}, {osoitenumero}, {osoitenumero2}, {jakokirjain}, {jakokirjain2}, {porras}, {huoneisto}, {huoneistojakokirjain},
-                    {postinumero}, {postitoimipaikannimi},
-                    ST_AsGML(3, {osoite_alias}.{geom_point}, options=>4) AS geom_point,
-                    ST_AsGML(3, {osoite_alias}.{geom_poly}, options=>4) AS geom_poly,
-                    ST_AsGML(3, {osoite_alias}.{geom_line}, options=>4) AS geom_line,
-                    {viitesijaintialue}, {nimitieto}
-                FROM osoite.osoite AS {osoite_alias}
-                JOIN {schema}.{table} AS tb ON tb.fid_osoite = {osoite_alias}.fid
-                WHERE tb.fid_osoite = {param}
-            """).format(
-                kunta=Identifier('kunta'),
-                osoite_alias=Identifier('os'),
-                osoitenumero=Identifier('osoitenumero'),
-                osoitenumero2=Identifier('osoitenumero2'),
-                jakokirjain=Identifier('jakokirjain'),
-                jakokirjain2=Identifier('jakokirjain2'),
-                porras=Identifier('porras'),
-                huoneisto=Identifier('huoneisto'),
-                huoneistojakokirjain=Identifier('huoneistojakokirjain'),
-                postinumero=Identifier('postinumero'),
-                postitoimipaikannimi=Identifier('postitoimipaikannimi'),
-                viitesijaintialue=Identifier('viitesijaintialue'),
-                nimitieto=Identifier('nimitieto'),
-                geom_point=Identifier('geom_point'),
-                geom_poly=Identifier('geom_poly'),
-                geom_line=Identifier('geom_line'),
-                schema=Identifier(schema),
-                table=Identifier(table),
-                param=Placeholder()
-            )
-            parameter = [value]
-            curs.execute(query, parameter)
-            osoite_results = dict(curs.fetchone())
-            for osoite_key, osoite_value in osoite_results.items():
-                if osoite_value is not None:
-                    if osoite_key != "nimitieto" and not osoite_key.startswith("geom_"):
-                        c_osoite_element = ET.SubElement(c_osoite, INFRAO_OSOITE_TAGS[osoite_key])
-                        c_osoite_element.text = str(osoite_value)
-                    elif osoite_key == "nimitieto":
-                        c_nimitieto = ET.SubElement(c_osoite, INFRAO_OSOITE_TAGS[osoite_key])
-                        c_nimi = ET.SubElement(c_nimitieto, INFRAO_NIMI)
-                        c_teksti = ET.SubElement(c_nimi, "infrao:teksti")
-                        c_teksti.text = str(osoite_value)
-                    elif osoite_key.startswith("geom_"):
-                        raw_gml_string = osoite_value
-                        ns = f' xmlns:gml="{GML_NS_LINK}"'
-                        ET.register_namespace("gml", GML_NS_LINK)
-                        p = raw_gml_string.find('srs') - 1
-                        raw_gml_string = raw_gml_string[:p] + ns + raw_gml_string[p:]
-                        c_osoite_geom = ET.SubElement(c_osoite, INFRAO_OSOITE_TAGS[osoite_key])
-                        c_osoite_geom_element = ET.fromstring(raw_gml_string)
-                        c_osoite_geom_element.set("gml:id", str(f"id-{uuid.uuid4()}"))
-                        c_osoite_geom.append(c_osoite_geom_element)
-
-
-def add_elements(schema: str, table: str, element_tags: dict, gml_fm: ET.Element, areas_elements: dict, conn_params: dict, values: list, plan_links_dict: dict, decree_attachments: dict) -> None:
-    """
-    Main loop for iterating over the value dictionaries for each table and adding corresponding XML elements and their values.
+    for osoite_key, osoite_tag in INFRAO_OSOITE_TAGS.items():
+        osoite_value = row[ADDRESS_COLUMN_PREFIX + osoite_key.upper()]
+        if osoite_value is not None:
+            if osoite_key != "nimitieto" and not osoite_key.startswith("geom_"):
+                c_osoite_element = ET.SubElement(c_osoite, osoite_tag)
+                c_osoite_element.text = str(osoite_value)
+            elif osoite_key == "nimitieto":
+                c_nimitieto = ET.SubElement(c_osoite, osoite_tag)
+                c_nimi = ET.SubElement(c_nimitieto, INFRAO_NIMI)
+                c_teksti = ET.SubElement(c_nimi, "infrao:teksti")
+                c_teksti.text = str(osoite_value)
+            elif osoite_key.startswith("geom_") and not is_empty_ewkb(osoite_value):
+                c_osoite_geom = ET.SubElement(c_osoite, osoite_tag)
+                geometry_type, srid, parts, _ = read_ewkb(osoite_value)
+                add_gml_geometry(c_osoite_geom, geometry_type, srid, parts, f"{feature_gml_id}.osoite.{osoite_key}")
+
+
+class FeatureState:
+    """
+    The elements of the feature being emitted that the later columns of the feature add their elements to.
+
+    Attributes:
+        feature (ET.Element): The feature element.
+        gml_id (str): gml:id of the feature.
+        row (FeatureRow): The values of the feature.
+        sijainti (ET.Element): The last infrao:Sijainti element added to the feature.
+        metadata (ET.Element): The gml:GenericMetaData element of the feature, if it has metadata.
+        belonging_checked (bool): True once the areas the feature belongs to have been added.
+    """
+    __slots__ = ("feature", "gml_id", "row", "sijainti", "metadata", "belonging_checked")
+
+    def __init__(self, feature: ET.Element, gml_id: str, row: FeatureRow):
+        self.feature = feature
+        self.gml_id = gml_id
+        self.row = row
+        self.sijainti = None
+        self.metadata = None
+        self.belonging_checked = False
+
+
+class TableEmitter:
+    """
+    Emitter plan of a table, compiled once from the table's tags.
+
+    The columns of the table are compiled into an ordered list of (column index, handler) steps, so that emitting a row only calls the handlers of its non-empty values without inspecting the XML tags. A step without a column index is called for every row with all the values of the row.
+
+    Attributes:
+        table (str): The name of the table.
+        base_element (str): The XML tag of the table's features.
+        identifier_index (int): Column index of the feature identifier.
+        metatieto_index (int): Column index of the METATIETO flag, or None if the table has no metadata.
+        steps (list): The (column index, handler) steps of the table in the order of the tags.
+    """
+
+    def __init__(self, table: str, element_tags: dict, area_memberships: dict, area_contents: dict, plan_links_dict: dict, decree_attachments: dict):
+        """
+        Args:
+            table (str): The name of the table.
+            element_tags (str): Dictionary containing the XML tag name and corresponding column in the table.
+            area_memberships (dict): Area table names mapped to indexes from feature identifiers to the identifiers of the areas (katualue etc.) they belong to.
+            area_contents (dict): Area table names mapped to indexes from area identifiers to the identifiers of their features by table.
+            plan_links_dict (dict): Dictionary containing the corresponding suunnitelmalinkkitieto feature data for each element (if exists), indexed by table and fid.
+            decree_attachments (dict): A dictionary where the fids of katualueenosa feature are keys and the decree and their attachment information are the values as lists of dictionaries.
+        """
+        self.table = table
+        self.base_element = f"{CORE_NS}:{ELEMENT_NAMES[table]}"
+        self.area_memberships = area_memberships
+        self.area_contents = area_contents
+        self.table_plan_links = plan_links_dict.get(table, {})
+        self.decree_attachments = decree_attachments
+
+        # The columns of the rows are in the order of the tags, see get_table_values.
+        indexes = {key: i for i, key in enumerate(element_tags)}
+        self.identifier_index = indexes["YKSILOINTITIETO"]
+        self.metatieto_index = indexes.get("METATIETO")
+        fid_index = indexes.get("FID")
+
+        location_tag = next((k for k, v in element_tags.items() if v[0] in LOCATION_TAGS and not k.startswith("GEOM_")), None)
+        empty_geometry_indexes = None
+        if self.base_element not in [INFRAO_KESKILINJA, INFRAO_KATUALUEENOSA, INFRAO_VIHERALUEENOSA] and location_tag:
+            empty_geometry_indexes = [indexes[tag] for tag in ["GEOM_POINT", "GEOM_LINE", location_tag] if tag in indexes]
+
+        self.steps = []
+        for key, (xml_tag, column, *_) in element_tags.items():
+            index = indexes[key]
+            if xml_tag in LOCATION_TAGS:
+                if empty_geometry_indexes is not None:
+                    self.steps.append((None, partial(self.add_empty_geometry, xml_tag, empty_geometry_indexes)))
+                    empty_geometry_indexes = None
+                if self.base_element == INFRAO_KESKILINJA:
+                    self.steps.append((index, partial(self.add_geometry, xml_tag, column)))
+                else:
+                    self.steps.append((index, partial(self.add_sijainti, xml_tag, column)))
+            elif xml_tag in ["infrao:sijaintiepavarmuus", "infrao:luontitapa"]:
+                self.steps.append((index, partial(self.add_sijainti_value, xml_tag)))
+            elif xml_tag == "infrao:osoitetieto":
+                self.steps.append((index, partial(self.add_address, xml_tag)))
+            elif xml_tag in AREA_NAMES.values():
+                self.steps.append((index, self.add_area_memberships))
+            elif any(xml_tag in i for i in AREA_INCLUDED_NAMES.values()):
+                if "Kasvillisuus" in xml_tag:
+                    included_tables = ["puu", "muukasvi"]
+                elif "linja" in xml_tag:
+                    included_tables = ["keskilinja"]
+                else:
+                    included_tables = [name for name in ELEMENT_NAMES if name not in ["puu", "muukasvi", "keskilinja"]]
+                self.steps.append((index, partial(self.add_area_contents, xml_tag, included_tables)))
+            elif xml_tag == "infrao:suunnitelmalinkkitieto":
+                # The column itself is a placeholder, the plan links are looked up by fid.
+                self.steps.append((fid_index, partial(self.add_plan_links, xml_tag)))
+            elif xml_tag == "infrao:paatostieto":
+                self.steps.append((fid_index, partial(self.add_decrees, xml_tag)))
+            elif xml_tag in ["", "infrao:metatieto"] or xml_tag.startswith("infrao:sisaltaa") or xml_tag.startswith("infrao:kuuluu"):
+                continue
+            elif key.startswith("META_"):
+                self.steps.append((index, partial(self.add_metadata_value, xml_tag)))
+            elif xml_tag == "infrao:alkuHetki" or xml_tag == "infrao:loppuHetki":
+                self.steps.append((index, partial(self.add_datetime, xml_tag)))
+            elif "kytkin" in xml_tag.lower():
+                self.steps.append((index, partial(self.add_boolean, xml_tag)))
+            else:
+                self.steps.append((index, partial(self.add_value, xml_tag)))
+
+    def emit(self, row: FeatureRow) -> ET.Element:
+        """
+        Builds the feature element of a row.
+
+        Args:
+            row (FeatureRow): The values of the feature.
+
+        Returns:
+            ET.Element: The feature element.
+        """
+        values = row.values
+        gml_id = f"{self.base_element.removeprefix('infrao:')}.{values[self.identifier_index]}"
+        state = FeatureState(ET.Element(self.base_element, {GML_ID: gml_id}), gml_id, row)
+
+        if self.metatieto_index is not None and values[self.metatieto_index]:
+            io_metatieto = ET.SubElement(state.feature, "infrao:metatieto")
+            gml_metadataproperty = ET.SubElement(io_metatieto, "gml:metaDataProperty")
+            state.metadata = ET.SubElement(gml_metadataproperty, "gml:GenericMetaData")
+
+        for index, handler in self.steps:
+            if index is None:
+                handler(state, values)
+            else:
+                value = values[index]
+                if value is not None and value != "Tyhjä":
+                    handler(state, value)
+        return state.feature
+
+    def add_empty_geometry(self, xml_tag: str, geometry_indexes: list, state: FeatureState, values: list) -> None:
+        if all(values[i] is None or is_empty_ewkb(values[i]) for i in geometry_indexes):
+            c_base = ET.SubElement(state.feature, xml_tag)
+            state.sijainti = ET.SubElement(c_base, INFRAO_SIJAINTI)
+            c_empty = ET.SubElement(state.sijainti, "infrao:tyhjaGeometria")
+            ET.SubElement(c_empty, GML_NULL)
+
+    def add_geometry(self, xml_tag: str, column: str, state: FeatureState, value) -> None:
+        if is_empty_ewkb(value):
+            return
+        geometry_type, srid, parts, _ = read_ewkb(value)
+        c_base = ET.SubElement(state.feature, xml_tag)
+        add_gml_geometry(c_base, geometry_type, srid, parts, f"{state.gml_id}.{column}")
+
+    def add_sijainti(self, xml_tag: str, column: str, state: FeatureState, value) -> None:
+        if is_empty_ewkb(value):
+            return
+        geometry_type, srid, parts, _ = read_ewkb(value)
+        c_base = ET.SubElement(state.feature, xml_tag)
+        state.sijainti = ET.SubElement(c_base, INFRAO_SIJAINTI)
+        c_io_geom = ET.SubElement(state.sijainti, SIJAINTI_GEOMETRY_TAGS[geometry_type])
+        add_gml_geometry(c_io_geom, geometry_type, srid, parts, f"{state.gml_id}.{column}")
+
+    def add_sijainti_value(self, xml_tag: str, state: FeatureState, value) -> None:
+        if state.sijainti is not None:
+            ET.SubElement(state.sijainti, xml_tag).text = str(value)
+
+    def add_address(self, xml_tag: str, state: FeatureState, value) -> None:
+        if state.sijainti is not None:
+            add_address(state.sijainti, xml_tag, state.row, state.gml_id)
+
+    def add_area_memberships(self, state: FeatureState, value) -> None:
+        if state.belonging_checked:
+            return
+        state.belonging_checked = True
+        identifier = state.row.values[self.identifier_index]
+        for key, xml_tag in AREA_NAMES.items():
+            area_identifier = self.area_memberships[key].get(identifier)
+            if area_identifier is not None and area_identifier != identifier:
+                attribs = {
+                "xlink:type": "simple",
+                "xlink:href": f"#{key.capitalize()}.{area_identifier}"
+                }
+                ET.SubElement(state.feature, xml_tag, attribs)
+
+    def add_area_contents(self, xml_tag: str, included_tables: list, state: FeatureState, value) -> None:
+        identifier = state.row.values[self.identifier_index]
+        for key in AREA_NAMES:
+            area_content = self.area_contents[key].get(identifier)
+            if area_content is not None:
+                for member_table, member_identifiers in area_content.items():
+                    if member_table in included_tables:
+                        for member_identifier in member_identifiers:
+                            attribs = {
+                                "xlink:type": "simple",
+                                "xlink:href": f"#{ELEMENT_NAMES[member_table]}.{member_identifier}"
+                            }
+                            ET.SubElement(state.feature, xml_tag, attribs)
+
+    def add_plan_links(self, xml_tag: str, state: FeatureState, fid) -> None:
+        for plan_link_values in self.table_plan_links.get(fid, []):
+            attachment_created = False
+            c_plan_link_parent = ET.SubElement(state.feature, xml_tag)
+            c_plan_link_base = ET.SubElement(c_plan_link_parent, INFRAO_SUUNNITELMALINKKI)
+
+            for plan_key, plan_value in plan_link_values.items():
+                tag = INFRAO_SUUNNITELMALINKKI_TAGS[plan_key]
+
+                if not tag.endswith("_liite") and plan_value is not None:
+                    c_plan_link_element = ET.SubElement(c_plan_link_base, tag)
+                    c_plan_link_element.text = str(plan_value)
+                else:
+                    if not attachment_created:
+                        c_attachment_parent = ET.SubElement(c_plan_link_base, "infrao:liitetieto")
+                        c_attachment_base = ET.SubElement(c_attachment_parent, INFRAO_LIITE)
+                        attachment_created = True
+
+                    if plan_value is not None:
+                        tag_without_suffix = tag.removesuffix("_liite")
+                        c_attachment_element = ET.SubElement(c_attachment_base, tag_without_suffix)
+
+                        if not tag.startswith("infrao:muokkaus"):
+                            c_attachment_element.text = str(plan_value)
+                        else:
+                            c_attachment_element.text = plan_value.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def add_decrees(self, xml_tag: str, state: FeatureState, fid) -> None:
+        for item in self.decree_attachments.get(fid, []):
+            decree_grandparent = ET.SubElement(state.feature, xml_tag)
+            decree_parent = ET.SubElement(decree_grandparent, INFRAO_PAATOS)
+            for attachment in item[1:]:
+                attachment_grandparent = ET.SubElement(decree_parent, "infrao:liitetieto")
+                attachment_parent = ET.SubElement(attachment_grandparent, INFRAO_LIITE)
+                for l_key, l_value in attachment.items():
+                    if l_value is not None:
+                        attachment_element = ET.SubElement(attachment_parent, INFRAO_LIITE_TAGS[l_key.removeprefix("liite_")].removesuffix("_liite"))
+                        if l_key == "liite_muokkaushetki":
+                            attachment_element.text = l_value.strftime('%Y-%m-%dT%H:%M:%S')
+                        else:
+                            attachment_element.text = str(l_value)
+
+            for p_key, p_value in item[0].items():
+                if p_value is not None:
+                    decree_element = ET.SubElement(decree_parent, INFRAO_PAATOS_TAGS[p_key])
+                    decree_element.text = str(p_value)
+
+    def add_metadata_value(self, xml_tag: str, state: FeatureState, value) -> None:
+        if state.metadata is not None:
+            ET.SubElement(state.metadata, xml_tag).text = str(value)
+
+    def add_datetime(self, xml_tag: str, state: FeatureState, value) -> None:
+        ET.SubElement(state.feature, xml_tag).text = value.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def add_boolean(self, xml_tag: str, state: FeatureState, value) -> None:
+        ET.SubElement(state.feature, xml_tag).text = str(value).lower()
+
+    def add_value(self, xml_tag: str, state: FeatureState, value) -> None:
+        ET.SubElement(state.feature, xml_tag).text = str(value)
+
+
+def add_elements(table: str, element_tags: dict, area_memberships: dict, area_contents: dict, values: Iterator[FeatureRow], plan_links_dict: dict, decree_attachments: dict) -> Iterator[ET.Element]:
+    """
+    Main loop for iterating over the rows of a table and adding corresponding XML elements and their values.
+
+    The table's tags are compiled into a TableEmitter once, and the feature elements are yielded one at a time as soon as they are complete, so that they can be written to the file and released before the next feature is built.
 
     Args:
-        schema (str): The name of the table's schema.
         table (str): The name of the table.
         element_tags (str): Dictionary containing the XML tag name and corresponding column in the table.
-        gml_fm (ET.Element): The gml:featureMembers element child elements are added to.
-        areas_elements (dict): Dictionary containing which elements belong to are elements (katualue etc.)
-        conn_params (dict): Connection parameters to the postgis database.
-        values (list): List of dictionaries containing the values for each element being added.
-        plan_links_dict (dict): Dictionary containing the corresponding suunnitelmalinkkitieto feature data for each element (if exists).
+        area_memberships (dict): Area table names mapped to indexes from feature identifiers to the identifiers of the areas (katualue etc.) they belong to.
+        area_contents (dict): Area table names mapped to indexes from area identifiers to the identifiers of their features by table.
+        values (Iterator[FeatureRow]): The values of each element being added.
+        plan_links_dict (dict): Dictionary containing the corresponding suunnitelmalinkkitieto feature data for each element (if exists), indexed by table and fid.
         decree_attachments (dict): A dictionary where the fids of katualueenosa feature are keys and the decree and their attachment information are the values as lists of dictionaries.
-        
+
+    Yields:
+        ET.Element: The feature element of each row.
+    """
+    emitter = TableEmitter(table, element_tags, area_memberships, area_contents, plan_links_dict, decree_attachments)
+    for row in values:
+        yield emitter.emit(row)
+
+
+def get_xml_value(column: str, xml_tag: str) -> Composed:
+    """
+    Builds the SQL expression of a column's value as it is written to the XML document.
+
+    Args:
+        column (str): The column of the exported table (alias t).
+        xml_tag (str): The XML tag of the column.
+
     Returns:
-        None
+        Composed: The value as text, or NULL if the value is not exported.
+    """
+    if column.startswith("cid_"):
+        return SQL("NULLIF((SELECT {selite} FROM {koodisto} AS {k} WHERE {cid} = {column}), {empty})").format(
+            selite=Identifier("k", "selite"),
+            koodisto=Identifier(KOODISTOT_SCHEMA, column.removeprefix("cid_")),
+            k=Identifier("k"),
+            cid=Identifier("k", "cid"),
+            column=Identifier("t", column),
+            empty=Literal("Tyhjä"))
+    if xml_tag in ["infrao:alkuHetki", "infrao:loppuHetki"]:
+        return SQL("to_char({}, {})").format(Identifier("t", column), Literal(XSD_DATETIME_FORMAT))
+    if "kytkin" in xml_tag.lower():
+        return SQL("lower({}::text)").format(Identifier("t", column))
+    return SQL("NULLIF({}::text, {})").format(Identifier("t", column), Literal("Tyhjä"))
+
+
+def get_optional_xml_element(xml_tag: str, value: Composable) -> Composed:
+    """
+    Builds the SQL expression of an element that is left out when its value is NULL.
+
+    Args:
+        xml_tag (str): The XML tag of the element.
+        value (Composable): SQL expression of the element's text.
+
+    Returns:
+        Composed: The xmlelement expression.
     """
-    for n, o in globals().items():
-        if o is element_tags:
-            dict_name = n
-            break
-    base_element_name = dict_name[:-5]
-    base_element = globals()[base_element_name]
+    return SQL("CASE WHEN {value} IS NOT NULL THEN xmlelement(name {tag}, {value}) END").format(tag=Identifier(xml_tag), value=value)
 
-    location_tag = next(((k_, v_[0]) for k_, v_ in element_tags.items() if v_[0] in LOCATION_TAGS and not k_.startswith("GEOM_")), None)
 
-    if table in PLAN_LINK_TABLES:
-        table_plan_links = plan_links_dict[table]
+def get_gml_xml(geometry: Composable, gml_id: Composable) -> Composed:
+    """
+    Builds the SQL expression of a GML geometry element with a gml:id.
 
-    for i in range(len(values)):
-        empty_geometry = False
-        if base_element not in [INFRAO_KESKILINJA, INFRAO_KATUALUEENOSA, INFRAO_VIHERALUEENOSA]:
-            if location_tag:
-                empty_geometry = all(values[i].get(tag) is None for tag in ["GEOM_POINT", "GEOM_LINE", location_tag[0]])
+    Args:
+        geometry (Composable): SQL expression of the geometry.
+        gml_id (Composable): SQL expression of the gml:id of the geometry.
 
-        belonging_checked = False
-        location_created = False
+    Returns:
+        Composed: The geometry as xml.
+    """
+    return SQL("ST_AsGML(3, {}, 15, 4, {}, {})::xml").format(geometry, Literal("gml"), gml_id)
 
-        gml_id = {GML_ID:f"{base_element.removeprefix('infrao:')}.{values[i]['YKSILOINTITIETO']}"}
-        f = ET.SubElement(gml_fm, base_element, attrib=gml_id)
 
-        if values[i]["METATIETO"]:
-            io_metatieto = ET.SubElement(f, "infrao:metatieto")
-            gml_metadataproperty = ET.SubElement(io_metatieto, "gml:metaDataProperty")
-            gml_genericmetadata = ET.SubElement(gml_metadataproperty, "gml:GenericMetaData")
-        
-        for key in values[i]:
-            xml_tag = element_tags[key][0]
-            if xml_tag in LOCATION_TAGS and empty_geometry == True and not location_created:
-                location_created = True
-                c_base = ET.SubElement(f, xml_tag)
-                c_sij = ET.SubElement(c_base, INFRAO_SIJAINTI)
-                c_empty = ET.SubElement(c_sij, "infrao:tyhjaGeometria")
-                ET.SubElement(c_empty, GML_NULL)
-            if values[i][key] != NULL and values[i][key] != "Tyhjä":
-                if xml_tag in LOCATION_TAGS:
-                    if base_element == INFRAO_KESKILINJA:
-                        c_base = ET.SubElement(f, xml_tag)
-                        gml_string = values[i][key]
-                        ns = f' xmlns:gml="{GML_NS_LINK}"'
-                        ET.register_namespace("gml", GML_NS_LINK)
-                        p = gml_string.find('srs') -1
-                        gml_string = gml_string[:p] + ns + gml_string[p:]
-                        c_gml_geom = ET.fromstring(gml_string)
-                        c_gml_geom.set("gml:id", str(f"id-{uuid.uuid4()}"))
-                        #geom_gml_id = {GML_ID: str(uuid.uuid4())}
-                        c_base.append(c_gml_geom)
+def get_missing_geometry(geometry: Composable) -> Composed:
+    """
+    Builds the SQL condition of a missing geometry. Empty geometries are handled like NULLs, since they have no GML representation.
+
+    Args:
+        geometry (Composable): SQL expression of the geometry.
+
+    Returns:
+        Composed: Condition that is true if the geometry is NULL or empty.
+    """
+    return SQL("coalesce(ST_IsEmpty({}), TRUE)").format(geometry)
+
+
+def get_link_xml(xml_tag: str, element_name: str, identifier: Composable) -> Composed:
+    """
+    Builds the SQL expression of an xlink reference element to another feature.
+
+    Args:
+        xml_tag (str): The XML tag of the reference.
+        element_name (str): The element name of the referenced feature.
+        identifier (Composable): SQL expression of the identifier of the referenced feature.
+
+    Returns:
+        Composed: The xmlelement expression.
+    """
+    return SQL("xmlelement(name {tag}, xmlattributes({simple} AS {type}, {prefix} || {identifier} AS {href}))").format(
+        tag=Identifier(xml_tag),
+        simple=Literal("simple"),
+        type=Identifier("xlink:type"),
+        prefix=Literal(f"#{element_name}."),
+        identifier=identifier,
+        href=Identifier("xlink:href"))
+
+
+def get_attachment_xml(alias: str) -> Composed:
+    """
+    Builds the SQL expression of an infrao:liitetieto element from a row of linkit.liite.
+
+    Args:
+        alias (str): Alias of the linkit.liite table in the query.
+
+    Returns:
+        Composed: The xmlelement expression.
+    """
+    values = []
+    for column, xml_tag in INFRAO_LIITE_TAGS.items():
+        if column == "muokkaushetki":
+            value = SQL("to_char({}, {})").format(Identifier(alias, column), Literal(XSD_DATETIME_FORMAT))
+        else:
+            value = SQL("{}::text").format(Identifier(alias, column))
+        values.append(get_optional_xml_element(xml_tag.removesuffix("_liite"), value))
+    return SQL("xmlelement(name {}, xmlelement(name {}, xmlconcat({})))").format(Identifier("infrao:liitetieto"), Identifier(INFRAO_LIITE), SQL(", ").join(values))
+
+
+def get_area_member_tables(area_table: str) -> list:
+    """
+    Lists the tables whose features can belong to an area table.
+
+    Args:
+        area_table (str): Name of the area table (katualue etc.)
+
+    Returns:
+        list: Schema and table name tuples.
+    """
+    if "osa" in area_table:
+        return [(schema, table) for schema, table in TABLE_NAMES if not (area_table == "viheralueenosa" and table == "keskilinja")]
+    return [(area_table, f"{area_table}enosa")]
+
+
+def get_table_xml_query(schema: str, table: str, element_tags: dict, snapshot: str = None) -> Composed:
+    """
+    Builds the query producing the complete XML of each feature of a table in the database.
+
+    The query produces the same elements as add_elements with xmlelement, xmlconcat and xmlagg. The code list descriptions, addresses, area references, plan links and decrees are read with joins and subqueries, and the geometries are written by ST_AsGML with deterministic gml:ids.
+
+    Args:
+        schema (str): The name of the table's schema.
+        table (str): The name of the table.
+        element_tags (str): Dictionary containing the XML tag name and corresponding column in the table.
+        snapshot (str, optional): If given, only the features changed after this database snapshot are selected, see get_changed_condition.
+
+    Returns:
+        Composed: Query returning the XML of a feature as text on each row.
+    """
+    element_name = ELEMENT_NAMES[table]
+    identifier = Identifier("t", "identifier")
+    columns = [v[1] for v in element_tags.values()]
+
+    location_keys = [k for k, v in element_tags.items() if v[0] in LOCATION_TAGS]
+    location_tag = next((k for k in location_keys if not k.startswith("GEOM_")), None)
+    check_empty_geometry = table not in ["keskilinja", "katualueenosa", "viheralueenosa"] and location_tag is not None
+    empty_geometry = SQL(" AND ").join(get_missing_geometry(Identifier("t", element_tags[k][1])) for k in ["GEOM_POINT", "GEOM_LINE", location_tag] if k in element_tags)
+
+    sijainti_children = []
+    join = SQL("")
+    for k, v in element_tags.items():
+        if v[0] in ["infrao:sijaintiepavarmuus", "infrao:luontitapa"]:
+            sijainti_children.append(get_optional_xml_element(v[0], get_xml_value(v[1], v[0])))
+        elif v[0] == "infrao:osoitetieto":
+            address_values = []
+            for osoite_key, osoite_tag in INFRAO_OSOITE_TAGS.items():
+                osoite_column = Identifier("os", osoite_key)
+                if osoite_key.startswith("geom_"):
+                    address_values.append(SQL("CASE WHEN NOT {missing} THEN xmlelement(name {tag}, {gml}) END").format(
+                        missing=get_missing_geometry(osoite_column),
+                        tag=Identifier(osoite_tag),
+                        gml=get_gml_xml(osoite_column, SQL("{} || {} || {}").format(Literal(f"{element_name}."), identifier, Literal(f".osoite.{osoite_key}")))))
+                elif osoite_key == "nimitieto":
+                    address_values.append(SQL("CASE WHEN {column} IS NOT NULL THEN xmlelement(name {tag}, xmlelement(name {nimi}, xmlelement(name {teksti}, {column}::text))) END").format(
+                        column=osoite_column, tag=Identifier(osoite_tag), nimi=Identifier(INFRAO_NIMI), teksti=Identifier("infrao:teksti")))
+                else:
+                    address_values.append(get_optional_xml_element(osoite_tag, SQL("{}::text").format(osoite_column)))
+            sijainti_children.append(SQL("CASE WHEN {fid_osoite} IS NOT NULL THEN xmlelement(name {tag}, xmlelement(name {osoite}, xmlconcat({values}))) END").format(
+                fid_osoite=Identifier("t", v[1]), tag=Identifier(v[0]), osoite=Identifier(INFRAO_OSOITE), values=SQL(", ").join(address_values)))
+            join = SQL(" LEFT JOIN {} AS {} ON {} = {}").format(Identifier("osoite", "osoite"), Identifier("os"), Identifier("os", "fid"), Identifier("t", v[1]))
+    sijainti_children = SQL("xmlconcat({})").format(SQL(", ").join(sijainti_children)) if sijainti_children else SQL("NULL::xml")
+
+    meta_columns = [(v[0], v[1]) for k, v in element_tags.items() if k.startswith("META_")]
+    elements = []
+    if meta_columns:
+        elements.append(SQL("CASE WHEN NOT ({all_null}) THEN xmlelement(name {metatieto}, xmlelement(name {property}, xmlelement(name {metadata}, xmlconcat({values})))) END").format(
+            all_null=SQL(" AND ").join(SQL("{} IS NULL").format(Identifier("t", column)) for _, column in meta_columns),
+            metatieto=Identifier("infrao:metatieto"),
+            property=Identifier("gml:metaDataProperty"),
+            metadata=Identifier("gml:GenericMetaData"),
+            values=SQL(", ").join(get_optional_xml_element(xml_tag, get_xml_value(column, xml_tag)) for xml_tag, column in meta_columns)))
+
+    area_references_added = False
+    for k, v in element_tags.items():
+        xml_tag, column = v[0], v[1]
+        if xml_tag in LOCATION_TAGS:
+            geometry = Identifier("t", column)
+            if check_empty_geometry and k == location_keys[0]:
+                elements.append(SQL("CASE WHEN {empty} THEN xmlelement(name {tag}, xmlelement(name {sijainti}, xmlconcat(xmlelement(name {tyhja}, xmlelement(name {null})), {children}))) END").format(
+                    empty=empty_geometry, tag=Identifier(xml_tag), sijainti=Identifier(INFRAO_SIJAINTI), tyhja=Identifier("infrao:tyhjaGeometria"), null=Identifier(GML_NULL), children=sijainti_children))
+            gml = get_gml_xml(geometry, SQL("{} || {} || {}").format(Literal(f"{element_name}."), identifier, Literal(f".{column}")))
+            if table == "keskilinja":
+                elements.append(SQL("CASE WHEN NOT {missing} THEN xmlelement(name {tag}, {gml}) END").format(missing=get_missing_geometry(geometry), tag=Identifier(xml_tag), gml=gml))
+            else:
+                later_geometries = [Identifier("t", element_tags[later][1]) for later in location_keys[location_keys.index(k) + 1:]]
+                last_geometry = SQL(" AND ").join(get_missing_geometry(later) for later in later_geometries) if later_geometries else SQL("TRUE")
+                elements.append(SQL("""CASE WHEN NOT {missing} THEN xmlelement(name {tag}, xmlelement(name {sijainti}, xmlconcat(
+                    CASE ST_Dimension({geometry}) WHEN 0 THEN xmlelement(name {piste}, {gml}) WHEN 1 THEN xmlelement(name {viiva}, {gml}) ELSE xmlelement(name {alue}, {gml}) END,
+                    CASE WHEN {last_geometry} THEN {children} END))) END""").format(
+                    missing=get_missing_geometry(geometry), geometry=geometry, tag=Identifier(xml_tag), sijainti=Identifier(INFRAO_SIJAINTI), gml=gml, last_geometry=last_geometry, children=sijainti_children,
+                    piste=Identifier("infrao:piste"), viiva=Identifier("infrao:viiva"), alue=Identifier("infrao:alue")))
+        elif xml_tag in AREA_NAMES.values():
+            if not area_references_added:
+                area_references_added = True
+                for area_table, area_tag in AREA_NAMES.items():
+                    if f"fid_{area_table}" in columns:
+                        elements.append(SQL("(SELECT {link} FROM {area} AS {a} WHERE {fid} = {area_fid} AND {area_identifier} IS DISTINCT FROM {identifier})").format(
+                            link=get_link_xml(area_tag, area_table.capitalize(), Identifier("a", "identifier")),
+                            area=Identifier(area_table.removesuffix("enosa"), area_table),
+                            a=Identifier("a"),
+                            fid=Identifier("a", "fid"),
+                            area_fid=Identifier("t", f"fid_{area_table}"),
+                            area_identifier=Identifier("a", "identifier"),
+                            identifier=identifier))
+        elif any(xml_tag in i for i in AREA_INCLUDED_NAMES.values()):
+            if table in AREA_NAMES:
+                for member_schema, member_table in get_area_member_tables(table):
+                    if "Kasvillisuus" in xml_tag:
+                        included = member_table in ["puu", "muukasvi"]
+                    elif "linja" in xml_tag:
+                        included = member_table == "keskilinja"
                     else:
-                        c_base = ET.SubElement(f, xml_tag)
-                        c_sij = ET.SubElement(c_base, INFRAO_SIJAINTI)
-                        gml_string = values[i][key]
-                        ns = f' xmlns:gml="{GML_NS_LINK}"'
-                        ET.register_namespace("gml", GML_NS_LINK)
-                        p = gml_string.find('srs') - 1
-                        gml_string = gml_string[:p] + ns + gml_string[p:]
-                        tags = {"Point": "infrao:piste", "LineString": "infrao:viiva", "Polygon": "infrao:alue"}
-                        for gml_geom, io_geom in tags.items():
-                            if gml_geom in gml_string:
-                                c_io_geom = ET.SubElement(c_sij, io_geom)
-                        c_gml_geom = ET.fromstring(gml_string)
-                        c_gml_geom.set("gml:id", str(f"id-{uuid.uuid4()}"))
-                        c_io_geom.append(c_gml_geom)
-                elif xml_tag in ["infrao:sijaintiepavarmuus", "infrao:luontitapa"]:
-                    c_sij_c = ET.SubElement(c_sij, xml_tag)
-                    c_sij_c.text = str(values[i][key])
-                elif xml_tag == "infrao:osoitetieto":
-                    add_address(c_sij, xml_tag, conn_params, schema, table, values[i][key])
-                elif xml_tag in AREA_NAMES.values() and belonging_checked == 0:
-                    belonging_checked = True
-                    for key, value in AREA_NAMES.items():
-                        find_dict = next((d for d in areas_elements[key] if any(lst and values[i]["YKSILOINTITIETO"] in lst for lst in d.values())), None)
-                        if find_dict:
-                            if find_dict['identifier'] != values[i]["YKSILOINTITIETO"]:
-                                attribs = {
-                                "xlink:type": "simple",
-                                "xlink:href": f"#{key.capitalize()}.{find_dict['identifier']}"
-                                }
-                                ET.SubElement(f, value, attribs)
-                elif any(xml_tag in i for i in AREA_INCLUDED_NAMES.values()):
-                    for key, value in AREA_NAMES.items():
-                        find_dict = next((dict_item for dict_item in areas_elements[key] if dict_item.get('identifier') == values[i]['YKSILOINTITIETO']), None)
-                        if find_dict is not None:
-                            for k, v in find_dict.items():
-                                if v == None or k == "identifier":
-                                    pass
-                                else:
-                                    for fi in find_dict[k]:
-                                        attribs = {
-                                            "xlink:type": "simple",
-                                            "xlink:href": f"#{ELEMENT_NAMES[k]}.{fi}"
-                                        }
-                                        if "Kasvillisuus" in xml_tag:
-                                            if k in ["puu", "muukasvi"]:
-                                                ET.SubElement(f, xml_tag, attribs)
-                                        elif "linja" in xml_tag:
-                                            if k == "keskilinja":
-                                                ET.SubElement(f, xml_tag, attribs)
-                                        else:
-                                            if k not in ["puu", "muukasvi", "keskilinja"]:
-                                                ET.SubElement(f, xml_tag, attribs)
-                elif xml_tag.startswith("infrao:sisaltaa"):
-                    pass
-                elif xml_tag == "infrao:suunnitelmalinkkitieto":
-                    plan_links_values = [p for p in table_plan_links if p.get(f'fid_{table}') == values[i]["FID"]]
-
-                    if plan_links_values:
-                        for plan_link_values in plan_links_values:
-                            attachment_created = False
-                            c_plan_link_parent = ET.SubElement(f, xml_tag)
-                            c_plan_link_base = ET.SubElement(c_plan_link_parent, "infrao:Suunnitelmalinkki")
-                            
-                            for plan_key, plan_value in plan_link_values.items():
-                                if plan_key.startswith("fid"):
-                                    continue
-                                
-                                tag = INFRAO_SUUNNITELMALINKKI_TAGS[plan_key]
-                                
-                                if not tag.endswith("_liite") and plan_value is not None:
-                                    c_plan_link_element = ET.SubElement(c_plan_link_base, tag)
-                                    c_plan_link_element.text = str(plan_value)
-                                else:
-                                    if not attachment_created:
-                                        c_attachment_parent = ET.SubElement(c_plan_link_base, "infrao:liitetieto")
-                                        c_attachment_base = ET.SubElement(c_attachment_parent, "infrao:Liite")
-                                        attachment_created = True
-                                        
-                                    if plan_value is not None:
-                                        tag_without_suffix = tag.removesuffix("_liite")
-                                        c_attachment_element = ET.SubElement(c_attachment_base, tag_without_suffix)
-                                        
-                                        if not tag.startswith("infrao:muokkaus"):
-                                            c_attachment_element.text = str(plan_value)
-                                        else:
-                                            xsdt_str = plan_value.strftime('%Y-%m-%dT%H:%M:%S')
-                                            c_attachment_element.text = xsdt_str
-                elif xml_tag == "infrao:paatostieto":
-                    decrees_and_their_attachments = decree_attachments.get(values[i]["FID"])
-                    if decrees_and_their_attachments:
-                        for item in decrees_and_their_attachments:
-                            decree_grandparent = ET.SubElement(f, xml_tag)
-                            decree_parent = ET.SubElement(decree_grandparent, "infrao:Paatos")
-                            if len(item) > 1:
-                                for attachment in item[1:]:
-                                    attachment_grandparent = ET.SubElement(decree_parent, "infrao:liitetieto")
-                                    attachment_parent = ET.SubElement(attachment_grandparent, INFRAO_LIITE)
-                                    for l_key, l_value in attachment.items():
-                                        if l_value is not None:
-                                            attachment_element = ET.SubElement(attachment_parent, INFRAO_LIITE_TAGS[l_key.removeprefix("liite_")].removesuffix("_liite"))
-                                            if l_key == "liite_muokkaushetki":
-                                                xsdt_str = l_value.strftime('%Y-%m-%dT%H:%M:%S')
-                                                attachment_element.text = xsdt_str
-                                            else:
-                                                attachment_element.text = str(l_value)
-
-                            for p_key, p_value in item[0].items():
-                                if p_value is not None:
-                                    decree_element = ET.SubElement(decree_parent, INFRAO_PAATOS_TAGS[p_key])
-                                    decree_element.text = str(p_value)
-                elif xml_tag == "":
-                    pass
-                elif xml_tag == "infrao:metatieto":
-                    pass
-                elif key.startswith("META_"):
-                    if values[i]["METATIETO"]:
-                        meta_element = ET.SubElement(gml_genericmetadata, xml_tag)
-                        meta_element.text = str(values[i][key])
-                elif xml_tag == "infrao:alkuHetki" or xml_tag == "infrao:loppuHetki":
-                    c_base = ET.SubElement(f, xml_tag)
-                    date_time = values[i][key]
-                    xsdt_str = date_time.strftime('%Y-%m-%dT%H:%M:%S')
-                    c_base.text = xsdt_str
-                elif "kytkin" in xml_tag.lower():
-                    c_base = ET.SubElement(f, xml_tag)
-                    c_base.text = str(values[i][key]).lower()
-                elif not xml_tag.startswith("infrao:kuuluu"):
-                    c_base = ET.SubElement(f, xml_tag)
-                    c_base.text = str(values[i][key])
-
-
-def add_shipment_information(root: ET.Element, shipment_information: dict, conn_params: dict) -> None:
-    """
-    Adds shipment information (infrao:toimituksentiedot) elements to the XML root element.
+                        included = member_table not in ["puu", "muukasvi", "keskilinja"]
+                    if included:
+                        elements.append(SQL("(SELECT xmlagg({link}) FROM {member} AS {m} WHERE {member_fid} = {fid} AND {member_identifier} IS NOT NULL)").format(
+                            link=get_link_xml(xml_tag, ELEMENT_NAMES[member_table], Identifier("m", "identifier")),
+                            member=Identifier(member_schema, member_table),
+                            m=Identifier("m"),
+                            member_fid=Identifier("m", f"fid_{table}"),
+                            fid=Identifier("t", "fid"),
+                            member_identifier=Identifier("m", "identifier")))
+        elif xml_tag == "infrao:suunnitelmalinkkitieto":
+            if table in PLAN_LINK_TABLES:
+                elements.append(SQL("""(SELECT xmlagg(xmlelement(name {tag}, xmlelement(name {suunnitelmalinkki}, xmlconcat({kohdeid}, {attachment}))))
+                    FROM {linkit}.{suunnitelmalinkki_table} AS {sl} JOIN {linkit}.{liite} AS {l} ON {fid_liite} = {liite_fid} WHERE {fid_table} = {fid})""").format(
+                    tag=Identifier(xml_tag),
+                    suunnitelmalinkki=Identifier(INFRAO_SUUNNITELMALINKKI),
+                    kohdeid=get_optional_xml_element(INFRAO_SUUNNITELMALINKKI_TAGS["suunnitelmakohdeid"], SQL("{}::text").format(Identifier("sl", "suunnitelmakohdeid"))),
+                    attachment=get_attachment_xml("l"),
+                    linkit=Identifier("linkit"),
+                    suunnitelmalinkki_table=Identifier("suunnitelmalinkki"),
+                    sl=Identifier("sl"),
+                    liite=Identifier("liite"),
+                    l=Identifier("l"),
+                    fid_liite=Identifier("sl", "fid_liite"),
+                    liite_fid=Identifier("l", "fid"),
+                    fid_table=Identifier("sl", f"fid_{table}"),
+                    fid=Identifier("t", "fid")))
+        elif xml_tag == "infrao:paatostieto":
+            elements.append(SQL("""(SELECT xmlagg(xmlelement(name {tag}, xmlelement(name {paatos}, xmlconcat(
+                    (SELECT xmlagg({attachment}) FROM {linkit}.{liite} AS {l} WHERE {id_paatos} = {paatos_id}), {kuvaus}, {paivamaara}))))
+                FROM {linkit}.{paatos_table} AS {p} WHERE {fid_katualueenosa} = {fid})""").format(
+                tag=Identifier(xml_tag),
+                paatos=Identifier(INFRAO_PAATOS),
+                attachment=get_attachment_xml("l"),
+                linkit=Identifier("linkit"),
+                liite=Identifier("liite"),
+                l=Identifier("l"),
+                id_paatos=Identifier("l", "id_paatos"),
+                paatos_id=Identifier("p", "id"),
+                kuvaus=get_optional_xml_element(INFRAO_PAATOS_TAGS["paatos_kuvaus"], SQL("{}::text").format(Identifier("p", "kuvaus"))),
+                paivamaara=get_optional_xml_element(INFRAO_PAATOS_TAGS["paatos_paivamaarapvm"], SQL("{}::text").format(Identifier("p", "paivamaarapvm"))),
+                paatos_table=Identifier("paatos"),
+                p=Identifier("p"),
+                fid_katualueenosa=Identifier("p", "fid_katualueenosa"),
+                fid=Identifier("t", "fid")))
+        elif column == "skip" or xml_tag in ["", "infrao:metatieto", "infrao:sijaintiepavarmuus", "infrao:luontitapa", "infrao:osoitetieto"] or k.startswith("META_") or xml_tag.startswith("infrao:sisaltaa") or xml_tag.startswith("infrao:kuuluu"):
+            continue
+        else:
+            elements.append(get_optional_xml_element(xml_tag, get_xml_value(column, xml_tag)))
+
+    return SQL("SELECT xmlelement(name {element}, xmlattributes({gml_id} AS {id}), xmlconcat({elements}))::text FROM {schema}.{table} AS {t}{join}{where}").format(
+        element=Identifier(f"{CORE_NS}:{element_name}"),
+        gml_id=SQL("{} || {}").format(Literal(f"{element_name}."), identifier),
+        id=Identifier(GML_ID),
+        elements=SQL(", ").join(elements),
+        schema=Identifier(schema),
+        table=Identifier(table),
+        t=Identifier("t"),
+        join=join,
+        where=get_changed_condition(schema, table, snapshot) if snapshot is not None else SQL(""))
+
+
+def write_table_xml(schema: str, table: str, element_tags: dict, conn_params: dict, writer: "GmlWriter", fetch_size: int = EXPORT_FETCH_SIZE, snapshot: str = None) -> None:
+    """
+    Writes the features of a table as XML built by the database.
 
     Args:
-        root (ET.Element): The root element of the XML document (infrao:InfraoKohteet).
-        shipment_information (dict): Dictionary containing the shipment information.
+        schema (str): The name of the table's schema.
+        table (str): The name of the table.
+        element_tags (str): Dictionary containing the XML tag name and corresponding column in the table.
         conn_params (dict): Connection parameters to the postgis database.
+        writer (GmlWriter): The writer of the document.
+        fetch_size (int): Number of features fetched from the server at a time.
+        snapshot (str, optional): If given, only the features changed after this database snapshot are written.
 
     Returns:
         None
     """
-    shipment_information_grandparent = ET.SubElement(root, "infrao:toimituksentiedot")
+    conn = psycopg2.connect(**conn_params)
+    try:
+        with conn.cursor(name=f"export_xml_{table}") as curs:
+            curs.itersize = fetch_size
+            curs.execute(get_table_xml_query(schema, table, element_tags, snapshot))
+            for row in curs:
+                writer.write_text(row[0])
+    finally:
+        conn.close()
+
+
+def get_shipment_information_element(shipment_information: dict) -> ET.Element:
+    """
+    Creates the shipment information (infrao:toimituksentiedot) element.
+
+    Args:
+        shipment_information (dict): Dictionary containing the shipment information.
+
+    Returns:
+        ET.Element: The infrao:toimituksentiedot element.
+    """
+    shipment_information_grandparent = ET.Element("infrao:toimituksentiedot")
     shipment_information_parent = ET.SubElement(shipment_information_grandparent, "infrao:Toimitus")
 
     for key, value in shipment_information.items():
         if value:
             shipment_information_element = ET.SubElement(shipment_information_parent, INFRAO_AINEISTOTOIMITUKSEN_TIEDOT[key])
             shipment_information_element.text = value
+    return shipment_information_grandparent
+
 
-    shipment_information["viety"] = True
+def store_shipment_information(shipment_information: dict, conn_params: dict, snapshot: str = None, exported: bool = True) -> None:
+    """
+    Stores the shipment information of a written document to the database.
+
+    Only shipments stored as exported (viety) are used as the starting point of the next export of changes, see get_shipment_snapshots.
+
+    Args:
+        shipment_information (dict): Dictionary containing the shipment information.
+        conn_params (dict): Connection parameters to the postgis database.
+        snapshot (str, optional): The database snapshot taken before the exported features were read, stored as the state of the shipment (tilanne). The next export of changes exports the features changed after it.
+        exported (bool): False if some of the tables could not be exported, in which case the shipment is not used by the next export of changes.
+
+    Returns:
+        None
+    """
+    shipment_information = dict(shipment_information, viety=exported)
+    if snapshot is not None:
+        shipment_information["tilanne"] = snapshot
 
     with(psycopg2.connect(**conn_params)) as conn:
         conn.autocommit = True
@@ -1111,53 +1789,296 @@ def add_shipment_information(root: ET.Element, shipment_information: dict, conn_
                         SQL(', ').join(Placeholder() * len(shipment_information.keys()))
             )                          
             curs.execute(query, list(shipment_information.values()))
-            
-    
-def xml_export(conn_params: dict, save_file: str, shipment_information: dict) -> None:
+
+
+class GmlWriter:
     """
-    Adds the needed root elements and runs the relevant functions iteratively for each table.
-    
+    Writes the exported GML document incrementally.
+
+    The root and gml:featureMembers start tags are written first, after which each feature is serialised and written as soon as it is complete. Only the feature currently being written is kept in memory.
+    """
+
+    def __init__(self, stream: IO[str], pretty_print: bool = True):
+        """
+        Args:
+            stream (IO[str]): Text stream the document is written to.
+            pretty_print (bool): Whether the elements are indented with tabs like ET.indent would indent the whole document.
+        """
+        self.stream = stream
+        self.pretty_print = pretty_print
+
+    def write_start(self, namespaces: dict) -> None:
+        """
+        Writes the XML declaration and the start tags of the root and gml:featureMembers elements.
+
+        Args:
+            namespaces (dict): Namespace and schema location attributes of the root element.
+        """
+        attributes = "".join(f" {name}={quoteattr(value)}" for name, value in namespaces.items())
+        self.stream.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        self.stream.write(f"<{INFRAO_KOHTEET}{attributes}>")
+        self.stream.write(f"\n\t<{GML_FEATURE_MEMBERS}>" if self.pretty_print else f"<{GML_FEATURE_MEMBERS}>")
+
+    def write_element(self, element: ET.Element, level: int = 2) -> None:
+        """
+        Serialises an element and writes it to the stream.
+
+        Args:
+            element (ET.Element): The element to write.
+            level (int): Depth of the element in the document, used for the indentation.
+        """
+        if self.pretty_print:
+            ET.indent(element, space="\t", level=level)
+        self.write_text(ET.tostring(element, encoding="unicode"), level)
+
+    def write_text(self, text: str, level: int = 2) -> None:
+        """
+        Writes an already serialised element to the stream.
+
+        Args:
+            text (str): The serialised element.
+            level (int): Depth of the element in the document, used for the indentation.
+        """
+        if self.pretty_print:
+            self.stream.write("\n" + "\t" * level)
+        self.stream.write(text)
+
+    def write_end(self, shipment_information_element: ET.Element = None) -> None:
+        """
+        Closes the gml:featureMembers element, writes the shipment information and closes the root element.
+
+        Args:
+            shipment_information_element (ET.Element, optional): The infrao:toimituksentiedot element.
+        """
+        if self.pretty_print:
+            self.stream.write("\n\t")
+        self.stream.write(f"</{GML_FEATURE_MEMBERS}>")
+        if shipment_information_element is not None:
+            self.write_element(shipment_information_element, level=1)
+        self.stream.write(f"\n</{INFRAO_KOHTEET}>" if self.pretty_print else f"</{INFRAO_KOHTEET}>")
+
+
+def init_export_worker(conn_params: dict, koodistot: Koodistot, area_memberships: dict, area_contents: dict, plan_links_dict: dict, decree_attachments: dict, pretty_print: bool, database_xml: bool = False, snapshot: str = None) -> None:
+    """
+    Sets up an export worker with the information shared by all the exported tables.
+
+    Args:
+        conn_params (dict): Connection parameters to the postgis database.
+        koodistot (Koodistot): Code lists of the database.
+        area_memberships (dict): Area table names mapped to indexes from feature identifiers to the identifiers of the areas they belong to.
+        area_contents (dict): Area table names mapped to indexes from area identifiers to the identifiers of their features by table.
+        plan_links_dict (dict): The suunnitelmalinkkitieto feature data indexed by table and fid.
+        decree_attachments (dict): The decrees and their attachments indexed by katualueenosa fid.
+        pretty_print (bool): Whether the features are indented.
+        database_xml (bool): True if the XML of the features is built by the database.
+        snapshot (str, optional): If given, only the features changed after this database snapshot are exported, followed by the features deleted after it.
+
+    Returns:
+        None
+    """
+    _worker_state.update(conn_params=conn_params, koodistot=koodistot, area_memberships=area_memberships, area_contents=area_contents,
+                         plan_links_dict=plan_links_dict, decree_attachments=decree_attachments, pretty_print=pretty_print, database_xml=database_xml, snapshot=snapshot)
+
+
+def write_table(schema: str, table: str, writer: GmlWriter) -> None:
+    """
+    Writes the features of a table with the information set up by init_export_worker.
+
+    The table is read on its own database connection. When exporting changes, the features deleted after the previous shipment are written after the changed ones, see get_tombstone_element.
+
+    Args:
+        schema (str): The name of the table's schema.
+        table (str): The name of the table.
+        writer (GmlWriter): Writer the serialised features are written to.
+
+    Returns:
+        None
+    """
+    element_tags = SCHEMA_TABLE_NAMES[(schema, table)]
+    snapshot = _worker_state["snapshot"]
+    if _worker_state["database_xml"]:
+        write_table_xml(schema, table, element_tags, _worker_state["conn_params"], writer, snapshot=snapshot)
+    else:
+        table_values = get_table_values(schema, table, element_tags, _worker_state["conn_params"], _worker_state["koodistot"], snapshot=snapshot)
+        for feature in add_elements(table, element_tags, _worker_state["area_memberships"], _worker_state["area_contents"], table_values, _worker_state["plan_links_dict"], _worker_state["decree_attachments"]):
+            writer.write_element(feature)
+    if snapshot is not None:
+        for identifier, deleted_at in get_deleted_features(schema, table, _worker_state["conn_params"], snapshot):
+            writer.write_element(get_tombstone_element(table, identifier, deleted_at))
+
+
+def export_table(schema: str, table: str, fragment_file: str) -> None:
+    """
+    Writes the features of a table to a fragment file in an export worker process, see write_table.
+
+    The fragments of the tables are concatenated into the document in the order of SCHEMA_TABLE_NAMES.
+
+    Args:
+        schema (str): The name of the table's schema.
+        table (str): The name of the table.
+        fragment_file (str): Path of the file the serialised features are written to.
+
+    Returns:
+        None
+    """
+    with open(fragment_file, "w", encoding="utf-8") as stream:
+        write_table(schema, table, GmlWriter(stream, _worker_state["pretty_print"]))
+
+
+def create_export_executor(workers: int, initargs: tuple) -> ProcessPoolExecutor:
+    """
+    Creates the process pool exporting tables in parallel.
+
+    Args:
+        workers (int): Number of worker processes.
+        initargs (tuple): Arguments of init_export_worker.
+
+    Returns:
+        ProcessPoolExecutor: The process pool, or None if the Python interpreter was not found.
+    """
+    executable = get_python_executable()
+    if executable is None:
+        LOGGER.info("Python-tulkkia ei löytynyt, taulut viedään ilman rinnakkaisia prosesseja.")
+        return None
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(executable)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_export_worker, initargs=initargs)
+
+
+def submit_export(executor: ProcessPoolExecutor, schema: str, table: str, fragment_file: str) -> Future:
+    """
+    Submits a table to be exported by export_table in a worker process.
+
+    Args:
+        executor (ProcessPoolExecutor): Process pool exporting the tables.
+        schema (str): The name of the table's schema.
+        table (str): The name of the table.
+        fragment_file (str): Path of the file the serialised features are written to.
+
+    Returns:
+        Future: The result of export_table, or None if the worker processes have failed or could not be started.
+    """
+    try:
+        return executor.submit(export_table, schema, table, fragment_file)
+    except (BrokenProcessPool, OSError):
+        # The worker processes could not be started.
+        return None
+
+
+def xml_export(conn_params: dict, save_file: str, shipment_information: dict, progress_callback: Callable[[float], None] = None, pretty_print: bool = True, workers: int = 1, database_xml: bool = False, changes_only: bool = False) -> list:
+    """
+    Writes the root elements and the features of each table to the .gml document.
+
+    With several workers, the tables are read and serialised in parallel worker processes into temporary fragment files, which are concatenated in the order of SCHEMA_TABLE_NAMES. Tables exported in the calling process are written straight to the document, and the features of a table that fails are truncated away. The document is written to a temporary file next to save_file, which replaces save_file only when the export has completed. The shipment information is stored only after save_file has been replaced, and the shipment is marked as exported only if all the tables were exported.
+
     Args:
         conn_params (dict): Connection parameters to the postgis database.
         save_file (str): File path for the .gml document being created.
         shipment_information (dict): Dictionary containing the shipment information.
+        progress_callback (Callable, optional): Called with the progress percentage after each table. If it raises an exception, the export is stopped and no file is written.
+        pretty_print (bool): Whether the document is indented.
+        workers (int): Number of tables exported in parallel worker processes, at most EXPORT_MAX_WORKERS. With 1 the tables are exported in the calling process, which is also where they are exported if the worker processes fail.
+        database_xml (bool): True to build the XML of the features in the database with get_table_xml_query. The features are then written as they are returned, and pretty_print only places each feature on its own line.
+        changes_only (bool): True to export only the features inserted, updated or deleted after the last exported shipment according to the change log, see get_changed_condition. If nothing has been exported yet or the database has no change log, all the features are exported.
 
     Returns:
-        None
+        list: Names of the tables that could not be exported.
     """
     start = time.time()
     LOGGER.info("========================================XML EXPORT STARTED========================================")
     NAMESPACES = {
         "xmlns:infrao": 'www.infra-o.fi/infrao',
+        "xmlns:gml": GML_NS_LINK,
         "xsi:schemaLocation": 'www.infra-o.fi/infrao http://www.paikkatietopalvelu.fi/gml/infrao/2.0.2/infrao.xsd',
         "xmlns:xsi":"http://www.w3.org/2001/XMLSchema-instance",
         "xmlns:xlink":"http://www.w3.org/1999/xlink",
         }
     
-    plan_links_dict = get_plan_link(conn_params)
-    decree_attachments = get_decree_attachments(conn_params)
-    areas_elements = get_area_identifiers(conn_params)
-    root = ET.Element('infrao:InfraoKohteet',  NAMESPACES)
-    gml_fm = ET.SubElement(root, GML_FEATURE_MEMBERS)
-
-    for key, value in SCHEMA_TABLE_NAMES.items():
-        try:
-            table_values = get_table_values(key[0], key[1], value, conn_params)
-            if not table_values == []:
-                add_elements(key[0], key[1], value, gml_fm, areas_elements, conn_params, table_values, plan_links_dict, decree_attachments)
-        except Exception as e:
-            LOGGER.info(f"Ongelma taulun {key[1]} viemisessä.")
-            iface.messageBar().pushMessage(f"Ongelma taulun {key[1]} viemisessä.", level=1, duration=10)
-            LOGGER.error(f"{e}")
-            LOGGER.info(traceback.format_exc())
-    
-    if shipment_information:
-        add_shipment_information(root, shipment_information, conn_params)
+    last_snapshot, snapshot = get_shipment_snapshots(conn_params)
+    since_snapshot = None
+    if changes_only:
+        if snapshot is None:
+            LOGGER.info("Tietokannassa ei ole muutoslokia, viedään kaikki kohteet.")
+        elif last_snapshot is None:
+            LOGGER.info("Aiempaa toimitusta ei löytynyt, viedään kaikki kohteet.")
+        else:
+            LOGGER.info("Viedään edellisen toimituksen jälkeen muuttuneet ja poistetut kohteet.")
+            since_snapshot = last_snapshot
 
-    tree = ET.ElementTree(root)
-    ET.indent(tree, space="\t", level=0)
-    tree.write(save_file, xml_declaration=True, encoding="utf-8")
+    if database_xml:
+        initargs = (conn_params, None, None, None, None, None, pretty_print, database_xml, since_snapshot)
+    else:
+        with(psycopg2.connect(**conn_params)) as conn:
+            koodistot = get_koodistot(conn, ENUMERATION_TABLES)
+        plan_links_dict = get_plan_link(conn_params)
+        decree_attachments = get_decree_attachments(conn_params)
+        area_memberships, area_contents = get_area_identifiers(conn_params)
+        initargs = (conn_params, koodistot, area_memberships, area_contents, plan_links_dict, decree_attachments, pretty_print, database_xml, since_snapshot)
+    workers = min(workers, EXPORT_MAX_WORKERS)
+
+    failed_tables = []
+    partial_file = f"{save_file}.part"
+    fragment_dir = tempfile.mkdtemp(prefix="infrao_export_")
+    executor = None
+    try:
+        fragment_files = [os.path.join(fragment_dir, f"{schema}.{table}.gml") for schema, table in SCHEMA_TABLE_NAMES]
+        if workers > 1:
+            executor = create_export_executor(workers, initargs)
+        if executor is not None:
+            futures = [submit_export(executor, schema, table, fragment_file) for (schema, table), fragment_file in zip(SCHEMA_TABLE_NAMES, fragment_files)]
+        # Tables are exported in this process without worker processes or if the worker processes fail.
+        init_export_worker(*initargs)
+
+        with open(partial_file, "w", encoding="utf-8") as stream:
+            writer = GmlWriter(stream, pretty_print)
+            writer.write_start(NAMESPACES)
+            for i, (schema, table) in enumerate(SCHEMA_TABLE_NAMES):
+                if progress_callback is not None:
+                    progress_callback(100 * i / len(SCHEMA_TABLE_NAMES))
+                table_start = stream.tell()
+                try:
+                    exported = False
+                    if executor is not None and futures[i] is not None:
+                        try:
+                            futures[i].result()
+                            exported = True
+                        except BrokenProcessPool:
+                            LOGGER.info(f"Rinnakkainen vientiprosessi keskeytyi, taulu {table} viedään ilman rinnakkaisia prosesseja.")
+                    if exported:
+                        with open(fragment_files[i], encoding="utf-8") as fragment:
+                            shutil.copyfileobj(fragment, stream)
+                    else:
+                        write_table(schema, table, writer)
+                except Exception as e:
+                    # Leave out the features of the table written before it failed.
+                    stream.seek(table_start)
+                    stream.truncate()
+                    LOGGER.info(f"Ongelma taulun {table} viemisessä.")
+                    failed_tables.append(table)
+                    LOGGER.error(f"{e}")
+                    LOGGER.info(traceback.format_exc())
+                finally:
+                    if os.path.exists(fragment_files[i]):
+                        os.remove(fragment_files[i])
+
+            shipment_information_element = None
+            if shipment_information:
+                shipment_information_element = get_shipment_information_element(shipment_information)
+            writer.write_end(shipment_information_element)
+        os.replace(partial_file, save_file)
+        # The shipment is stored only once the document has been written, as the next export of changes starts from it.
+        if shipment_information:
+            if failed_tables:
+                LOGGER.info("Kaikkia tauluja ei voitu viedä, toimitusta ei merkitä viedyksi.")
+            store_shipment_information(shipment_information, conn_params, snapshot, exported=not failed_tables)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        shutil.rmtree(fragment_dir, ignore_errors=True)
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
     
     end = time.time()
     LOGGER.info("========================================XML EXPORT ENDED========================================")
-    LOGGER.info(f"TIME ELAPSED: {round(((end-start) * 10**3)/1000, 2)} seconds.")
\ No newline at end of file
+    LOGGER.info(f"TIME ELAPSED: {round(((end-start) * 10**3)/1000, 2)} seconds.")
+    return failed_tables
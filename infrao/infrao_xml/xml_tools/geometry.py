@@ -0,0 +1,408 @@
+#  Gispo Ltd., hereby disclaims all copyright interest in the program infrao-plugin
+#  Copyright (C) 2023 Gispo Ltd (https://www.gispo.fi/).
+#
+#
+#  This file is part of infrao-plugin.
+#
+#  infrao-plugin is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  infrao-plugin is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with infrao-plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+from osgeo import ogr, osr
+
+from xml.etree import ElementTree as ET
+
+from ...qgis_plugin_tools.tools.resources import plugin_name
+
+
+
+GML_NS_LONG = "{http://www.opengis.net/gml/3.2}"
+
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+
+# EWKB flags for geometries with z coordinates, with m coordinates and with an srid.
+EWKB_Z_FLAG = 0x80000000
+EWKB_M_FLAG = 0x40000000
+EWKB_SRID_FLAG = 0x20000000
+
+LOGGER = logging.getLogger(plugin_name())
+
+
+class GmlGeometry:
+    """
+    A geometry read from a gml file waiting to be transformed and encoded with the other geometries of its batch.
+
+    Points, line strings and polygons are kept as NumPy coordinate arrays. Other geometries are read with OGR.
+
+    Attributes:
+        geometry_type (int): WKB type of the geometry without dimension flags.
+        rings (list): Coordinate arrays of the geometry, one per linear ring for polygons.
+        epsg (int): EPSG code of the coordinates or None if the geometry has no srsName.
+        ogr_geometry (ogr.Geometry): The geometry if it could not be read into coordinate arrays.
+    """
+
+    __slots__ = ("geometry_type", "rings", "epsg", "ogr_geometry")
+
+    def __init__(self, geometry_type: int, rings: list, epsg: Optional[int], ogr_geometry: ogr.Geometry = None):
+        self.geometry_type = geometry_type
+        self.rings = rings
+        self.epsg = epsg
+        self.ogr_geometry = ogr_geometry
+
+    def to_ewkb(self, srid: Optional[int]) -> bytes:
+        """
+        Encodes the geometry as little endian EWKB.
+
+        Args:
+            srid (int): Srid written to the geometry, or None to leave it out.
+
+        Returns:
+            bytes: The EWKB of the geometry.
+        """
+        if self.ogr_geometry is not None:
+            return set_ewkb_srid(self.ogr_geometry.ExportToWkb(ogr.wkbNDR), srid)
+
+        type_code = self.geometry_type
+        if self.rings[0].shape[1] == 3:
+            type_code |= EWKB_Z_FLAG
+        if srid:
+            header = struct.pack("<BII", 1, type_code | EWKB_SRID_FLAG, srid)
+        else:
+            header = struct.pack("<BI", 1, type_code)
+
+        if self.geometry_type == WKB_POINT:
+            return header + self.rings[0][0].astype("<f8").tobytes()
+        if self.geometry_type == WKB_LINESTRING:
+            return header + struct.pack("<I", len(self.rings[0])) + self.rings[0].astype("<f8").tobytes()
+        return header + struct.pack("<I", len(self.rings)) + b"".join(
+            struct.pack("<I", len(ring)) + ring.astype("<f8").tobytes() for ring in self.rings
+        )
+
+
+def set_ewkb_srid(wkb: bytes, srid: Optional[int]) -> bytes:
+    """
+    Adds an srid to a little endian WKB geometry.
+
+    Args:
+        wkb (bytes): The WKB of the geometry.
+        srid (int): The srid, or None to return the geometry unchanged.
+
+    Returns:
+        bytes: The EWKB of the geometry.
+    """
+    if not srid:
+        return wkb
+    type_code = struct.unpack_from("<I", wkb, 1)[0]
+    return struct.pack("<BII", 1, type_code | EWKB_SRID_FLAG, srid) + wkb[5:]
+
+
+def read_ewkb(wkb: bytes, offset: int = 0) -> Tuple[int, Optional[int], list, int]:
+    """
+    Reads a WKB or EWKB geometry into coordinate arrays.
+
+    Both the EWKB flags and the ISO type codes of z and m coordinates are understood. M coordinates are dropped.
+
+    Args:
+        wkb (bytes): The (E)WKB of the geometry, for example from ST_AsEWKB.
+        offset (int): Position of the geometry in wkb.
+
+    Returns:
+        tuple: The WKB type of the geometry without dimension flags, its srid or None, its parts and the position after the geometry. Each part is a list of coordinate arrays of shape (number of points, 2 or 3), one per linear ring for polygons. Single geometries have one part.
+    """
+    byte_order = "<" if wkb[offset] == 1 else ">"
+    type_code = struct.unpack_from(byte_order + "I", wkb, offset + 1)[0]
+    offset += 5
+    srid = None
+    if type_code & EWKB_SRID_FLAG:
+        srid = struct.unpack_from(byte_order + "I", wkb, offset)[0]
+        offset += 4
+    iso_type = type_code & 0x0FFFFFFF
+    geometry_type = iso_type % 1000
+    has_z = bool(type_code & EWKB_Z_FLAG) or iso_type // 1000 in (1, 3)
+    has_m = bool(type_code & EWKB_M_FLAG) or iso_type // 1000 in (2, 3)
+    dimension = 2 + has_z + has_m
+    dtype = np.dtype(byte_order + "f8")
+
+    def read_points(count: int) -> np.ndarray:
+        nonlocal offset
+        coordinates = np.frombuffer(wkb, dtype, count * dimension, offset).reshape(count, dimension)[:, :2 + has_z]
+        offset += count * dimension * 8
+        return coordinates
+
+    def read_count() -> int:
+        nonlocal offset
+        count = struct.unpack_from(byte_order + "I", wkb, offset)[0]
+        offset += 4
+        return count
+
+    if geometry_type == WKB_POINT:
+        parts = [[read_points(1)]]
+    elif geometry_type == WKB_LINESTRING:
+        parts = [[read_points(read_count())]]
+    elif geometry_type == WKB_POLYGON:
+        parts = [[read_points(read_count()) for _ in range(read_count())]]
+    elif geometry_type in (WKB_MULTIPOINT, WKB_MULTILINESTRING, WKB_MULTIPOLYGON):
+        parts = []
+        for _ in range(read_count()):
+            _, _, member_parts, offset = read_ewkb(wkb, offset)
+            parts.extend(member_parts)
+    else:
+        raise ValueError(f"Unsupported WKB geometry type {geometry_type}")
+    return geometry_type, srid, parts, offset
+
+
+def is_empty_part(part: list) -> bool:
+    """
+    Checks whether a part returned by read_ewkb has no coordinates.
+
+    Empty points are stored in WKB as NaN coordinates and empty line strings and polygons have no points or rings.
+
+    Args:
+        part (list): Coordinate arrays of one part of a geometry.
+
+    Returns:
+        bool: True if the part has no coordinates.
+    """
+    return all(len(ring) == 0 or np.isnan(ring).all() for ring in part)
+
+
+def is_empty_ewkb(wkb: bytes) -> bool:
+    """
+    Checks whether a WKB or EWKB geometry is empty, for example POLYGON EMPTY or POINT EMPTY.
+
+    Only the header of single geometries is read. Collections are empty if all of their members are.
+
+    Args:
+        wkb (bytes): The (E)WKB of the geometry.
+
+    Returns:
+        bool: True if the geometry has no coordinates.
+    """
+    byte_order = "<" if wkb[0] == 1 else ">"
+    type_code = struct.unpack_from(byte_order + "I", wkb, 1)[0]
+    offset = 9 if type_code & EWKB_SRID_FLAG else 5
+    geometry_type = (type_code & 0x0FFFFFFF) % 1000
+    if geometry_type == WKB_POINT:
+        return bool(np.isnan(struct.unpack_from(byte_order + "d", wkb, offset)[0]))
+    if geometry_type in (WKB_LINESTRING, WKB_POLYGON):
+        return struct.unpack_from(byte_order + "I", wkb, offset)[0] == 0
+    return all(is_empty_part(part) for part in read_ewkb(wkb)[2])
+
+
+def read_coordinates(pos_list: Optional[ET.Element], dimension: int) -> Optional[np.ndarray]:
+    """
+    Reads the coordinates of a gml:posList or gml:pos element into an array.
+
+    Args:
+        pos_list (ET.Element): The gml:posList or gml:pos element.
+        dimension (int): Number of coordinates per point if the element doesn't have an srsDimension.
+
+    Returns:
+        np.ndarray: Array of shape (number of points, dimension), or None if the element is missing or empty.
+    """
+    if pos_list is None or not pos_list.text:
+        return None
+    dimension = int(pos_list.attrib.get("srsDimension", dimension))
+    coordinates = np.array(pos_list.text.split(), dtype=np.float64)
+    if coordinates.size == 0 or coordinates.size % dimension:
+        return None
+    return coordinates.reshape(-1, dimension)
+
+
+def read_rings(polygon: ET.Element, dimension: int) -> Optional[List[np.ndarray]]:
+    """
+    Reads the exterior and interior rings of a gml:Polygon or gml:PolygonPatch element.
+
+    Args:
+        polygon (ET.Element): The polygon element.
+        dimension (int): Number of coordinates per point if the elements don't have an srsDimension.
+
+    Returns:
+        list: Coordinate arrays of the rings, exterior first, or None if the rings are not simple gml:posLists.
+    """
+    rings = [
+        read_coordinates(ring.find(f"./{GML_NS_LONG}posList"), dimension)
+        for ring in polygon.findall(f"./{GML_NS_LONG}exterior/{GML_NS_LONG}LinearRing") + polygon.findall(f"./{GML_NS_LONG}interior/{GML_NS_LONG}LinearRing")
+    ]
+    if not rings or any(ring is None for ring in rings) or len(polygon.findall(f"./{GML_NS_LONG}exterior")) != 1:
+        return None
+    return rings
+
+
+def read_gml_geometry(gml_element: ET.Element, epsg: Optional[int]) -> Optional[GmlGeometry]:
+    """
+    Reads a gml geometry element.
+
+    Points, line strings, polygons and single segment curves and surfaces are read straight into coordinate arrays.
+    Other geometries are read with OGR, and curves and surfaces are converted to line strings and polygons.
+
+    Args:
+        gml_element (ET.Element): The gml geometry element.
+        epsg (int): EPSG code of the coordinates or None if they are in the database's system.
+
+    Returns:
+        GmlGeometry: The geometry, or None if it could not be read.
+    """
+    tag = gml_element.tag
+    dimension = int(gml_element.attrib.get("srsDimension", 2))
+    geometry_type, rings = None, None
+
+    if tag == GML_NS_LONG + "Point":
+        geometry_type = WKB_POINT
+        rings = [read_coordinates(gml_element.find(f"./{GML_NS_LONG}pos"), dimension)]
+    elif tag == GML_NS_LONG + "LineString":
+        geometry_type = WKB_LINESTRING
+        rings = [read_coordinates(gml_element.find(f"./{GML_NS_LONG}posList"), dimension)]
+    elif tag == GML_NS_LONG + "Polygon":
+        geometry_type = WKB_POLYGON
+        rings = read_rings(gml_element, dimension)
+    elif tag in (GML_NS_LONG + "Curve", GML_NS_LONG + "Surface"):
+        parts = gml_element.findall(f"./{GML_NS_LONG}segments/*") + gml_element.findall(f"./{GML_NS_LONG}patches/*")
+        if len(parts) == 1 and parts[0].tag == GML_NS_LONG + "LineStringSegment":
+            geometry_type = WKB_LINESTRING
+            rings = [read_coordinates(parts[0].find(f"./{GML_NS_LONG}posList"), dimension)]
+        elif len(parts) == 1 and parts[0].tag == GML_NS_LONG + "PolygonPatch":
+            geometry_type = WKB_POLYGON
+            rings = read_rings(parts[0], dimension)
+
+    if rings is not None and all(ring is not None for ring in rings):
+        return GmlGeometry(geometry_type, rings, epsg)
+
+    geom = ogr.CreateGeometryFromGML(ET.tostring(gml_element).decode("utf-8"))
+    if geom is None:
+        return None
+    geom_type = geom.GetGeometryType()
+    if geom_type == 1010 or geom_type == 10:
+        geom = ogr.ForceToPolygon(geom)
+    if geom_type == 9 or geom_type == 1009 or geom_type == 8 or geom_type == 1008:
+        geom = ogr.ForceToLineString(geom)
+    return GmlGeometry(ogr.GT_Flatten(geom.GetGeometryType()), None, epsg, geom)
+
+
+def get_coordinate_transformation(source_epsg: int, target_epsg: int) -> osr.CoordinateTransformation:
+    """
+    Creates a transformation between two coordinate systems with coordinates in easting, northing order.
+
+    Args:
+        source_epsg (int): EPSG code of the source coordinate system.
+        target_epsg (int): EPSG code of the target coordinate system.
+
+    Returns:
+        osr.CoordinateTransformation: The transformation.
+    """
+    source_srs = osr.SpatialReference()
+    source_srs.ImportFromEPSG(source_epsg)
+    source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    target_srs = osr.SpatialReference()
+    target_srs.ImportFromEPSG(target_epsg)
+    target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return osr.CoordinateTransformation(source_srs, target_srs)
+
+
+def transform_geometries(geometries: List[GmlGeometry], transformation: osr.CoordinateTransformation) -> None:
+    """
+    Transforms the coordinates of the geometries in place with a single call to the transformation.
+
+    Only the x and y coordinates are transformed, z coordinates are kept as they are.
+
+    Args:
+        geometries (list): Geometries in the source coordinate system of the transformation.
+        transformation (osr.CoordinateTransformation): The transformation.
+
+    Returns:
+        None
+    """
+    rings = [ring for geometry in geometries if geometry.ogr_geometry is None for ring in geometry.rings]
+    if rings:
+        coordinates = np.concatenate([ring[:, :2] for ring in rings])
+        transformed = np.asarray(transformation.TransformPoints(coordinates), dtype=np.float64)[:, :2]
+        offsets = np.cumsum([len(ring) for ring in rings])[:-1]
+        for ring, transformed_ring in zip(rings, np.split(transformed, offsets)):
+            ring[:, :2] = transformed_ring
+
+    for geometry in geometries:
+        if geometry.ogr_geometry is not None:
+            geometry.ogr_geometry.Transform(transformation)
+
+
+class GeometryEncoder:
+    """
+    Transforms and encodes the geometries of the batches of one import.
+
+    The coordinate transformations are created once per source coordinate system and reused for every batch.
+    Geometries already in the target coordinate system are not transformed. If the transformation is left to
+    the database, the geometries are encoded with their source srid to be transformed with ST_Transform on insert.
+
+    Attributes:
+        target_epsg (int): EPSG code of the database's coordinate system.
+        transform_in_database (bool): True if the geometries are transformed by the database.
+        transformations (dict): Created transformations keyed by (source EPSG, target EPSG).
+    """
+
+    def __init__(self, target_epsg: int, transform_in_database: bool = False):
+        self.target_epsg = target_epsg
+        self.transform_in_database = transform_in_database
+        self.transformations = {}
+
+    def get_transformation(self, source_epsg: int) -> osr.CoordinateTransformation:
+        """
+        Gets the transformation from a source coordinate system to the target coordinate system.
+
+        Args:
+            source_epsg (int): EPSG code of the source coordinate system.
+
+        Returns:
+            osr.CoordinateTransformation: The transformation.
+        """
+        key = (source_epsg, self.target_epsg)
+        transformation = self.transformations.get(key)
+        if transformation is None:
+            transformation = get_coordinate_transformation(*key)
+            self.transformations[key] = transformation
+        return transformation
+
+    def encode(self, values_dict: list) -> None:
+        """
+        Replaces the geometries read from the gml file with their EWKB.
+
+        The geometries are grouped by their coordinate system and each group is transformed with one call.
+        Geometries without a coordinate system are encoded without an srid.
+
+        Args:
+            values_dict (list): List of dictionaries for each feature to be added to the table.
+
+        Returns:
+            None
+        """
+        geometries_by_epsg = {}
+        for value_dict in values_dict:
+            for column, value in value_dict.items():
+                if isinstance(value, GmlGeometry):
+                    geometries_by_epsg.setdefault(value.epsg, []).append((value_dict, column, value))
+
+        for epsg, geometries in geometries_by_epsg.items():
+            srid = epsg
+            if epsg is not None and epsg != self.target_epsg and not self.transform_in_database:
+                transform_geometries([geometry for _, _, geometry in geometries], self.get_transformation(epsg))
+                srid = self.target_epsg
+            for value_dict, column, geometry in geometries:
+                value_dict[column] = geometry.to_ewkb(srid)
@@ -0,0 +1,320 @@
+#  Gispo Ltd., hereby disclaims all copyright interest in the program infrao-plugin
+#  Copyright (C) 2023 Gispo Ltd (https://www.gispo.fi/).
+#
+#
+#  This file is part of infrao-plugin.
+#
+#  infrao-plugin is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  infrao-plugin is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with infrao-plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+from ...qgis_plugin_tools.tools.resources import plugin_name, profile_path
+
+
+# Size of the cached responses in bytes after which the least recently used responses are removed.
+HTTP_CACHE_MAX_SIZE = 512 * 1024 * 1024
+# Share of the cache the responses of a single url, for example the pages of a collection, may use.
+HTTP_CACHE_MAX_GROUP_SHARE = 4
+# Headers stored with the cached responses.
+CACHED_HEADERS = ["Content-Type", "ETag", "Last-Modified", "Link"]
+CACHE_FILE_SUFFIX = ".cache"
+
+LOGGER = logging.getLogger(plugin_name())
+
+_http_cache = None
+
+
+class HttpCache:
+    """
+    On-disk cache of HTTP responses keyed by url and the accepted media type.
+
+    Each response is stored in a single file containing its headers as a line of JSON followed by the decompressed body.
+    The modification time of a file is updated whenever the response is used, and the least recently used responses are
+    removed once the total size of the files exceeds max_size. The responses of a url with different query parameters,
+    such as the pages of a collection, form a group that may use at most max_group_size, so reading one large collection
+    does not remove everything else from the cache.
+    """
+
+    def __init__(self, directory: str, max_size: int = HTTP_CACHE_MAX_SIZE, max_group_size: int = None):
+        """
+        Args:
+            directory (str): The directory the responses are stored in.
+            max_size (int): Total size of the cached responses in bytes after which the least recently used responses are removed.
+            max_group_size (int, optional): Total size of the cached responses of a url in bytes after which its least recently used responses are removed. Larger responses are not cached. Defaults to a quarter of max_size.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_group_size = max_group_size or max_size // HTTP_CACHE_MAX_GROUP_SHARE
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, url: str, accept: str) -> str:
+        group = hashlib.sha256(urlsplit(url)._replace(query="", fragment="").geturl().encode("utf-8")).hexdigest()[:16]
+        key = hashlib.sha256(f"{accept}\n{url}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{group}-{key}{CACHE_FILE_SUFFIX}")
+
+    def get_headers(self, path: str) -> dict:
+        """
+        Reads the stored headers of a cached response.
+
+        Args:
+            path (str): Path of the cached response.
+
+        Returns:
+            dict: The headers, or None if the response is not cached.
+        """
+        try:
+            with open(path, "rb") as cache_file:
+                return json.loads(cache_file.readline())
+        except (OSError, ValueError):
+            return None
+
+    def open(self, path: str) -> HTTPResponse:
+        """
+        Opens a cached response and marks it as the most recently used.
+
+        Args:
+            path (str): Path of the cached response.
+
+        Returns:
+            HTTPResponse: The response with the body read from the cache.
+        """
+        cache_file = open(path, "rb")
+        headers = json.loads(cache_file.readline())
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return HTTPResponse(body=cache_file, headers=headers, status=200, reason="OK", preload_content=False, decode_content=False)
+
+    def store(self, path: str, response: requests.Response) -> HTTPResponse:
+        """
+        Returns a response whose body is stored to the cache as it is read.
+
+        The response is added to the cache once its body has been read to the end, see CachingReader. Responses larger than max_group_size are not cached.
+
+        Args:
+            path (str): Path of the cached response.
+            response (requests.Response): The response, with its body not yet read.
+
+        Returns:
+            HTTPResponse: The response with the decompressed body read through the cache.
+
+        Raises:
+            OSError: If the cache file could not be created.
+        """
+        headers = {key: response.headers[key] for key in CACHED_HEADERS if key in response.headers}
+        reader = CachingReader(self, path, response.raw, headers)
+        return HTTPResponse(body=reader, headers=headers, status=200, reason="OK", preload_content=False, decode_content=False)
+
+    def evict(self, path: str = None) -> None:
+        """
+        Removes the least recently used responses until the total size of the cache is at most max_size.
+
+        Args:
+            path (str, optional): Path of a stored response. The least recently used responses of its group are removed first until the group is at most max_group_size.
+
+        Returns:
+            None
+        """
+        group = os.path.basename(path).split("-")[0] if path is not None else None
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(CACHE_FILE_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path, entry.name.split("-")[0]))
+            entries.sort()
+            group_size = sum(size for _, size, _, entry_group in entries if entry_group == group)
+            total_size = sum(size for _, size, _, _ in entries)
+            for _, size, entry_path, entry_group in entries:
+                if total_size <= self.max_size and group_size <= self.max_group_size:
+                    break
+                if total_size <= self.max_size and entry_group != group:
+                    continue
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    # The response is being read.
+                    continue
+                total_size -= size
+                if entry_group == group:
+                    group_size -= size
+
+
+class CachingReader(io.IOBase):
+    """
+    Reads the body of a response and writes it to a cache file at the same time.
+
+    The file is added to the cache when the body has been read to the end. It is removed if the body is not read to the
+    end, reading it fails or it grows larger than the max_group_size of the cache.
+    """
+
+    def __init__(self, cache: HttpCache, path: str, source: HTTPResponse, headers: dict):
+        """
+        Args:
+            cache (HttpCache): The cache.
+            path (str): Path of the cached response.
+            source (HTTPResponse): The response whose body is read.
+            headers (dict): The headers stored with the response.
+        """
+        super().__init__()
+        self.cache = cache
+        self.path = path
+        self.source = source
+        self.size = 0
+        file_descriptor, self.temporary_path = tempfile.mkstemp(dir=cache.directory)
+        self.cache_file = os.fdopen(file_descriptor, "wb")
+        try:
+            self.cache_file.write(json.dumps(headers).encode("utf-8") + b"\n")
+        except BaseException:
+            self.discard()
+            raise
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            data = self.source.read(size if size is not None and size >= 0 else None, decode_content=True)
+            if self.cache_file is not None:
+                self.size += len(data)
+                if self.size > self.cache.max_group_size:
+                    self.discard()
+                elif data:
+                    self.cache_file.write(data)
+                if self.cache_file is not None and (not data and size != 0 or size is None or size < 0):
+                    self.commit()
+        except BaseException:
+            self.discard()
+            raise
+        return data
+
+    def commit(self) -> None:
+        self.cache_file.close()
+        self.cache_file = None
+        os.replace(self.temporary_path, self.path)
+        self.cache.evict(self.path)
+
+    def discard(self) -> None:
+        if self.cache_file is None:
+            return
+        self.cache_file.close()
+        self.cache_file = None
+        try:
+            os.remove(self.temporary_path)
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        if not self.closed:
+            self.discard()
+            self.source.close()
+        super().close()
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    Transport adapter revalidating cached GET responses with conditional requests.
+
+    A cached response is requested with If-None-Match and If-Modified-Since, and an unchanged response (304) is read from
+    the cache. Successful responses with an ETag or Last-Modified header are stored to the cache as their body is read.
+    """
+
+    def __init__(self, cache: HttpCache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def is_cacheable(self, response: requests.Response) -> bool:
+        try:
+            return int(response.headers.get("Content-Length", 0)) <= self.cache.max_group_size
+        except ValueError:
+            return True
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if request.method != "GET":
+            return super().send(request, **kwargs)
+
+        path = self.cache.get_path(request.url, request.headers.get("Accept"))
+        cached_headers = self.cache.get_headers(path)
+        if cached_headers is not None:
+            if "ETag" in cached_headers:
+                request.headers["If-None-Match"] = cached_headers["ETag"]
+            if "Last-Modified" in cached_headers:
+                request.headers["If-Modified-Since"] = cached_headers["Last-Modified"]
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and cached_headers is not None:
+            response.close()
+        elif response.status_code == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers) and self.is_cacheable(response):
+            try:
+                return self.build_response(request, self.cache.store(path, response))
+            except OSError:
+                LOGGER.info(f"Vastausta osoitteeseen {request.url} ei voitu tallentaa välimuistiin.")
+                return response
+        else:
+            return response
+
+        try:
+            return self.build_response(request, self.cache.open(path))
+        except (OSError, ValueError):
+            LOGGER.info(f"Välimuistista ei voitu lukea vastausta osoitteeseen {request.url}.")
+            request.headers.pop("If-None-Match", None)
+            request.headers.pop("If-Modified-Since", None)
+            return super().send(request, **kwargs)
+
+
+def get_http_cache() -> HttpCache:
+    """
+    Gets the cache of the plugin in the QGIS profile directory.
+
+    Returns:
+        HttpCache: The cache.
+    """
+    global _http_cache
+    if _http_cache is None:
+        _http_cache = HttpCache(profile_path(plugin_name(), "http_cache"))
+    return _http_cache
+
+
+def create_session(cache: HttpCache = None, pool_size: int = 10) -> requests.Session:
+    """
+    Creates a session whose GET responses are cached and revalidated.
+
+    Args:
+        cache (HttpCache, optional): The cache. Defaults to the cache of the plugin, see get_http_cache.
+        pool_size (int): Number of connections kept open per host.
+
+    Returns:
+        requests.Session: The session.
+    """
+    adapter = CachingAdapter(cache or get_http_cache(), pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
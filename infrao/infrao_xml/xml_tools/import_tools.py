@@ -17,18 +17,26 @@
 #  You should have received a copy of the GNU General Public License
 #  along with infrao-plugin.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
 import logging
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import IO, Callable, Iterator, Tuple, Union
 
-from ...qgis_plugin_tools.tools.resources import plugin_name, load_ui
-from qgis.core import QgsCoordinateTransform, QgsProject, QgsGeometry
-from qgis.utils import iface
-from osgeo import ogr
+from ...qgis_plugin_tools.tools.resources import plugin_name
 
 from xml.etree import ElementTree as ET
 
 import psycopg2
-from psycopg2.sql import SQL, Placeholder, Identifier, Composed
-from psycopg2.extras import DictCursor
+from psycopg2.sql import SQL, Placeholder, Identifier, Literal, Composed
+from psycopg2.extras import DictCursor, execute_values
+
+from .geometry import GeometryEncoder, read_gml_geometry
+from .koodistot import Koodistot, get_koodistot
 
 import time
 
@@ -439,6 +447,61 @@ LOCATION_UNCERTAINTY_ENUMERATION = {
     "-1": 14,
 }
 
+ELEMENT_TO_TABLE = {element: table for table, (element, _) in TABLE_TO_ELEMENT.items()}
+
+TABLE_TO_SCHEMA = {table: schema for schema, table in AREA_TABLE_LIST + AREA_PART_TABLE_LIST + TABLE_LIST}
+
+SHIPMENT_INFORMATION_TAG = CORE_NS_LONG + "toimituksentiedot"
+
+# Code list (koodistot) tables referred to by the enumeration columns of the imported tables.
+ENUMERATION_TABLES = sorted({column.removeprefix("cid_") for _, tags in TABLE_TO_ELEMENT.values() for column in tags.values() if column.startswith("cid_")})
+
+# Number of features streamed to the database with a single COPY.
+COPY_BATCH_SIZE = 10000
+
+# Number of features read into memory per table before they are added to the database when streaming.
+IMPORT_BATCH_SIZE = 1000
+
+# Number of features read between progress reports when streaming.
+PROGRESS_INTERVAL = 100
+
+# Percentage of the progress of a streamed import reached once all features have been read. The rest is reported while
+# the last batches, area memberships, decrees, attachments and plan links are added.
+READ_PROGRESS_SHARE = 90
+FINAL_STAGE_COUNT = 5
+
+# Columns of osoite.osoite an address is identified by, in the order of INFRAO_OSOITE_TAGS, and their types.
+OSOITE_COLUMN_TYPES = {
+    "kunta": "text",
+    "osoitenumero": "integer",
+    "osoitenumero2": "integer",
+    "jakokirjain": "text",
+    "jakokirjain2": "text",
+    "porras": "text",
+    "huoneisto": "integer",
+    "huoneistojakokirjain": "text",
+    "postinumero": "text",
+    "postitoimipaikannimi": "text",
+    "viitesijaintialue": "text",
+    "nimitieto": "text",
+}
+
+# Columns of linkit.liite an attachment is identified by and their types.
+LIITE_COLUMN_TYPES = {
+    "kuvaus": "text",
+    "linkkiliitteeseen": "text",
+    "muokkaushetki": "timestamptz",
+    "versionumero": "text",
+    "id_paatos": "bigint",
+}
+
+# Columns of linkit.paatos a decree is identified by and their types.
+PAATOS_COLUMN_TYPES = {
+    "kuvaus": "text",
+    "paivamaarapvm": "date",
+    "fid_katualueenosa": "bigint",
+}
+
 AREA_TAG_TO_TABLE = {
     CORE_NS_LONG + "kuuluuViheralueeseen": "viheralue",
     CORE_NS_LONG + "kuuluuKatualueeseen": "katualue",
@@ -465,72 +528,26 @@ SRS_LIST = [
     "3885",
 ]
 
-FORM_CLASS = load_ui('import.ui')
 LOGGER = logging.getLogger(plugin_name())
 
-def get_area_fids(conn_params):
-    results_dicts = {"viheralueenosa": [],
-                     "katualueenosa": [],
-                     "viheralue": [],
-                     "katualue": [],}
-    for key in results_dicts.keys():
-        if key.startswith('k'):
-            schema = "katualue"
-        else:
-            schema = "viheralue"
-
-        query = SQL("SELECT {}, {} FROM {}.{}").format(Identifier("fid"), Identifier("identifier"), Identifier(schema), Identifier(key))
-
-        with(psycopg2.connect(**conn_params)) as conn:
-            with conn.cursor() as curs:
-                curs.execute(query)
-                rows = curs.fetchall()
-                result_dict = {}
-                for row in rows:
-                    result_dict[row[1]] = row[0]
-                results_dicts[key] = result_dict
-    return results_dicts
-
-
-def add_enumeration_values(conn_params: dict, enumeration_tables: dict, column:str) -> dict:
-    """
-    Fetches an enumeration table corresponding a foreign key column and adds it to a dictionary for later use.
-
-    Args:
-        conn_params (dict): Connection parameters to the postgis database. 
-        enumeration_tables (dict): Dictionary of dictionaries which will be updated with this function.
-        column (str): The foreign key column whose corresponding enumeration table will be fetched.
-
-    Returns:
-        dict: A dictionary of dictionaries, where the keys are column names.
-    """
-    query = SQL("SELECT {}, {} FROM {}.{}").format(Identifier("selite"), Identifier("cid"), Identifier("koodistot"), Identifier(column.removeprefix('cid_')))
-    with(psycopg2.connect(**conn_params)) as conn:
-        with conn.cursor(cursor_factory=DictCursor) as curs:
-            curs.execute(query)
-            results = dict(curs.fetchall())
-            enumeration_tables[column] = results
-    return enumeration_tables
+# State of an import worker process set by init_parse_worker.
+_worker_state = {}
 
 
-def add_shipment_information(conn_params:dict, tree:str) -> None:
+def add_shipment_information(conn:psycopg2.extensions.connection, shipment_grandparent:ET.Element) -> None:
     """
     Reads shipment information (aineistotoimituksen tiedot) from the gml file and adds it to the database.
 
     Args:
-        conn_params (dict): Connection parameters to the postgis database. 
-        tree (ET.ElementTree): XML tree.
+        conn (psycopg2.extensions.connection): Connection to the postgis database. 
+        shipment_grandparent (ET.Element): The infrao:toimituksentiedot element, or None if the file has no shipment information.
     
     Returns:
         None
     """
-    #tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    shipment_grandparent = root.find(f".//{CORE_NS_LONG + 'toimituksentiedot'}")
     if shipment_grandparent is not None:
         shipment_information_elements = shipment_grandparent.findall("./*/*")
-        if shipment_information_elements is not None:
+        if shipment_information_elements:
 
             shipment_information_to_add = {}
 
@@ -548,547 +565,844 @@ def add_shipment_information(conn_params:dict, tree:str) -> None:
                 columns=columns,
                 value_placeholders=value_placeholders)
 
-            with(psycopg2.connect(**conn_params)) as conn:
-                with conn.cursor(cursor_factory=DictCursor) as curs:
-                    curs.execute(query, list(shipment_information_to_add.values()))
+            with conn.cursor(cursor_factory=DictCursor) as curs:
+                curs.execute(query, list(shipment_information_to_add.values()))
+
+
+def get_or_add_fids(conn:psycopg2.extensions.connection, schema:str, table:str, column_types:dict, keys:list, fid_column:str = "fid") -> dict:
+    """
+    Finds the fids of the rows matching the given keys and adds the rows that don't exist yet with a single statement.
+
+    Rows match when all the key columns are equal, nulls included. The columns are compared one by one with
+    IS NOT DISTINCT FROM, so the comparison uses the types of the columns instead of their text representations.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
+        schema (str): Name of the table's schema.
+        table (str): Name of the table.
+        column_types (dict): Types of the key columns keyed by column name.
+        keys (list): Tuples of key column values in the order of column_types.
+        fid_column (str): Name of the table's primary key column.
+
+    Returns:
+        dict: Fid of each key.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    columns = list(column_types)
+    query = SQL("""
+        WITH input_rows AS (
+            SELECT * FROM (VALUES %s) AS v (ordinal, {columns})
+        ), existing AS (
+            SELECT DISTINCT ON (i.ordinal) i.ordinal, t.{fid_column} AS fid
+                FROM input_rows AS i
+                JOIN {schema}.{table} AS t ON {existing_match}
+                ORDER BY i.ordinal, t.{fid_column}
+        ), inserted AS (
+            INSERT INTO {schema}.{table} ({columns})
+                SELECT {input_columns}
+                FROM input_rows AS i
+                WHERE NOT EXISTS (SELECT 1 FROM existing AS e WHERE e.ordinal = i.ordinal)
+                RETURNING {fid_column} AS fid, {columns}
+        )
+        SELECT ordinal, fid FROM existing
+        UNION ALL
+        SELECT i.ordinal, n.fid
+            FROM inserted AS n
+            JOIN input_rows AS i ON {inserted_match}
+    """).format(
+        columns=SQL(", ").join(map(Identifier, columns)),
+        schema=Identifier(schema),
+        table=Identifier(table),
+        fid_column=Identifier(fid_column),
+        input_columns=SQL(", ").join(Identifier("i", column) for column in columns),
+        existing_match=get_key_match("t", "i", columns),
+        inserted_match=get_key_match("n", "i", columns))
+    template = SQL("(%s, {})").format(SQL(", ").join(SQL("%s::{}").format(SQL(column_type)) for column_type in column_types.values()))
+
+    with conn.cursor() as curs:
+        rows = execute_values(curs, query.as_string(curs), [(ordinal, *key) for ordinal, key in enumerate(keys)], template=template.as_string(curs), page_size=len(keys), fetch=True)
+    return {keys[ordinal]: fid for ordinal, fid in rows}
+
+
+def get_key_match(alias:str, other_alias:str, columns:list) -> Composed:
+    """
+    Builds the join condition of two rows whose key columns are all equal, nulls included.
+
+    Args:
+        alias (str): Alias of the first table.
+        other_alias (str): Alias of the second table.
+        columns (list): Names of the key columns.
+
+    Returns:
+        Composed: The join condition.
+    """
+    return SQL(" AND ").join(SQL("{} IS NOT DISTINCT FROM {}").format(Identifier(alias, column), Identifier(other_alias, column)) for column in columns)
 
 
-def add_decrees_and_their_attachments(conn_params:dict, decree_information_dicts:list) -> None: # TODO: refactor adding attachments etc. to a separate function
+def get_feature_fids(conn:psycopg2.extensions.connection, table:str, identifiers:list) -> dict:
     """
-    Adds decree (päätös) features and their linked attachments (if they exist).
+    Gets the fids of the features with the given identifiers with one query.
 
     Args:
-        conn_params (dict): Connection parameters to the postgis database. 
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
+        table (str): Name of the feature table.
+        identifiers (list): Identifiers of the features.
+
+    Returns:
+        dict: Fid of each identifier found.
+    """
+    query = SQL("SELECT DISTINCT ON (identifier) identifier, fid FROM {schema}.{table} WHERE identifier = ANY(%s) ORDER BY identifier, fid").format(
+        schema=Identifier(TABLE_TO_SCHEMA[table]),
+        table=Identifier(table))
+    with conn.cursor() as curs:
+        curs.execute(query, [list(set(identifiers))])
+        return dict(curs.fetchall())
+
+
+def add_decrees(conn:psycopg2.extensions.connection, decree_information_dicts:list) -> None:
+    """
+    Adds the decree (päätös) features that don't exist yet and links their attachments to them.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database. 
         decree_information_dicts (list): List of dictionaries for each decree, included is a list of potential attachments as dictionaries.
 
     Returns:
         None
     """
-    for decree in decree_information_dicts:
-        select_query = f"SELECT id FROM linkit.paatos WHERE kuvaus='{decree['kuvaus']}' AND paivamaarapvm='{decree['paivamaarapvm']}' AND fid_katualueenosa=(SELECT fid FROM katualue.katualueenosa WHERE identifier='{decree['feature_identifier']}' LIMIT 1)"
-        select_query = SQL("""
-            SELECT id
-                FROM linkit.paatos
-                WHERE kuvaus={kuvaus_value} AND
-                      paivamaarapvm={paivamaarapvm} AND
-                      fid_katualueenosa=(SELECT fid 
-                                            FROM katualue.katualueenosa 
-                                            WHERE identifier={feature_identifier_value} 
-                                            LIMIT 1)
-        """).format(
-            kuvaus_value=Placeholder(),
-            paivamaarapvm=Placeholder(),
-            feature_identifier_value=Placeholder()
-        )
-        with(psycopg2.connect(**conn_params)) as conn:
-            with conn.cursor() as curs:
-                curs.execute(select_query, [decree['kuvaus'], decree['paivamaarapvm'], decree['feature_identifier']])
-                select_result = curs.fetchone()
-
-                decree_id = select_result[0] if select_result is not None else None
-
-                if decree_id is None:
-                    insert_query = SQL("""
-                        INSERT INTO linkit.paatos (kuvaus, paivamaarapvm, fid_katualueenosa)
-                        VALUES ({kuvaus_value}, {paivamaarapvm_value},
-                        (SELECT fid FROM katualue.katualueenosa WHERE identifier={feature_identifier_value} LIMIT 1)
-                        )
-                        RETURNING id
-                    """).format(
-                        kuvaus_value=Placeholder(),
-                        paivamaarapvm_value=Placeholder(),
-                        feature_identifier_value=Placeholder()
-                    )
+    feature_fids = get_feature_fids(conn, "katualueenosa", [decree["feature_identifier"] for decree in decree_information_dicts])
+    decree_keys = [
+        (decree["kuvaus"], decree["paivamaarapvm"], feature_fids.get(decree["feature_identifier"]))
+        for decree in decree_information_dicts
+    ]
+    decree_ids = get_or_add_fids(conn, "linkit", "paatos", PAATOS_COLUMN_TYPES, decree_keys, "id")
+
+    for decree, decree_key in zip(decree_information_dicts, decree_keys):
+        for attachment_information_to_add in decree["attachments"]:
+            attachment_information_to_add["id_paatos"] = decree_ids[decree_key]
 
-                    curs.execute(insert_query, [decree['kuvaus'], decree['paivamaarapvm'], decree['feature_identifier']])
 
-                    returning = curs.fetchone()
+def add_attachments(conn:psycopg2.extensions.connection, plan_link_dicts:list, decree_information_dicts:list) -> dict:
+    """
+    Adds the attachments (liite) of the plan links and decrees that don't exist yet and sets the attachment fids of the plan links.
 
-                    decree_id = returning[0]
-        if decree['attachments'] is not []:
-            for attachment_information_to_add in decree['attachments']:
-                attachment_information_to_add['id_paatos'] = decree_id
+    All the attachments of the import are deduplicated and resolved with a single statement, so the decrees
+    must have been added with add_decrees first.
 
-                query = SQL("SELECT {columns} FROM {schema}.{table} WHERE {conditions}").format(
-                    columns=SQL(", ").join(map(Identifier, ["fid"])),
-                    schema=Identifier("linkit"),
-                    table=Identifier("liite"),
-                    conditions=SQL(" AND ").join(
-                        Composed([Identifier(column), SQL("="), Placeholder()]) for column in attachment_information_to_add.keys()
-                    )
-                )
-                with(psycopg2.connect(**conn_params)) as conn:
-                    with conn.cursor() as curs:
-                        curs.execute(query, list(attachment_information_to_add.values()))
-                        result = curs.fetchone()
-
-                        if result is None:
-                            insert_columns = SQL(', ').join(Identifier(column) for column in attachment_information_to_add.keys())
-                            insert_value_placeholders = SQL(', ').join(Placeholder() for _ in attachment_information_to_add.keys())
-                            insert_query = SQL("""
-                                INSERT INTO {schema}.{table} ({columns})
-                                VALUES ({placeholders})
-                            """).format(
-                                schema=Identifier("linkit"),
-                                table=Identifier("liite"),
-                                columns=insert_columns,
-                                placeholders=insert_value_placeholders)
-                            curs.execute(insert_query, list(attachment_information_to_add.values()))
-
-
-def add_plan_link_features(conn_params:dict, plan_link_dicts):
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
+        plan_link_dicts (list): List of dictionaries for each plan link.
+        decree_information_dicts (list): List of dictionaries for each decree, included is a list of potential attachments as dictionaries.
+
+    Returns:
+        dict: Fid of each attachment keyed by its normalised field tuple.
+    """
+    attachment_keys = [plan_link_dict["liite"] for plan_link_dict in plan_link_dicts if "liite" in plan_link_dict]
+    for decree in decree_information_dicts:
+        for attachment_information_to_add in decree["attachments"]:
+            attachment_keys.append(tuple(attachment_information_to_add.get(column) for column in LIITE_COLUMN_TYPES))
+    attachment_fids = get_or_add_fids(conn, "linkit", "liite", LIITE_COLUMN_TYPES, attachment_keys)
+
+    for plan_link_dict in plan_link_dicts:
+        plan_link_dict["fid_liite"] = attachment_fids.get(plan_link_dict.pop("liite", None))
+    return attachment_fids
+
+
+def add_plan_link_features(conn:psycopg2.extensions.connection, plan_link_dicts:list) -> None:
     """
     Insert plan link features to the database if a feature with the same attributes doesn't already exist.
 
+    The plan links are inserted with one statement per linked feature table.
+
     Args:
-        conn_params (dict): Connection parameters to the postgis database. 
+        conn (psycopg2.extensions.connection): Connection to the postgis database. 
         plan_link_dicts (list): List of dictionaries for each plan link.
     
     Returns:
         None
     """
+    grouped_plan_links = {}
     for plan_link_dict in plan_link_dicts:
-        for key in plan_link_dict:
-            if key.startswith("fid_"):
-                feature_identifier = plan_link_dict[key]
-                feature_column = key
-        with(psycopg2.connect(**conn_params)) as conn:
-            with conn.cursor() as curs:
-                if feature_column == "fid_viheralueenosa":
-                    sub_schema = "viheralue"
-                elif feature_column == "fid_katualueenosa" or feature_column == "fid_ajoratamerkinta":
-                    sub_schema = "katualue"
-                elif feature_column in ["fid_pysakointiruutu","fid_ymparistotaide","fid_rakenne", "fid_hulevesi"]:
-                    sub_schema = "kohteet"
-                else:
-                    sub_schema = "varusteet"
-
-                select_query = SQL(
-                    """SELECT EXISTS (
-                    SELECT 1 FROM linkit.suunnitelmalinkki
-                    WHERE suunnitelmakohdeid={suunnitelmakohdeid_value}
-                        AND fid_liite={fid_liite_value}
-                        AND {feature_column}=(
-                            SELECT fid FROM {sub_schema}.{sub_table}
-                                WHERE identifier={feature_identifier} LIMIT 1
-                            )
-                        )"""
-                    ).format(
-                        suunnitelmakohdeid_value=Placeholder(),
-                        fid_liite_value=Placeholder(),
-                        feature_column=Identifier(feature_column),
-                        sub_schema=Identifier(sub_schema),
-                        sub_table=Identifier(key.removeprefix("fid_")),
-                        feature_identifier=Placeholder()
+        feature_column = next(key for key in plan_link_dict if key.startswith("fid_") and key != "fid_liite")
+        grouped_plan_links.setdefault(feature_column, {})[
+            (plan_link_dict.get("suunnitelmakohdeid"), plan_link_dict.get("fid_liite"), plan_link_dict[feature_column])
+        ] = None
+
+    with conn.cursor() as curs:
+        for feature_column, plan_links in grouped_plan_links.items():
+            feature_table = feature_column.removeprefix("fid_")
+            insert_query = SQL("""
+                INSERT INTO linkit.suunnitelmalinkki (suunnitelmakohdeid, fid_liite, {feature_column})
+                    SELECT v.suunnitelmakohdeid, v.fid_liite, f.fid
+                    FROM (VALUES %s) AS v (suunnitelmakohdeid, fid_liite, identifier)
+                    LEFT JOIN LATERAL (
+                        SELECT fid FROM {sub_schema}.{sub_table} WHERE identifier = v.identifier LIMIT 1
+                    ) AS f ON true
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM linkit.suunnitelmalinkki AS s
+                            WHERE s.suunnitelmakohdeid = v.suunnitelmakohdeid
+                                AND s.fid_liite IS NOT DISTINCT FROM v.fid_liite
+                                AND s.{feature_column} = f.fid
                     )
+            """).format(
+                feature_column=Identifier(feature_column),
+                sub_schema=Identifier(TABLE_TO_SCHEMA[feature_table]),
+                sub_table=Identifier(feature_table))
+            execute_values(curs, insert_query.as_string(curs), list(plan_links), template="(%s, %s::bigint, %s)", page_size=len(plan_links))
+
 
-                curs.execute(select_query, [plan_link_dict['suunnitelmakohdeid'], plan_link_dict['fid_liite'], feature_identifier])
-                select_result = curs.fetchone()
-
-                if select_result is not None:
-                    feature_exists = select_result[0]
-                if not feature_exists:
-                    insert_query = SQL("""
-                        INSERT INTO linkit.suunnitelmalinkki (suunnitelmakohdeid, fid_liite, {feature_column})
-                            VALUES(
-                            {suunnitelmakohdeid_value},
-                            {fid_liite_value},
-                            (SELECT fid FROM {sub_schema}.{sub_table} WHERE identifier={feature_identifier_value} LIMIT 1)
-                            )"""
-                        ).format(
-                        feature_column=Identifier(feature_column),
-                        suunnitelmakohdeid_value=Placeholder(),
-                        fid_liite_value=Placeholder(),
-                        sub_schema=Identifier(sub_schema),
-                        sub_table=Identifier(key.removeprefix("fid_")),
-                        feature_identifier_value = Placeholder()
-                        )
-                    curs.execute(insert_query, [plan_link_dict["suunnitelmakohdeid"], plan_link_dict["fid_liite"], feature_identifier])
-
-
-def get_values_from_xml(table: str, tree: ET.ElementTree, results_dicts:dict, conn_params:dict, enumeration_tables:dict, plan_link_dicts:list, decree_information_dicts:list, import_from_api:bool) -> tuple[list, dict, list, list]:
+def get_source_epsg(gml_element: ET.Element) -> int:
     """
-    Main loop for iterating over the gml file and reading the elements table by table and retrieving their values to be used in building the insert query later.
+    Gets the EPSG code of a gml geometry's coordinates from its srsName.
 
     Args:
-        table (str): Name of the table being iterated over.
-        tree (ET.ElementTree): XML tree.
-        results_dicts(dict): Dictionary containing which elements belong to are elements (katualue etc.)
-        conn_params (dict): Connection parameters to the postgis database. 
-        enumeration_tables (dict): Dictionary of dictionaries for reading values and if needed adding for enumeration tables.
-        plan_link_dicts (list): List of plan link features to be added later being updated in this function.
-        decree_information_dicts (list): List of decree features to be added later.
-        import_from_api (bool): True if importing from api, false if importing from file.
+        gml_element (ET.Element): The gml geometry element.
 
     Returns:
-        A tuple containing the following variables:
-        - values_dict: list of dictionaries for each feature of the element type being iterated over.
-        - enumeration_tables: updated dictionary of dictionaries containing cached enumeration tables.
-        - plan_link_dicts: Updated list of plan link features to be added later.
-        - decree_information_dicts: Updated list of decree features to be added later.
+        int: The EPSG code, 4326 if the srsName is not recognised or None if the geometry has no srsName.
     """
-    element = TABLE_TO_ELEMENT[table][0]
-    element_dict = TABLE_TO_ELEMENT[table][1]
-
-    root = tree.getroot()
+    if "srsName" not in gml_element.attrib:
+        return None
+    match = next((srs for srs in SRS_LIST if srs in gml_element.attrib["srsName"]), None)
+    if match is None:
+        match = "4326"
+    return int(match)
 
-    values_dict = []
 
-    if import_from_api:
-        f_members = root.findall("{http://www.opengis.net/wfs/2.0}member")
-        if f_members == []:
-            f_members = root.findall("{http://www.opengis.net/ogcapi-features-1/1.0/sf}featureMember")
+def get_feature_values(feature: ET.Element, table: str, koodistot: Koodistot, plan_link_dicts: list, decree_information_dicts: list, area_references: list) -> dict:
+    """
+    Reads the values of a single feature element to be used in building the insert query later.
 
-        features = []
+    Args:
+        feature (ET.Element): The feature element being read.
+        table (str): Name of the table the feature belongs to.
+        koodistot (Koodistot): Code lists for reading the values of enumeration columns.
+        plan_link_dicts (list): List of plan link features to be added later being updated in this function.
+        decree_information_dicts (list): List of decree features to be added later.
+        area_references (list): List the areas the feature belongs to are appended to as tuples (table, feature identifier, column, area table, area identifier) to be resolved after all features have been added.
 
-        for f_member in f_members:
-            f_member_children = f_member.findall(f"./{element}") # TODO: search by tag?
-            for f_member_child in f_member_children:
-                features.append(f_member_child)
-    else:
-        features = root.findall(f".//{element}")
+    Returns:
+        dict: The values of the feature keyed by column name.
+    """
+    element = TABLE_TO_ELEMENT[table][0]
+    element_dict = TABLE_TO_ELEMENT[table][1]
 
     tags = list(element_dict.keys())
 
     if table != "katualue" or table != "viheralue":
         tags.extend(SIJAINTI_TAGS)
 
-    for feature in features:
-        value_dict = {key: "-1" if key.startswith("cid_") else None for key in element_dict.values() if key != "skip"}
-        for tag in tags:
-            children = feature.findall(f"./{tag}")
-            if children is not None:
-                for child in children:
-                    if child.text == None or len(element) > 0:
-                        if not child.tag in [CORE_NS_LONG + "paatostieto", CORE_NS_LONG + "suunnitelmalinkkitieto", CORE_NS_LONG + "metatieto", CORE_NS_LONG + "kuuluuKatualueeseen", CORE_NS_LONG + "kuuluuViheralueeseen", CORE_NS_LONG + "kuuluuKatuAlueenOsaan", CORE_NS_LONG + "kuuluuViheralueenOsaan", CORE_NS_LONG + "tarkkaSijaintitieto", CORE_NS_LONG + "sijaintitieto", CORE_NS_LONG + "sijainti",]:
-                            column = element_dict[child.tag]
-                            value = child.text
-                            if column.startswith('cid_'):
-                                enumeration_dict = enumeration_tables.get(column)
-                                if enumeration_dict is None:
-                                    enumeration_tables = add_enumeration_values(conn_params, enumeration_tables, column)
-                                    enumeration_dict = enumeration_tables[column]
-                                try:
-                                    value = enumeration_tables[column][value]
-                                except KeyError:
-                                    value = -1
-                                    LOGGER.info(f'Kohteen "{feature.tag}.{value_dict.get(element_dict[CORE_NS_LONG + "yksilointitieto"])}" enumeraatioarvo "{child.text}" kentässä "{child.tag}" ei löytynyt.')
-                            value_dict[element_dict[child.tag]] = value
-                        elif child.tag == CORE_NS_LONG + "metatieto":
-                            meta_children = child.findall("./gml:metaDataProperty/gml:GenericMetaData/*", GML_NS_LONG_DICT)
-                            if meta_children is not None:
-                                for meta_child in meta_children:
-                                    value_dict[element_dict[meta_child.tag]] = meta_child.text
-                        elif child.tag == CORE_NS_LONG + "paatostieto":
-                            decree_information_dict = {}
-
-                            decree_description = child.find(f"./*/{CORE_NS_LONG + 'kuvaus'}")
-                            decree_description_value = decree_description.text if decree_description is not None else None
-                            
-                            decree_date = child.find(f"./*/{CORE_NS_LONG + 'paivamaaraPvm'}")
-                            decree_date_value = decree_date.text if decree_date is not None else None
-
-                            decree_information_dict['kuvaus'] = decree_description_value
-                            decree_information_dict['paivamaarapvm'] = decree_date_value
-
-                            attachments = child.findall(f"./*/{CORE_NS_LONG + 'liitetieto'}/*")
-
-                            attachment_list = []
-
-                            if attachments is not None:
-                                for attachment in attachments:
-                                    attachment_information_to_add = {key: None for key in INFRAO_LIITE_TAGS.values()}
-                                    for attachment_field in attachment:
-                                        attachment_information_to_add[INFRAO_LIITE_TAGS[attachment_field.tag]] = attachment_field.text
-                                    attachment_list.append(attachment_information_to_add)
-
-                            decree_information_dict["feature_identifier"] = value_dict["identifier"]
-                            decree_information_dict["attachments"] = attachment_list
-
-                            decree_information_dicts.append(decree_information_dict)
-                        elif child.tag == CORE_NS_LONG + "suunnitelmalinkkitieto":
-                            plan_link_dict = {}
-                            attachment = child.find(f"./*/{CORE_NS_LONG + 'liitetieto'}/*")
-                            if attachment is not None:
+    feature_area_references = []
+    value_dict = {key: "-1" if key.startswith("cid_") else None for key in element_dict.values() if key != "skip"}
+    for tag in tags:
+        children = feature.findall(f"./{tag}")
+        if children is not None:
+            for child in children:
+                if child.text == None or len(element) > 0:
+                    if not child.tag in [CORE_NS_LONG + "paatostieto", CORE_NS_LONG + "suunnitelmalinkkitieto", CORE_NS_LONG + "metatieto", CORE_NS_LONG + "kuuluuKatualueeseen", CORE_NS_LONG + "kuuluuViheralueeseen", CORE_NS_LONG + "kuuluuKatuAlueenOsaan", CORE_NS_LONG + "kuuluuViheralueenOsaan", CORE_NS_LONG + "tarkkaSijaintitieto", CORE_NS_LONG + "sijaintitieto", CORE_NS_LONG + "sijainti",]:
+                        column = element_dict[child.tag]
+                        value = child.text
+                        if column.startswith('cid_'):
+                            try:
+                                value = koodistot.cid(column, value)
+                            except KeyError:
+                                value = -1
+                                LOGGER.info(f'Kohteen "{feature.tag}.{value_dict.get(element_dict[CORE_NS_LONG + "yksilointitieto"])}" enumeraatioarvo "{child.text}" kentässä "{child.tag}" ei löytynyt.')
+                        value_dict[element_dict[child.tag]] = value
+                    elif child.tag == CORE_NS_LONG + "metatieto":
+                        meta_children = child.findall("./gml:metaDataProperty/gml:GenericMetaData/*", GML_NS_LONG_DICT)
+                        if meta_children is not None:
+                            for meta_child in meta_children:
+                                value_dict[element_dict[meta_child.tag]] = meta_child.text
+                    elif child.tag == CORE_NS_LONG + "paatostieto":
+                        decree_information_dict = {}
+
+                        decree_description = child.find(f"./*/{CORE_NS_LONG + 'kuvaus'}")
+                        decree_description_value = decree_description.text if decree_description is not None else None
+                        
+                        decree_date = child.find(f"./*/{CORE_NS_LONG + 'paivamaaraPvm'}")
+                        decree_date_value = decree_date.text if decree_date is not None else None
+
+                        decree_information_dict['kuvaus'] = decree_description_value
+                        decree_information_dict['paivamaarapvm'] = decree_date_value
+
+                        attachments = child.findall(f"./*/{CORE_NS_LONG + 'liitetieto'}/*")
+
+                        attachment_list = []
+
+                        if attachments is not None:
+                            for attachment in attachments:
                                 attachment_information_to_add = {key: None for key in INFRAO_LIITE_TAGS.values()}
                                 for attachment_field in attachment:
                                     attachment_information_to_add[INFRAO_LIITE_TAGS[attachment_field.tag]] = attachment_field.text
-                                query = SQL("SELECT {columns} FROM {schema}.{table} WHERE {conditions}").format(
-                                    columns=SQL(", ").join(map(Identifier, ["fid"])),
-                                    schema=Identifier("linkit"),
-                                    table=Identifier("liite"),
-                                    conditions=SQL(" AND ").join(
-                                        Composed([Identifier(column), SQL("="), Placeholder()]) for column in attachment_information_to_add.keys()
-                                    )
-                                )
-                                with(psycopg2.connect(**conn_params)) as conn:
-                                    with conn.cursor() as curs:
-                                        curs.execute(query, list(attachment_information_to_add.values()))
-                                        result = curs.fetchone()
-
-                                        if result is not None:
-                                            attachment_fid = result[0]
-                                            plan_link_dict["fid_liite"] = attachment_fid
-                                        else:
-                                            insert_columns = SQL(', ').join(Identifier(column) for column in attachment_information_to_add.keys())
-                                            insert_value_placeholders = SQL(', ').join(Placeholder() for _ in attachment_information_to_add.keys())
-                                            insert_query = SQL("""
-                                                INSERT INTO {schema}.{table} ({columns})
-                                                VALUES ({placeholders})
-                                                RETURNING fid;
-                                            """).format(
-                                                schema=Identifier("linkit"),
-                                                table=Identifier("liite"),
-                                                columns=insert_columns,
-                                                placeholders=insert_value_placeholders)
-                                            curs.execute(insert_query, list(attachment_information_to_add.values()))
-
-                                            inserted_result = curs.fetchone()
-
-                                            if inserted_result is not None:
-                                                inserted_attachment_fid = inserted_result[0]
-                                                plan_link_dict["fid_liite"] = inserted_attachment_fid
-                            plan_link_id_element = child.find(f'./*/{CORE_NS_LONG + "suunnitelmakohdeId"}')
-                            if plan_link_id_element is not None:
-                                plan_link_dict["suunnitelmakohdeid"] = plan_link_id_element.text
-                            feature_identifier = value_dict["identifier"]
-                            plan_link_dict[f"fid_{table}"] = feature_identifier
-                            plan_link_dicts.append(plan_link_dict)
-                        elif child.tag in SIJAINTI_TAGS or table == 'keskilinja' and child.tag == CORE_NS_LONG + "sijainti":
-                            gml_elem = None
-                            geom = None
-                            if table != "keskilinja":
-                                sij_creation = child.find(f"./*/{CORE_NS_LONG}luontitapa")
-                                sij_uncertainty = child.find(f"./*/{CORE_NS_LONG}sijaintiepavarmuus")
-
-                                if sij_creation is not None:
-                                    value_dict[element_dict[sij_creation.tag]] = LOCATION_CREATION_ENUMERATION[sij_creation.text]
-
-                                if sij_uncertainty is not None:
-                                    value_dict[element_dict[sij_uncertainty.tag]] = LOCATION_UNCERTAINTY_ENUMERATION[sij_uncertainty.text]
-
-                                for sij_child in child:
-                                    for geom_type in INFRAO_GEOMS:
-                                        io_geom_element = sij_child.find(f"./{geom_type}")
-                                        if io_geom_element is not None:
-                                            sij_key = io_geom_element.tag
-
-                                            gml_elem = io_geom_element.find('*')
-
-                                address = child.find(f"./*/{CORE_NS_LONG}osoitetieto")
-
-                                if address is not None:
-                                    address_fields = address.findall(f"./*/*")
-
-                                    if address_fields is not None:
-                                        address_information_to_add = {key: None for key in INFRAO_OSOITE_TAGS.values() if not key.startswith("geom_")}
-
-                                        for address_field in address_fields:
-                                            if address_field.tag != CORE_NS_LONG + "nimitieto" and address_field.tag not in [CORE_NS_LONG + "pistesijainti", CORE_NS_LONG + "aluesijainti", CORE_NS_LONG + "viivasijainti",]:
-                                                address_information_to_add[INFRAO_OSOITE_TAGS[address_field.tag]] = address_field.text
-                                            elif address_field.tag == CORE_NS_LONG + "nimitieto":
-                                                name_information = address_field.find(f"./*/*")
-                                                address_information_to_add[INFRAO_OSOITE_TAGS[address_field.tag]] = name_information.text
-
-                                        query = SQL("SELECT {columns} FROM {schema}.{table} WHERE {conditions}").format(
-                                                        columns=SQL(", ").join(map(Identifier, ["fid"])),
-                                                        schema=Identifier("osoite"),
-                                                        table=Identifier("osoite"),
-                                                        conditions=SQL(" AND ").join(
-                                                            Composed([Identifier(column), SQL("="), Placeholder()]) for column, value in address_information_to_add.items() if value is not None
-                                                        )
-                                                    )
-                                        
-                                        with(psycopg2.connect(**conn_params)) as conn:
-                                            with conn.cursor(cursor_factory=DictCursor) as curs:
-                                                query_values = [value for value in address_information_to_add.values() if value is not None]
-                                                curs.execute(query, query_values)
-                                                result = curs.fetchone()
-
-                                                if result is not None:
-                                                    address_fid = result[0]
-                                                    value_dict["fid_osoite"] = address_fid
-                                                else:
-                                                    insert_columns = SQL(', ').join(Identifier(column) for column, value in address_information_to_add.items() if value is not None)
-                                                    insert_value_placeholders = SQL(', ').join(Placeholder() for value in address_information_to_add.values() if value is not None)
-                                                    insert_query = SQL("""
-                                                        INSERT INTO {schema}.{table} ({columns})
-                                                        VALUES ({placeholders})
-                                                        RETURNING fid;
-                                                    """).format(
-                                                        schema=Identifier("osoite"),
-                                                        table=Identifier("osoite"),
-                                                        columns=insert_columns,
-                                                        placeholders=insert_value_placeholders)
-                                                    curs.execute(insert_query, query_values)
-
-                                                    inserted_result = curs.fetchone()
-
-                                                    if inserted_result is not None:
-                                                        inserted_address_fid = inserted_result[0]
-                                                        value_dict["fid_osoite"] = inserted_address_fid
-                            else:
-                                gml_elem = child.find('*')
-                                sij_key = child.tag
-                            if gml_elem is not None:
-                                gml_string = ET.tostring(gml_elem).decode('utf-8')
-                                geom = ogr.CreateGeometryFromGML(gml_string)
-                            if geom is not None:
-                                geom_type = geom.GetGeometryType()
-                                if geom_type == 1010 or geom_type == 10:
-                                    geom = ogr.ForceToPolygon(geom)
-                                if geom_type == 9 or geom_type == 1009 or geom_type == 8 or geom_type == 1008:
-                                    geom = ogr.ForceToLineString(geom)
-                                geom_wkb = geom.ExportToWkb()
-                                if "srsName" in gml_elem.attrib:
-                                    match = next((srs for srs in SRS_LIST if srs in gml_elem.attrib["srsName"]), None)
-                                    if match is None:
-                                        match = "4326"
-                                    
-                                    source_crs = QgsProject.instance().crs().fromEpsgId(int(match))
-                                    target_crs = QgsProject.instance().crs().fromEpsgId(SYSTEM_EPSG)
-
-                                    qgs_geom = QgsGeometry()
-                                    qgs_geom.fromWkb(geom_wkb)
-                                    transform = QgsCoordinateTransform(source_crs, target_crs, QgsProject.instance())
-
-                                    qgs_geom.transform(transform)
-                                    
-                                    geom_wkb = bytes(qgs_geom.asWkb())
-                                geom.Set3D(True)
-                                try:
-                                    value_dict[element_dict[sij_key]] = geom_wkb
-                                except:
-                                    LOGGER.info(f"Ongelma kohteen {feature.tag}.{value_dict.get(element_dict[CORE_NS_LONG + 'yksilointitieto'])} geometrian lisäämisessä.")
-                            else:
-                                LOGGER.info(f"Ongelma kohteen {feature.tag}.{value_dict.get(element_dict[CORE_NS_LONG + 'yksilointitieto'])} geometrian lukemisessa.")
-                                pass
-                        elif child.tag.startswith(CORE_NS_LONG + "kuuluu"):
-                            try:
-                                belong_attrib = child.attrib[XLINK_NS_LONG + "href"]
-                                dot_pos = belong_attrib.find('.')
-                                if dot_pos != -1:
-                                    id = belong_attrib[dot_pos + 1:]
-                                    try:
-                                        value_dict[element_dict[child.tag]] = results_dicts[AREA_TAG_TO_TABLE[child.tag]][id]
-                                    except:
-                                        LOGGER.info(f"Kohteen {feature.tag}.{value_dict.get(element_dict[CORE_NS_LONG + 'yksilointitieto'])} sisältävän alueen yksilöintitietoa ei löytynyt.")
-                                        pass
-                            except KeyError:
-                                LOGGER.info(f"Kohteen {feature.tag} elementti {child.tag} ei sisällä xlink- attribuuttia.")
-                                pass
-        values_dict.append(value_dict)
-    return values_dict, enumeration_tables, plan_link_dicts, decree_information_dicts
+                                attachment_list.append(attachment_information_to_add)
+
+                        decree_information_dict["feature_identifier"] = value_dict["identifier"]
+                        decree_information_dict["attachments"] = attachment_list
+
+                        decree_information_dicts.append(decree_information_dict)
+                    elif child.tag == CORE_NS_LONG + "suunnitelmalinkkitieto":
+                        plan_link_dict = {}
+                        attachment = child.find(f"./*/{CORE_NS_LONG + 'liitetieto'}/*")
+                        if attachment is not None:
+                            attachment_information_to_add = {key: None for key in LIITE_COLUMN_TYPES}
+                            for attachment_field in attachment:
+                                attachment_information_to_add[INFRAO_LIITE_TAGS[attachment_field.tag]] = attachment_field.text
+                            # The attachment is resolved to a fid together with all the other attachments of the import in add_attachments.
+                            plan_link_dict["liite"] = tuple(attachment_information_to_add.values())
+                        plan_link_id_element = child.find(f'./*/{CORE_NS_LONG + "suunnitelmakohdeId"}')
+                        if plan_link_id_element is not None:
+                            plan_link_dict["suunnitelmakohdeid"] = plan_link_id_element.text
+                        feature_identifier = value_dict["identifier"]
+                        plan_link_dict[f"fid_{table}"] = feature_identifier
+                        plan_link_dicts.append(plan_link_dict)
+                    elif child.tag in SIJAINTI_TAGS or table == 'keskilinja' and child.tag == CORE_NS_LONG + "sijainti":
+                        gml_elem = None
+                        geom = None
+                        if table != "keskilinja":
+                            sij_creation = child.find(f"./*/{CORE_NS_LONG}luontitapa")
+                            sij_uncertainty = child.find(f"./*/{CORE_NS_LONG}sijaintiepavarmuus")
+
+                            if sij_creation is not None:
+                                value_dict[element_dict[sij_creation.tag]] = LOCATION_CREATION_ENUMERATION[sij_creation.text]
+
+                            if sij_uncertainty is not None:
+                                value_dict[element_dict[sij_uncertainty.tag]] = LOCATION_UNCERTAINTY_ENUMERATION[sij_uncertainty.text]
+
+                            for sij_child in child:
+                                for geom_type in INFRAO_GEOMS:
+                                    io_geom_element = sij_child.find(f"./{geom_type}")
+                                    if io_geom_element is not None:
+                                        sij_key = io_geom_element.tag
+
+                                        gml_elem = io_geom_element.find('*')
+
+                            address = child.find(f"./*/{CORE_NS_LONG}osoitetieto")
+
+                            if address is not None:
+                                address_fields = address.findall(f"./*/*")
+
+                                if address_fields is not None:
+                                    address_information_to_add = {key: None for key in INFRAO_OSOITE_TAGS.values() if not key.startswith("geom_")}
+
+                                    for address_field in address_fields:
+                                        if address_field.tag != CORE_NS_LONG + "nimitieto" and address_field.tag not in [CORE_NS_LONG + "pistesijainti", CORE_NS_LONG + "aluesijainti", CORE_NS_LONG + "viivasijainti",]:
+                                            address_information_to_add[INFRAO_OSOITE_TAGS[address_field.tag]] = address_field.text
+                                        elif address_field.tag == CORE_NS_LONG + "nimitieto":
+                                            name_information = address_field.find(f"./*/*")
+                                            address_information_to_add[INFRAO_OSOITE_TAGS[address_field.tag]] = name_information.text
+
+                                    # The address is stored as its normalised field tuple and resolved to a fid for the whole batch before it is added to the database.
+                                    address_key = tuple(address_information_to_add.values())
+                                    if any(value is not None for value in address_key):
+                                        value_dict["fid_osoite"] = address_key
+                        else:
+                            gml_elem = child.find('*')
+                            sij_key = child.tag
+                        if gml_elem is not None:
+                            # The geometry is transformed and encoded together with the other geometries of its batch by a GeometryEncoder.
+                            geom = read_gml_geometry(gml_elem, get_source_epsg(gml_elem))
+                        if geom is not None:
+                            value_dict[element_dict[sij_key]] = geom
+                        else:
+                            LOGGER.info(f"Ongelma kohteen {feature.tag}.{value_dict.get(element_dict[CORE_NS_LONG + 'yksilointitieto'])} geometrian lukemisessa.")
+                            pass
+                    elif child.tag.startswith(CORE_NS_LONG + "kuuluu"):
+                        try:
+                            belong_attrib = child.attrib[XLINK_NS_LONG + "href"]
+                            dot_pos = belong_attrib.find('.')
+                            if dot_pos != -1:
+                                id = belong_attrib[dot_pos + 1:]
+                                if child.tag in AREA_TAG_TO_TABLE:
+                                    feature_area_references.append((element_dict[child.tag], AREA_TAG_TO_TABLE[child.tag], id))
+                        except KeyError:
+                            LOGGER.info(f"Kohteen {feature.tag} elementti {child.tag} ei sisällä xlink- attribuuttia.")
+                            pass
+    for column, area_table, area_identifier in feature_area_references:
+        area_references.append((table, value_dict["identifier"], column, area_table, area_identifier))
+    return value_dict
+
+
+def get_python_executable() -> str:
+    """
+    Gets the Python interpreter used to start import worker processes.
+
+    Inside QGIS sys.executable may point to the QGIS executable instead of Python, in which case the Python
+    interpreter of the QGIS installation is searched for. Interpreters outside the installation are not used, as they
+    may be of another Python version or lack the packages of QGIS.
+
+    Returns:
+        str: Path to the Python interpreter, or None if it was not found.
+    """
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    candidates = [
+        os.path.join(sys.exec_prefix, "python.exe"),
+        os.path.join(sys.exec_prefix, "bin", f"python{sys.version_info.major}.{sys.version_info.minor}"),
+        os.path.join(sys.exec_prefix, "bin", "python3"),
+    ]
+    return next((candidate for candidate in candidates if os.path.isfile(candidate)), None)
 
 
-def build_sql_query(values_dict:list, schema:str, table:str) -> tuple[Composed, list]:
+def init_parse_worker(koodistot: Koodistot, transform_in_database: bool) -> None:
     """
-    Builds an SQL query based on the value list iteratively which adds all features to the table.
+    Sets up an import worker process.
 
     Args:
+        koodistot (Koodistot): Code lists for reading the values of enumeration columns.
+        transform_in_database (bool): True if the geometries are transformed by the database.
+
+    Returns:
+        None
+    """
+    _worker_state["koodistot"] = koodistot
+    _worker_state["geometry_encoder"] = GeometryEncoder(SYSTEM_EPSG, transform_in_database)
+
+
+def create_parse_executor(workers: int, koodistot: Koodistot, transform_in_database: bool) -> ProcessPoolExecutor:
+    """
+    Creates the process pool parsing features in parallel.
+
+    This process is set up as a worker too, so the features can be read here if the worker processes fail, see get_parsed_features.
+
+    Args:
+        workers (int): Number of worker processes.
+        koodistot (Koodistot): Code lists for reading the values of enumeration columns.
+        transform_in_database (bool): True if the geometries are transformed by the database.
+
+    Returns:
+        ProcessPoolExecutor: The process pool, or None if the Python interpreter was not found.
+    """
+    init_parse_worker(koodistot, transform_in_database)
+    executable = get_python_executable()
+    if executable is None:
+        LOGGER.info("Python-tulkkia ei löytynyt, kohteet luetaan ilman rinnakkaisia prosesseja.")
+        return None
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(executable)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_parse_worker, initargs=(koodistot, transform_in_database))
+
+
+def parse_features(table: str, features: list) -> tuple:
+    """
+    Reads the values of features serialised as bytes in an import worker process.
+
+    Args:
+        table (str): Name of the table the features belong to.
+        features (list): The feature elements serialised as bytes.
+
+    Returns:
+        tuple: Column names, row tuples with geometries as EWKB, plan link dicts, decree dicts and area references of the features.
+    """
+    plan_link_dicts = []
+    decree_information_dicts = []
+    area_references = []
+    values_dict = [
+        get_feature_values(ET.fromstring(feature), table, _worker_state["koodistot"], plan_link_dicts, decree_information_dicts, area_references)
+        for feature in features
+    ]
+    _worker_state["geometry_encoder"].encode(values_dict)
+    columns = list(values_dict[0].keys()) if values_dict else []
+    rows = [tuple(value_dict.get(column) for column in columns) for value_dict in values_dict]
+    return columns, rows, plan_link_dicts, decree_information_dicts, area_references
+
+
+def submit_parse(executor: ProcessPoolExecutor, table: str, features: list) -> Future:
+    """
+    Submits features to be read by parse_features in a worker process.
+
+    Args:
+        executor (ProcessPoolExecutor): Process pool reading the features.
+        table (str): Name of the table the features belong to.
+        features (list): The feature elements serialised as bytes.
+
+    Returns:
+        Future: The result of parse_features, or None if the worker processes have failed or could not be started.
+    """
+    try:
+        return executor.submit(parse_features, table, features)
+    except (BrokenProcessPool, OSError):
+        # The worker processes could not be started.
+        return None
+
+
+def get_parsed_features(future: Future, table: str, features: list) -> tuple:
+    """
+    Gets the result of parse_features submitted by submit_parse.
+
+    If the worker processes have failed, e.g. because they could not be started, the features are read in this process instead.
+
+    Args:
+        future (Future): The result of submit_parse.
+        table (str): Name of the table the features belong to.
+        features (list): The feature elements serialised as bytes.
+
+    Returns:
+        tuple: Result of parse_features.
+    """
+    if future is not None:
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            LOGGER.info("Rinnakkainen lukuprosessi keskeytyi, kohteet luetaan ilman rinnakkaisia prosesseja.")
+    return parse_features(table, features)
+
+
+def collect_parsed_features(parsed_features: tuple, plan_link_dicts: list, decree_information_dicts: list, area_references: list) -> list:
+    """
+    Collects the results of parse_features.
+
+    Args:
+        parsed_features (tuple): Result of parse_features.
+        plan_link_dicts (list): List of plan link features to be added later being updated in this function.
+        decree_information_dicts (list): List of decree features to be added later being updated in this function.
+        area_references (list): List of area references to be resolved later being updated in this function.
+
+    Returns:
+        list: List of dictionaries for each feature.
+    """
+    columns, rows, feature_plan_link_dicts, feature_decree_information_dicts, feature_area_references = parsed_features
+    plan_link_dicts.extend(feature_plan_link_dicts)
+    decree_information_dicts.extend(feature_decree_information_dicts)
+    area_references.extend(feature_area_references)
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def iter_xml_features(source: Union[str, IO[bytes]]) -> Iterator[Tuple[str, ET.Element]]:
+    """
+    Streams the gml file once and yields each feature element together with the name of the table it belongs to, see iter_feature_elements.
+
+    Args:
+        source (str | IO[bytes]): Path to the gml file or a binary file object.
+
+    Yields:
+        A tuple containing the table name and the feature element.
+    """
+    return iter_feature_elements(ET.iterparse(source, events=("start", "end")))
+
+
+def iter_feature_elements(events: Iterator[Tuple[str, ET.Element]]) -> Iterator[Tuple[str, ET.Element]]:
+    """
+    Yields each feature element of a document being parsed together with the name of the table it belongs to.
+
+    The document is never fully materialised: every yielded element is cleared and detached from its parent once the
+    caller resumes the generator, so the caller has to read everything it needs from the element before that.
+    The shipment information element (infrao:toimituksentiedot) is yielded with the table name aineistotoimituksentiedot.
+
+    Args:
+        events (Iterator[Tuple[str, ET.Element]]): The start and end events of the parsed document, as returned by ET.iterparse.
+
+    Yields:
+        A tuple containing the table name and the feature element.
+    """
+    record_tags = set(ELEMENT_TO_TABLE) | {SHIPMENT_INFORMATION_TAG}
+    parents = []
+    open_records = 0
+
+    for event, element in events:
+        if event == "start":
+            parents.append(element)
+            if element.tag in record_tags:
+                open_records += 1
+            continue
+
+        parents.pop()
+        if element.tag in record_tags:
+            open_records -= 1
+            yield ELEMENT_TO_TABLE.get(element.tag, "aineistotoimituksentiedot"), element
+        elif open_records:
+            # Child of a feature which hasn't been read yet.
+            continue
+
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+
+
+def format_copy_value(value) -> str:
+    """
+    Formats a single value for COPY ... FROM STDIN in the text format. Geometries (WKB bytes) are written as hex,
+    which PostGIS reads as (E)WKB.
+
+    Args:
+        value: The value to format.
+
+    Returns:
+        str: The formatted value.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def add_addresses(conn:psycopg2.extensions.connection, values_dict:list) -> None:
+    """
+    Replaces the address field tuples of the features with fids of osoite.osoite, adding the missing addresses.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
         values_dict (list): List of dictionaries for each feature to be added to the table.
-        schema (str): Name of the table's schema being inserted into.
-        table (str): Name of the table being inserted into.
-    
+
     Returns:
-        A tuple containing the following variables:
-        - query: The query as an psycopg2.sql.Composed object.
-        - values: List of the values to be inserted.
+        None
     """
-    table_name = Identifier(schema, table)
+    address_keys = [value_dict["fid_osoite"] for value_dict in values_dict if isinstance(value_dict.get("fid_osoite"), tuple)]
+    address_fids = get_or_add_fids(conn, "osoite", "osoite", OSOITE_COLUMN_TYPES, address_keys)
+    for value_dict in values_dict:
+        if isinstance(value_dict.get("fid_osoite"), tuple):
+            value_dict["fid_osoite"] = address_fids[value_dict["fid_osoite"]]
 
 
-    keys = list(values_dict[0].keys())
-    values = [value for dict in values_dict for value in dict.values()]
+def add_features_to_database(values_dict:list, schema:str, table:str, conn:psycopg2.extensions.connection, geometry_encoder:GeometryEncoder = None, batch_size:int = COPY_BATCH_SIZE) -> None:
+    """
+    Adds the features to the table by streaming them with COPY to a temporary staging table and inserting them from there.
 
-    values_template = SQL(", ").join(
-        Placeholder() if i < len(keys) - 3 or table in ['katualue', 'viheralue'] or i < len(keys) - 1 and table in ['katualueenosa', 'viheralueenosa', 'keskilinja'] else SQL("ST_Force3D(ST_GeomFromEWKB({}))").format(Placeholder())
-        for i in range(len(keys))
-    )  
+    The staging table has unconstrained geometry columns so the 2D geometries read from the file can be forced to 3D
+    with ST_Force3D on the insert-select.
+    Addresses of the features are resolved to osoite.osoite fids first with add_addresses and the geometries
+    are transformed and encoded with the geometry encoder. If the encoder leaves the transformation to the database,
+    geometries with a source srid are transformed with ST_Transform on the insert-select.
 
-    query = SQL("INSERT INTO {} ({}) VALUES {}").format(
-        table_name,
-        SQL(',').join(map(Identifier, keys)),
-        SQL(", ").join(SQL("({})").format(values_template) * len(values_dict))
-    )
-    return query, values
+    Args:
+        values_dict (list): List of dictionaries for each feature to be added to the table.
+        schema (str): Name of the table's schema being inserted into.
+        table (str): Name of the table being inserted into.
+        conn (psycopg2.extensions.connection): Connection to the postgis database. 
+        geometry_encoder (GeometryEncoder, optional): Encoder shared by the batches of the import. A new one is used if not given.
+        batch_size (int): Number of features copied to the staging table at a time.
 
+    Returns:
+        None
+    """
+    if "fid_osoite" in values_dict[0]:
+        add_addresses(conn, values_dict)
+    if geometry_encoder is None:
+        geometry_encoder = GeometryEncoder(SYSTEM_EPSG)
+    geometry_encoder.encode(values_dict)
+
+    columns = list(values_dict[0].keys())
+    geometry_value = SQL("ST_Force3D(CASE WHEN ST_SRID({column}) = 0 THEN {column} ELSE ST_Transform({column}, {epsg}) END)")
+    staging_table = Identifier(f"stage_{table}")
+
+    create_query = SQL("CREATE TEMPORARY TABLE IF NOT EXISTS {staging_table} ON COMMIT DROP AS SELECT {columns} FROM {schema}.{table} WITH NO DATA").format(
+        staging_table=staging_table,
+        columns=SQL(", ").join(
+            SQL("{column}::geometry AS {column}").format(column=Identifier(column)) if column.startswith("geom") else Identifier(column)
+            for column in columns
+        ),
+        schema=Identifier(schema),
+        table=Identifier(table))
+    copy_query = SQL("COPY {staging_table} ({columns}) FROM STDIN").format(
+        staging_table=staging_table,
+        columns=SQL(", ").join(map(Identifier, columns)))
+    insert_query = SQL("INSERT INTO {schema}.{table} ({columns}) SELECT {values} FROM {staging_table}; TRUNCATE {staging_table}").format(
+        schema=Identifier(schema),
+        table=Identifier(table),
+        columns=SQL(", ").join(map(Identifier, columns)),
+        values=SQL(", ").join(
+            (geometry_value if geometry_encoder.transform_in_database else SQL("ST_Force3D({column})")).format(column=Identifier(column), epsg=Literal(SYSTEM_EPSG))
+            if column.startswith("geom") else Identifier(column)
+            for column in columns
+        ),
+        staging_table=staging_table)
+
+    with conn.cursor() as curs:
+        curs.execute(create_query)
+        for i in range(0, len(values_dict), batch_size):
+            buffer = io.StringIO()
+            for value_dict in values_dict[i:i + batch_size]:
+                buffer.write("\t".join(format_copy_value(value_dict.get(column)) for column in columns))
+                buffer.write("\n")
+            buffer.seek(0)
+            curs.copy_expert(copy_query.as_string(curs), buffer)
+            curs.execute(insert_query)
+
+
+def add_area_references(conn:psycopg2.extensions.connection, area_references:list) -> None:
+    """
+    Sets the fids of the areas (katualue etc.) the imported features belong to after all features have been added.
 
-def add_features_to_database(query:Composed, values:list, conn_params:dict):
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
+        area_references (list): List of tuples (table, feature identifier, column, area table, area identifier).
+
+    Returns:
+        None
+    """
+    grouped_references = {}
+    for table, identifier, column, area_table, area_identifier in area_references:
+        grouped_references.setdefault((table, column, area_table), []).append((identifier, area_identifier))
+
+    with conn.cursor() as curs:
+        for (table, column, area_table), references in grouped_references.items():
+            query = SQL("""
+                UPDATE {schema}.{table} AS t
+                    SET {column} = a.fid
+                    FROM (VALUES %s) AS v (identifier, area_identifier)
+                    JOIN {area_schema}.{area_table} AS a ON a.identifier = v.area_identifier
+                    WHERE t.identifier = v.identifier AND t.{column} IS NULL
+                    RETURNING t.identifier
+            """).format(
+                schema=Identifier(TABLE_TO_SCHEMA[table]),
+                table=Identifier(table),
+                column=Identifier(column),
+                area_schema=Identifier(TABLE_TO_SCHEMA[area_table]),
+                area_table=Identifier(area_table))
+            updated = {row[0] for row in execute_values(curs, query, references, fetch=True)}
+            for identifier, _ in references:
+                if identifier not in updated:
+                    LOGGER.info(f"Kohteen {TABLE_TO_ELEMENT[table][0]}.{identifier} sisältävän alueen yksilöintitietoa ei löytynyt.")
+
+
+def get_stream_size(stream: IO[bytes]) -> int:
     """
-    Executes the insert query.
+    Gets the size of the file being streamed for reporting progress.
 
     Args:
-        query (Composed): The query that inserts features to the database.
-        values (list): The values being inserted.
-        conn_params (dict): Connection parameters to the postgis database. 
+        stream (IO[bytes]): The binary file object.
 
+    Returns:
+        int: Size of the file in bytes, or None if it is not known.
     """
-    with(psycopg2.connect(**conn_params)) as conn:
-        with conn.cursor() as curs:
-            #LOGGER.info(query.as_string(curs)) #TODO: remove
-            #LOGGER.info(values)
-            curs.execute(query, values)
+    try:
+        return os.fstat(stream.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
 
 
-def xml_import(conn_params: dict, tree:ET.ElementTree, import_from_api:bool):
+def xml_import_features(conn_params: dict, features: Iterator[Tuple[str, ET.Element]], batch_size: int = IMPORT_BATCH_SIZE, transform_in_database: bool = False, workers: int = 1, progress_callback: Callable[[float], None] = None):
     """
-    Main function for running the previous functions.
+    Imports streamed feature elements to the database.
+
+    Features are dispatched to their tables by tag and added to the database whenever a table has batch_size
+    features waiting, so the peak memory use depends on the batch size instead of the number of features. Because areas
+    may appear after the features belonging to them, area memberships are resolved after all features have been added.
+    The whole import is run in a single transaction, so an exception raised by the features iterator rolls it back.
+
+    With more than one worker, once the first batch is full the following batches are read in parallel worker processes while the main
+    process keeps reading the features and adding the read batches to the database.
 
     Args:
         conn_params (dict): Connection parameters to the postgis database.
-        tree (ET.ElementTree): XML tree.
-        import_from_api (bool): True if importing from api, false if importing from file.
-    
+        features (Iterator[Tuple[str, ET.Element]]): The table names and feature elements, see iter_xml_features.
+        batch_size (int): Number of features per table kept in memory before adding them to the database.
+        transform_in_database (bool): True to transform the geometries to the database's coordinate system with PostGIS instead of while reading them.
+        workers (int): Number of worker processes reading the features. With 1 the features are read in this process. If the worker processes fail, the features are read in this process instead.
+        progress_callback (Callable, optional): Called with the percentage of the import finished while the features left after reading them are added, from READ_PROGRESS_SHARE to 100. The features iterator reports the progress up to READ_PROGRESS_SHARE. If it raises an exception, the import is rolled back.
+
     Returns:
         None
     """
     start = time.time()
     LOGGER.info("========================================XML IMPORT STARTED========================================")
-    enumeration_tables = {}
     plan_link_dicts = []
     decree_information_dicts = []
-
-    # Iterate over the tables in this order so primary keys have been generated for related tables and update the area fid dictionary accordingly.
-
-    for schema, table in AREA_TABLE_LIST:
-        values_dict, enumeration_tables, _, _ = get_values_from_xml(table, tree, None, conn_params, enumeration_tables, plan_link_dicts, decree_information_dicts, import_from_api)
-        if not values_dict == []:
-            #LOGGER.info(f"Yritetään lisätä kohteita tauluun: {table}")
-            query, values = build_sql_query(values_dict, schema, table)
-            add_features_to_database(query, values, conn_params)
-            #LOGGER.info(f"Kohteet lisätty tauluun: {table}")
-    results_dicts = get_area_fids(conn_params)
-
-    for schema, table in AREA_PART_TABLE_LIST:
-        values_dict, enumeration_tables, plan_link_dicts, decree_information_dicts = get_values_from_xml(table, tree, results_dicts, conn_params, enumeration_tables, plan_link_dicts, decree_information_dicts, import_from_api)
-        if not values_dict == []:
-            #LOGGER.info(f"Yritetään lisätä kohteita tauluun: {table}")
-            query, values = build_sql_query(values_dict, schema, table)
-            add_features_to_database(query, values, conn_params)
-            #LOGGER.info(f"Kohteet lisätty tauluun: {table}")
-    results_dicts = get_area_fids(conn_params)
-
-    for schema, table in TABLE_LIST:
-        values_dict, enumeration_tables, plan_link_dicts, _ = get_values_from_xml(table, tree, results_dicts, conn_params, enumeration_tables, plan_link_dicts, decree_information_dicts, import_from_api)
-        if not values_dict == []:
-            #LOGGER.info(f"Yritetään lisätä kohteita tauluun: {table}")
-            query, values = build_sql_query(values_dict, schema, table)
-            add_features_to_database(query, values, conn_params)
-            #LOGGER.info(f"Kohteet lisätty tauluun: {table}")
-
-    # Add plan link and decree features and their attachments last so main feature primary keys have been generated.
-
-    add_plan_link_features(conn_params, plan_link_dicts)
-    add_decrees_and_their_attachments(conn_params, decree_information_dicts)
-    add_shipment_information(conn_params, tree)
-
-    # Refresh the QGIS canvas to see added features.
-
-    canvas = iface.mapCanvas()
-    canvas.refreshAllLayers()
+    area_references = []
+    batches = {table: [] for table in TABLE_TO_SCHEMA}
+    geometry_encoder = GeometryEncoder(SYSTEM_EPSG, transform_in_database)
+    executor = None
+    pending = deque()
+
+    def add_parsed_batch():
+        table, batch, future = pending.popleft()
+        values_dict = collect_parsed_features(get_parsed_features(future, table, batch), plan_link_dicts, decree_information_dicts, area_references)
+        add_features_to_database(values_dict, TABLE_TO_SCHEMA[table], table, conn, geometry_encoder)
+
+    def report_final_progress(stage: int):
+        if progress_callback is not None:
+            progress_callback(READ_PROGRESS_SHARE + (100 - READ_PROGRESS_SHARE) * stage / FINAL_STAGE_COUNT)
+
+    conn = psycopg2.connect(**conn_params)
+    try:
+        with conn:
+            koodistot = get_koodistot(conn, ENUMERATION_TABLES)
+            for table, element in features:
+                if table == "aineistotoimituksentiedot":
+                    add_shipment_information(conn, element)
+                    continue
+                batch = batches[table]
+                if executor is None:
+                    batch.append(get_feature_values(element, table, koodistot, plan_link_dicts, decree_information_dicts, area_references))
+                    if len(batch) >= batch_size:
+                        add_features_to_database(batch, TABLE_TO_SCHEMA[table], table, conn, geometry_encoder)
+                        batch.clear()
+                        if workers > 1:
+                            # Add the features read so far so the rest of the batches only contain serialised features.
+                            for other_table, other_batch in batches.items():
+                                if other_batch:
+                                    add_features_to_database(other_batch, TABLE_TO_SCHEMA[other_table], other_table, conn, geometry_encoder)
+                                    other_batch.clear()
+                            executor = create_parse_executor(workers, koodistot, transform_in_database)
+                            if executor is None:
+                                workers = 1
+                else:
+                    batch.append(ET.tostring(element))
+                    if len(batch) >= batch_size:
+                        pending.append((table, batch, submit_parse(executor, table, batch)))
+                        batches[table] = []
+                        while len(pending) > 2 * workers:
+                            add_parsed_batch()
+
+            for table, batch in batches.items():
+                report_final_progress(0)
+                if batch and executor is not None:
+                    pending.append((table, batch, submit_parse(executor, table, batch)))
+                elif batch:
+                    add_features_to_database(batch, TABLE_TO_SCHEMA[table], table, conn, geometry_encoder)
+            while pending:
+                report_final_progress(0)
+                add_parsed_batch()
+            report_final_progress(1)
+
+            # Add area memberships, plan link and decree features last so all primary keys have been generated.
+
+            add_area_references(conn, area_references)
+            report_final_progress(2)
+            add_decrees(conn, decree_information_dicts)
+            report_final_progress(3)
+            add_attachments(conn, plan_link_dicts, decree_information_dicts)
+            report_final_progress(4)
+            add_plan_link_features(conn, plan_link_dicts)
+            report_final_progress(5)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        conn.close()
 
     end = time.time()
     LOGGER.info("========================================XML IMPORT ENDED  ========================================")
     LOGGER.info(f"TIME ELAPSED: {round(((end-start) * 10**3)/1000, 2)} seconds.")
-    iface.messageBar().pushMessage(f"Kohteet tiedostosta {tree} tuotu onnistuneesti tietokantaan.", level=3, duration=10)
\ No newline at end of file
+
+
+def xml_import_stream(conn_params: dict, source: Union[str, IO[bytes]], batch_size: int = IMPORT_BATCH_SIZE, transform_in_database: bool = False, workers: int = 1, progress_callback: Callable[[float], None] = None):
+    """
+    Imports a gml file by streaming it once instead of parsing it to a tree, see xml_import_features.
+
+    Args:
+        conn_params (dict): Connection parameters to the postgis database.
+        source (str | IO[bytes]): Path to the gml file or a binary file object.
+        batch_size (int): Number of features per table kept in memory before adding them to the database.
+        transform_in_database (bool): True to transform the geometries to the database's coordinate system with PostGIS instead of while reading them.
+        workers (int): Number of worker processes reading the features. With 1 the features are read in this process. If the worker processes fail, the features are read in this process instead.
+        progress_callback (Callable, optional): Called with the percentage of the import finished every PROGRESS_INTERVAL features and while the features left after reading the file are added, see xml_import_features. If it raises an exception, the import is rolled back.
+
+    Returns:
+        None
+    """
+    def read_features():
+        for feature_count, feature in enumerate(iter_xml_features(stream), 1):
+            if progress_callback is not None and feature_count % PROGRESS_INTERVAL == 0:
+                progress_callback(READ_PROGRESS_SHARE * stream.tell() / stream_size if stream_size else 0)
+            yield feature
+
+    stream = open(source, "rb") if isinstance(source, str) else source
+    try:
+        stream_size = get_stream_size(stream)
+        xml_import_features(conn_params, read_features(), batch_size, transform_in_database, workers, progress_callback)
+    finally:
+        if stream is not source:
+            stream.close()
@@ -0,0 +1,260 @@
+#  Gispo Ltd., hereby disclaims all copyright interest in the program infrao-plugin
+#  Copyright (C) 2023 Gispo Ltd (https://www.gispo.fi/).
+#
+#
+#  This file is part of infrao-plugin.
+#
+#  infrao-plugin is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  infrao-plugin is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with infrao-plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import psycopg2
+from psycopg2.sql import SQL, Identifier, Literal
+
+from ...qgis_plugin_tools.tools.resources import plugin_name, profile_path
+
+
+
+KOODISTOT_SCHEMA = "koodistot"
+# Table with the version stamp of the code lists, updated by triggers on the code list tables.
+KOODISTOT_VERSION_TABLE = ("meta", "koodistoversio")
+
+LOGGER = logging.getLogger(plugin_name())
+
+# Loaded code lists of each database keyed by (host, port, dbname), kept for the QGIS session. They are also saved in the
+# profile directory of the plugin, see get_koodistot.
+_KOODISTOT_CACHE = {}
+
+
+class Koodistot:
+    """
+    Code lists (koodistot) of a database with lookups in both directions.
+
+    Attributes:
+        cids (dict): Code of each description (selite) keyed by code list table name.
+        selites (dict): Description (selite) of each code keyed by code list table name.
+        fingerprint (tuple): Version of the code lists when they were loaded, see get_version.
+    """
+
+    def __init__(self, cids: dict, selites: dict, fingerprint: tuple):
+        self.cids = cids
+        self.selites = selites
+        self.fingerprint = fingerprint
+
+    def cid(self, column: str, selite: str) -> int:
+        """
+        Gets the code of a description.
+
+        Args:
+            column (str): Code list table name or foreign key column (cid_*) referring to it.
+            selite (str): Description of the code.
+
+        Returns:
+            int: The code.
+
+        Raises:
+            KeyError: If the description is not in the code list.
+        """
+        return self.cids[column.removeprefix("cid_")][selite]
+
+    def selite(self, column: str, cid: int) -> str:
+        """
+        Gets the description of a code.
+
+        Args:
+            column (str): Code list table name or foreign key column (cid_*) referring to it.
+            cid (int): The code.
+
+        Returns:
+            str: Description of the code or None if the code is not in the code list.
+        """
+        return self.selites[column.removeprefix("cid_")].get(cid)
+
+
+def get_fingerprint(conn: psycopg2.extensions.connection) -> tuple:
+    """
+    Gets a checksum of the rows of each table in the koodistot schema.
+
+    The checksums are computed from the committed rows of the code lists, so comparing them tells whether cached code lists are still valid.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
+
+    Returns:
+        tuple: Tuples of the table name and the checksum of its rows, ordered by table name.
+    """
+    with conn.cursor() as curs:
+        curs.execute(SQL("SELECT tablename FROM pg_tables WHERE schemaname = {schema}").format(schema=Literal(KOODISTOT_SCHEMA)))
+        tables = [table for table, in curs.fetchall()]
+        if not tables:
+            return ()
+        query = SQL(" UNION ALL ").join(
+            SQL("SELECT {table_name}, md5(coalesce(string_agg(t::text, ',' ORDER BY t::text), '')) FROM {schema}.{table} t").format(
+                table_name=Literal(table),
+                schema=Identifier(KOODISTOT_SCHEMA),
+                table=Identifier(table))
+            for table in tables
+        )
+        curs.execute(query)
+        return tuple(sorted(curs.fetchall()))
+
+
+def get_version(conn: psycopg2.extensions.connection) -> tuple:
+    """
+    Gets the version stamp of the code lists, which changes whenever a code list table is modified.
+
+    The stamp is maintained by triggers, see V1.1.0__koodistot_version.sql. Databases created before it was added are checked with the checksums of the code list tables instead, see get_fingerprint.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
+
+    Returns:
+        tuple: The version of the code lists.
+    """
+    schema, table = KOODISTOT_VERSION_TABLE
+    with conn.cursor() as curs:
+        curs.execute(SQL("SELECT to_regclass({})").format(Literal(f"{schema}.{table}")))
+        if curs.fetchone()[0] is not None:
+            curs.execute(SQL("SELECT versiotunniste::text FROM {schema}.{table}").format(schema=Identifier(schema), table=Identifier(table)))
+            row = curs.fetchone()
+            if row is not None:
+                return (("versiotunniste", row[0]),)
+    return get_fingerprint(conn)
+
+
+def load_code_lists(conn: psycopg2.extensions.connection, tables: list) -> tuple:
+    """
+    Fetches the given code lists with a single query.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
+        tables (list): Names of the code list tables.
+
+    Returns:
+        tuple: Dictionaries of selite->cid and cid->selite maps keyed by table name.
+    """
+    cids = {table: {} for table in tables}
+    selites = {table: {} for table in tables}
+    if not tables:
+        return cids, selites
+    query = SQL(" UNION ALL ").join(
+        SQL("SELECT {table_name}, cid, selite FROM {schema}.{table}").format(
+            table_name=Literal(table),
+            schema=Identifier(KOODISTOT_SCHEMA),
+            table=Identifier(table))
+        for table in tables
+    )
+    with conn.cursor() as curs:
+        curs.execute(query)
+        for table, cid, selite in curs.fetchall():
+            cids[table][selite] = cid
+            selites[table][cid] = selite
+    return cids, selites
+
+
+def get_cache_path(directory: str, key: tuple) -> str:
+    name = hashlib.sha256("\n".join(map(str, key)).encode("utf-8")).hexdigest()
+    return os.path.join(directory, f"{name}.json")
+
+
+def read_cached_koodistot(path: str) -> Koodistot:
+    """
+    Reads code lists saved by write_cached_koodistot.
+
+    Args:
+        path (str): Path of the saved code lists.
+
+    Returns:
+        Koodistot: The code lists, or None if they could not be read.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as cache_file:
+            saved = json.load(cache_file)
+        code_lists = saved["code_lists"]
+        cids = {table: {selite: cid for cid, selite in rows} for table, rows in code_lists.items()}
+        selites = {table: {cid: selite for cid, selite in rows} for table, rows in code_lists.items()}
+        return Koodistot(cids, selites, tuple(map(tuple, saved["fingerprint"])))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_cached_koodistot(path: str, koodistot: Koodistot) -> None:
+    """
+    Saves code lists to a file, replacing the file only once it has been written.
+
+    Args:
+        path (str): Path of the saved code lists.
+        koodistot (Koodistot): The code lists.
+
+    Returns:
+        None
+    """
+    saved = {
+        "fingerprint": koodistot.fingerprint,
+        "code_lists": {table: list(selites.items()) for table, selites in koodistot.selites.items()},
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as cache_file:
+                json.dump(saved, cache_file)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+    except OSError:
+        LOGGER.info(f"Koodistoja ei voitu tallentaa tiedostoon {path}.")
+
+
+def get_koodistot(conn: psycopg2.extensions.connection, tables: list, cache_directory: str = None) -> Koodistot:
+    """
+    Gets the code lists of the database, fetching them only if they are not cached or have changed since they were cached.
+
+    The code lists are cached for the QGIS session and saved per database in cache_directory, so they are not fetched
+    again in later sessions while their version stays the same, see get_version. Code lists missing from the cached ones
+    are fetched and added to the cache.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection to the postgis database.
+        tables (list): Names of the code list tables needed.
+        cache_directory (str, optional): The directory the code lists are saved in. Defaults to the koodistot directory in the profile directory of the plugin.
+
+    Returns:
+        Koodistot: The code lists.
+    """
+    key = (conn.info.host, conn.info.port, conn.info.dbname)
+    fingerprint = get_version(conn)
+    koodistot = _KOODISTOT_CACHE.get(key)
+    path = get_cache_path(cache_directory or profile_path(plugin_name(), "koodistot"), key)
+
+    if koodistot is None or koodistot.fingerprint != fingerprint:
+        koodistot = read_cached_koodistot(path)
+    if koodistot is None or koodistot.fingerprint != fingerprint:
+        LOGGER.info("Haetaan koodistot tietokannasta.")
+        koodistot = Koodistot(*load_code_lists(conn, list(tables)), fingerprint)
+        write_cached_koodistot(path, koodistot)
+    else:
+        missing_tables = [table for table in tables if table not in koodistot.cids]
+        if missing_tables:
+            cids, selites = load_code_lists(conn, missing_tables)
+            koodistot.cids.update(cids)
+            koodistot.selites.update(selites)
+            write_cached_koodistot(path, koodistot)
+    _KOODISTOT_CACHE[key] = koodistot
+    return koodistot
@@ -0,0 +1,50 @@
+-- Version stamp of the code lists (koodistot).
+-- The stamp is replaced by a statement trigger whenever the rows of a code list table change, so the plugin
+-- can check with a single-row query whether the code lists it has cached are still valid.
+
+-- object: meta.koodistoversio | type: TABLE --
+-- DROP TABLE IF EXISTS meta.koodistoversio CASCADE;
+CREATE TABLE IF NOT EXISTS meta.koodistoversio (
+	id boolean NOT NULL DEFAULT true,
+	versiotunniste uuid NOT NULL DEFAULT gen_random_uuid(),
+	muokattuhetki timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT koodistoversio_pk PRIMARY KEY (id),
+	CONSTRAINT koodistoversio_yksi_rivi CHECK (id)
+);
+-- ddl-end --
+COMMENT ON TABLE meta.koodistoversio IS E'Koodistojen versio. Versiotunniste vaihtuu aina, kun jonkin koodistot-skeeman taulun rivit muuttuvat.';
+-- ddl-end --
+ALTER TABLE meta.koodistoversio OWNER TO infrao_admin;
+-- ddl-end --
+
+INSERT INTO meta.koodistoversio DEFAULT VALUES ON CONFLICT DO NOTHING;
+-- ddl-end --
+
+-- object: meta.paivita_koodistoversio | type: FUNCTION --
+-- DROP FUNCTION IF EXISTS meta.paivita_koodistoversio() CASCADE;
+CREATE OR REPLACE FUNCTION meta.paivita_koodistoversio ()
+	RETURNS trigger
+	LANGUAGE plpgsql
+	AS $$
+BEGIN
+	UPDATE meta.koodistoversio SET versiotunniste = gen_random_uuid(), muokattuhetki = now();
+	RETURN NULL;
+END;
+$$;
+-- ddl-end --
+ALTER FUNCTION meta.paivita_koodistoversio() OWNER TO infrao_admin;
+-- ddl-end --
+
+-- object: paivita_koodistoversio | type: TRIGGER --
+-- Added to every table of the koodistot schema.
+DO $$
+DECLARE
+	taulu text;
+BEGIN
+	FOR taulu IN SELECT tablename FROM pg_tables WHERE schemaname = 'koodistot' LOOP
+		EXECUTE format('DROP TRIGGER IF EXISTS paivita_koodistoversio ON koodistot.%I', taulu);
+		EXECUTE format('CREATE TRIGGER paivita_koodistoversio AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON koodistot.%I FOR EACH STATEMENT EXECUTE FUNCTION meta.paivita_koodistoversio()', taulu);
+	END LOOP;
+END;
+$$;
+-- ddl-end --
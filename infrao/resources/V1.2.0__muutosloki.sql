@@ -0,0 +1,82 @@
+-- Change log of the exported feature tables.
+-- Statement triggers record the fid and identifier of every inserted, updated and deleted feature together with the
+-- transaction that changed it, so an export of changes can select exactly the features changed after the previous
+-- shipment and tell the receiver which features have been deleted.
+
+-- object: meta.muutosloki | type: TABLE --
+-- DROP TABLE IF EXISTS meta.muutosloki CASCADE;
+CREATE TABLE IF NOT EXISTS meta.muutosloki (
+	id bigint NOT NULL GENERATED ALWAYS AS IDENTITY ,
+	skeema text NOT NULL,
+	taulu text NOT NULL,
+	fid bigint NOT NULL,
+	identifier text,
+	toiminto text NOT NULL,
+	muutoshetki timestamptz NOT NULL DEFAULT clock_timestamp(),
+	transaktio xid8 NOT NULL DEFAULT pg_current_xact_id(),
+	CONSTRAINT muutosloki_pk PRIMARY KEY (id),
+	CONSTRAINT muutosloki_toiminto CHECK (toiminto IN ('INSERT', 'UPDATE', 'DELETE'))
+);
+-- ddl-end --
+COMMENT ON TABLE meta.muutosloki IS E'Kohdetauluihin tehdyt lisäykset, muutokset ja poistot. Muutosten vienti valitsee kohteet, joita muuttaneet transaktiot eivät näkyneet edellisen toimituksen tilanteessa.';
+-- ddl-end --
+COMMENT ON COLUMN meta.muutosloki.transaktio IS E'Muutoksen tehneen transaktion tunniste';
+-- ddl-end --
+ALTER TABLE meta.muutosloki OWNER TO infrao_admin;
+-- ddl-end --
+
+-- object: muutosloki_taulu_idx | type: INDEX --
+-- DROP INDEX IF EXISTS meta.muutosloki_taulu_idx CASCADE;
+CREATE INDEX IF NOT EXISTS muutosloki_taulu_idx ON meta.muutosloki (skeema, taulu, transaktio);
+-- ddl-end --
+
+-- object: meta.aineistotoimituksentiedot.tilanne | type: COLUMN --
+ALTER TABLE meta.aineistotoimituksentiedot ADD COLUMN IF NOT EXISTS tilanne pg_snapshot;
+-- ddl-end --
+COMMENT ON COLUMN meta.aineistotoimituksentiedot.tilanne IS E'Tietokannan tilanne (snapshot), jossa toimituksen kohteet luettiin. Seuraava muutosten vienti vie kohteet, joiden muutokset eivät näkyneet tässä tilanteessa.';
+-- ddl-end --
+
+-- object: meta.kirjaa_muutokset | type: FUNCTION --
+-- DROP FUNCTION IF EXISTS meta.kirjaa_muutokset() CASCADE;
+CREATE OR REPLACE FUNCTION meta.kirjaa_muutokset ()
+	RETURNS trigger
+	LANGUAGE plpgsql
+	AS $$
+BEGIN
+	IF TG_OP = 'DELETE' THEN
+		INSERT INTO meta.muutosloki (skeema, taulu, fid, identifier, toiminto)
+			SELECT TG_TABLE_SCHEMA, TG_TABLE_NAME, vanhat.fid, vanhat.identifier, TG_OP FROM vanhat;
+	ELSE
+		INSERT INTO meta.muutosloki (skeema, taulu, fid, identifier, toiminto)
+			SELECT TG_TABLE_SCHEMA, TG_TABLE_NAME, uudet.fid, uudet.identifier, TG_OP FROM uudet;
+	END IF;
+	RETURN NULL;
+END;
+$$;
+-- ddl-end --
+ALTER FUNCTION meta.kirjaa_muutokset() OWNER TO infrao_admin;
+-- ddl-end --
+
+-- object: kirjaa_lisaykset, kirjaa_muutokset, kirjaa_poistot | type: TRIGGER --
+-- Added to every exported feature table.
+DO $$
+DECLARE
+	taulu text;
+BEGIN
+	FOREACH taulu IN ARRAY ARRAY[
+		'varusteet.jate', 'varusteet.kaluste', 'varusteet.leikkivaline', 'varusteet.liikunta', 'varusteet.melukohde',
+		'varusteet.muuvaruste', 'varusteet.opaste', 'varusteet.liikennemerkki', 'viheralue.viheralueenosa',
+		'viheralue.viheralue', 'katualue.katualue', 'katualue.katualueenosa', 'katualue.keskilinja',
+		'katualue.ajoratamerkinta', 'kasvillisuus.puu', 'kasvillisuus.muukasvi', 'kohteet.erikoisrakennekerros',
+		'kohteet.hulevesi', 'kohteet.pysakointiruutu', 'kohteet.rakenne', 'kohteet.ymparistotaide'
+	] LOOP
+		EXECUTE format('DROP TRIGGER IF EXISTS kirjaa_lisaykset ON %s', taulu);
+		EXECUTE format('DROP TRIGGER IF EXISTS kirjaa_muutokset ON %s', taulu);
+		EXECUTE format('DROP TRIGGER IF EXISTS kirjaa_poistot ON %s', taulu);
+		EXECUTE format('CREATE TRIGGER kirjaa_lisaykset AFTER INSERT ON %s REFERENCING NEW TABLE AS uudet FOR EACH STATEMENT EXECUTE FUNCTION meta.kirjaa_muutokset()', taulu);
+		EXECUTE format('CREATE TRIGGER kirjaa_muutokset AFTER UPDATE ON %s REFERENCING NEW TABLE AS uudet FOR EACH STATEMENT EXECUTE FUNCTION meta.kirjaa_muutokset()', taulu);
+		EXECUTE format('CREATE TRIGGER kirjaa_poistot AFTER DELETE ON %s REFERENCING OLD TABLE AS vanhat FOR EACH STATEMENT EXECUTE FUNCTION meta.kirjaa_muutokset()', taulu);
+	END LOOP;
+END;
+$$;
+-- ddl-end --
@@ -37,6 +37,9 @@ from ..qgis_plugin_tools.tools.resources import load_ui, plugin_name, resources_
 FORM_CLASS = load_ui('db_init.ui')
 LOGGER = logging.getLogger(plugin_name())
 
+# Sql files creating the database structure in the order they are run.
+DATABASE_SCRIPTS = ['V1.0.0__initial.sql', 'V1.1.0__koodistot_version.sql', 'V1.2.0__muutosloki.sql']
+
 class Dialog(QDialog, FORM_CLASS):
     
     def __init__(self, iface, parent=None):
@@ -109,19 +112,20 @@ class Dialog(QDialog, FORM_CLASS):
                 conn.autocommit = True
                 with conn.cursor() as curs:
                     try:
-                        LOGGER.info("Attempting to read sql file.")
-                        with open(resources_path('V1.0.0__initial.sql'), "r") as f:
-                            LOGGER.info("File opened.")
-                            lines = f.readlines()
-                            modified_script = ''
-                            for line in lines:
-                                if 'ALTER' in line and 'OWNER TO' in line:
-                                    continue
-                                modified_script +=line
-                            curs.execute(modified_script)
-                            iface.messageBar().pushMessage(dbname, "-tietokanta alustettu onnistuneesti.", level=3, duration=5)
-                            return True
-                            #self.close()
+                        for script in DATABASE_SCRIPTS:
+                            LOGGER.info(f"Attempting to read sql file {script}.")
+                            with open(resources_path(script), "r") as f:
+                                LOGGER.info("File opened.")
+                                lines = f.readlines()
+                                modified_script = ''
+                                for line in lines:
+                                    if 'ALTER' in line and 'OWNER TO' in line:
+                                        continue
+                                    modified_script +=line
+                                curs.execute(modified_script)
+                        iface.messageBar().pushMessage(dbname, "-tietokanta alustettu onnistuneesti.", level=3, duration=5)
+                        return True
+                        #self.close()
                     except psycopg2.errors.InsufficientPrivilege:
                         iface.messageBar().pushMessage("Käyttäjällä ei riittäviä oikeuksia lisätä skeemoja, tauluja, sekvenssejä tai PostGIS- liitännäistä. Katso viestilokista lisätietoja.", level=2, duration=5)
                         error_msg = traceback.format_exc()
@@ -130,7 +134,6 @@ class Dialog(QDialog, FORM_CLASS):
                             LOGGER.info("Lisää tarvittavat oikeudet liitännäisen lisäämiseen käyttäjälle, tai lisää PostGIS- liitännäiseen tietokantaan etukäteen.")
                     except Exception as error:
                         iface.messageBar().pushMessage("Virhe tietokantarakenteen luomisessa. Katso viestilokista lisätietoja.", level=2, duration=5)
-                        LOGGER.info(resources_path('V1.0.0__initial.sql'))
                         LOGGER.info("Reading sql file failed.")
                         error_msg = traceback.format_exc()
                         LOGGER.info(error_msg)
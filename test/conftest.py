@@ -13,3 +13,38 @@ pytest-qgis (https://pypi.org/project/pytest-qgis) contains the following helpfu
   This should be used with tests that add stuff to QgsProject.
 
 """
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from psycopg2.sql import Composed, Identifier, Literal
+
+
+def render_sql(composable) -> str:
+    """Renders a psycopg2.sql composable without a connection, with identifiers unquoted and literals as their repr."""
+    if isinstance(composable, Composed):
+        return "".join(render_sql(part) for part in composable.seq)
+    if isinstance(composable, Identifier):
+        return ".".join(composable.strings)
+    if isinstance(composable, Literal):
+        return repr(composable.wrapped)
+    return composable.string
+
+
+class BrokenExecutor:
+    """Process pool whose worker processes could not be started."""
+
+    def submit(self, *args):
+        raise BrokenProcessPool("worker failed to start")
+
+    def shutdown(self, cancel_futures=False):
+        pass
+
+
+@pytest.fixture
+def render():
+    return render_sql
+
+
+@pytest.fixture
+def broken_executor():
+    return BrokenExecutor()
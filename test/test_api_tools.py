@@ -0,0 +1,168 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+from infrao.infrao_xml.xml_tools.api_tools import get_filter_parameters, get_items_url, iter_api_features, iter_collection_pages, iter_collections, sort_collections
+
+FEATURE_COUNT = 25
+MAX_LIMIT = 4
+
+
+def get_page(offset: int, limit: int, next_link: str = None, count_returned: bool = False) -> bytes:
+    members = "".join(
+        f'<sf:featureMember><infrao:Puu gml:id="Puu.{i}"><infrao:yksilointitieto>{i}</infrao:yksilointitieto></infrao:Puu></sf:featureMember>'
+        for i in range(offset, min(offset + limit, FEATURE_COUNT))
+    )
+    link = f'<atom:link rel="next" href="{next_link}"/>' if next_link else ""
+    returned = f' numberReturned="{len(members.split("</sf:featureMember>")) - 1}"' if count_returned else ""
+    return (
+        '<sf:FeatureCollection xmlns:sf="http://www.opengis.net/ogcapi-features-1/1.0/sf" xmlns:atom="http://www.w3.org/2005/Atom" '
+        f'xmlns:infrao="www.infra-o.fi/infrao" xmlns:gml="http://www.opengis.net/gml/3.2" numberMatched="{FEATURE_COUNT}"{returned}>{link}{members}</sf:FeatureCollection>'
+    ).encode("utf-8")
+
+
+class CollectionHandler(BaseHTTPRequestHandler):
+    """
+    Serves the features of a collection with offset paging and Link headers, or with opaque page tokens in atom:link elements.
+
+    Under /capped/ at most MAX_LIMIT features are returned per page, but the next links step by the requested limit.
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        limit = int(query.get("limit", 10))
+        self.server.requests.append(query)
+        self.server.encodings.append(self.headers.get("Accept-Encoding"))
+        if url.path.startswith("/tokens/"):
+            offset = int(query.get("token", 0))
+            next_link = f"http://localhost:{self.server.server_port}/tokens/collections/puu/items?token={offset + limit}&amp;limit={limit}" if offset + limit < FEATURE_COUNT else None
+            content = get_page(offset, limit, next_link)
+            headers = {}
+        elif url.path.startswith("/capped/"):
+            offset = int(query.get("offset", 0))
+            content = get_page(offset, min(limit, MAX_LIMIT), count_returned=url.path.startswith("/capped/counted/"))
+            headers = {"Link": f'<http://localhost:{self.server.server_port}{url.path}?offset={offset + limit}&limit={limit}>; rel="next"'} if offset + limit < FEATURE_COUNT else {}
+        else:
+            offset = int(query.get("offset", 0))
+            content = get_page(offset, limit)
+            headers = {"Link": f'<http://localhost:{self.server.server_port}/collections/puu/items?offset={offset + limit}&limit={limit}>; rel="next"'} if offset + limit < FEATURE_COUNT else {}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/gml+xml")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api_url():
+    server = ThreadingHTTPServer(("localhost", 0), CollectionHandler)
+    server.requests = []
+    server.encodings = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_port}/", server
+    server.shutdown()
+    server.server_close()
+
+
+def test_iter_collection_pages_fetches_offset_pages_concurrently(api_url):
+    url, server = api_url
+    with requests.Session() as session:
+        pages = iter_collection_pages(session, get_items_url(url, "puu"), page_size=10, workers=2)
+        identifiers = [element.get("{http://www.opengis.net/gml/3.2}id") for _, element in iter_api_features(pages)]
+
+    assert identifiers == [f"Puu.{i}" for i in range(FEATURE_COUNT)]
+    assert sorted(int(query.get("offset", 0)) for query in server.requests) == [0, 10, 20]
+
+
+@pytest.mark.parametrize("path", ["capped", "capped/counted"])
+def test_iter_collection_pages_steps_offsets_by_returned_features(api_url, path):
+    url, server = api_url
+    with requests.Session() as session:
+        pages = iter_collection_pages(session, get_items_url(f"{url}{path}", "puu"), page_size=10, workers=2)
+        identifiers = [element.get("{http://www.opengis.net/gml/3.2}id") for _, element in iter_api_features(pages)]
+
+    assert identifiers == [f"Puu.{i}" for i in range(FEATURE_COUNT)]
+    assert sorted(int(query.get("offset", 0)) for query in server.requests) == list(range(0, FEATURE_COUNT, MAX_LIMIT))
+
+
+def test_iter_collection_pages_follows_next_links(api_url):
+    url, server = api_url
+    with requests.Session() as session:
+        pages = iter_collection_pages(session, get_items_url(f"{url}tokens", "puu"), page_size=10)
+        features = [table for table, _ in iter_api_features(pages)]
+
+    assert features == ["puu"] * FEATURE_COUNT
+    assert [query.get("token") for query in server.requests] == [None, "10", "20"]
+    assert server.requests[0]["f"] == "application/gml+xml;version=3.2"
+
+
+def test_iter_collection_pages_reads_gzip_compressed_pages(api_url):
+    url, server = api_url
+    with requests.Session() as session:
+        page = next(iter_collection_pages(session, get_items_url(url, "puu"), page_size=10, workers=1))
+        features = list(page.iter_features())
+
+    assert server.encodings[0] == "gzip"
+    assert (page.next_url, page.number_matched, len(features)) == (f"{url}collections/puu/items?offset=10&limit=10", FEATURE_COUNT, 10)
+
+
+def test_iter_collections_reads_collections_in_import_order(api_url):
+    url, server = api_url
+    collections = sort_collections(["infrao:Puu", "infrao:KatualueenOsa", "muu:Taso", "infrao:Katualue"])
+    with requests.Session() as session:
+        tables = [table for pages in iter_collections(session, [get_items_url(url, collection) for collection in collections], page_size=10, workers=2) for table, _ in iter_api_features(pages)]
+
+    assert collections == ["infrao:Katualue", "infrao:KatualueenOsa", "infrao:Puu", "muu:Taso"]
+    assert tables == ["puu"] * FEATURE_COUNT * len(collections)
+    assert len(server.requests) == 3 * len(collections)
+
+
+class UncountedPage:
+    """Page of a service which does not report numberMatched."""
+
+    number_matched = None
+
+    def iter_features(self):
+        for i in range(250):
+            yield "puu", i
+
+
+def test_iter_api_features_reports_progress_without_matched_feature_count():
+    progress = []
+
+    features = list(iter_api_features(iter([UncountedPage()]), progress.append))
+
+    assert len(features) == 250
+    assert progress == [0, 0]
+
+
+def test_get_items_url_adds_filter_parameters(api_url):
+    url, server = api_url
+    parameters = get_filter_parameters((385000.5, 6670000, 386000, 6671000), "http://www.opengis.net/def/crs/EPSG/0/3067", "omistaja = 'Kaupunki'", "2024-01-01T00:00:00Z/..")
+    with requests.Session() as session:
+        next(iter_collection_pages(session, get_items_url(url, "puu", parameters), page_size=10)).close()
+
+    assert get_filter_parameters() == {}
+    assert server.requests[0] == {
+        "bbox": "385000.5,6670000,386000,6671000",
+        "bbox-crs": "http://www.opengis.net/def/crs/EPSG/0/3067",
+        "filter": "omistaja = 'Kaupunki'",
+        "filter-lang": "cql2-text",
+        "datetime": "2024-01-01T00:00:00Z/..",
+        "f": "application/gml+xml;version=3.2",
+        "limit": "10",
+    }
@@ -0,0 +1,210 @@
+import io
+import os
+import struct
+import uuid
+from datetime import datetime
+from xml.etree import ElementTree as ET
+
+import psycopg2
+import pytest
+from psycopg2.extensions import parse_dsn
+
+from infrao.infrao_xml.xml_tools import export_tools
+from infrao.infrao_xml.xml_tools.export_tools import GML_NS_LINK, INFRAO_PUU_TAGS, FeatureRow, GmlWriter, TableEmitter, add_gml_geometry, get_changed_condition, get_tombstone_element, xml_export
+from infrao.infrao_xml.xml_tools.geometry import read_ewkb
+
+
+def test_gml_writer_writes_features_incrementally():
+    stream = io.StringIO()
+    writer = GmlWriter(stream)
+    writer.write_start({"xmlns:infrao": "www.infra-o.fi/infrao", "xmlns:gml": "http://www.opengis.net/gml/3.2"})
+    for identifier in ["1", "2"]:
+        feature = ET.Element("infrao:Puu", {"gml:id": f"Puu.{identifier}"})
+        ET.SubElement(feature, "infrao:yksilointitieto").text = identifier
+        writer.write_element(feature)
+    writer.write_end()
+
+    root = ET.fromstring(stream.getvalue().encode("utf-8"))
+
+    assert [element.get("{http://www.opengis.net/gml/3.2}id") for element in root[0]] == ["Puu.1", "Puu.2"]
+    assert "\n\t\t<infrao:Puu" in stream.getvalue()
+
+
+def test_feature_row_looks_up_values_by_column_name():
+    row = FeatureRow({"FID": 0, "YKSILOINTITIETO": 1}, [5, "abc"])
+
+    assert row["YKSILOINTITIETO"] == "abc"
+    assert row.get("GEOM_POINT") is None
+    assert list(row) == ["FID", "YKSILOINTITIETO"]
+
+
+def test_add_gml_geometry_writes_polygon_from_ewkb():
+    ewkb = struct.pack("<BIII", 1, 3 | 0x80000000 | 0x20000000, 3067, 1) + struct.pack("<I12d", 4, 0, 0, 1, 0.5, 0, 1, 1, 1, 1, 0, 0, 1)
+    geometry_type, srid, parts, _ = read_ewkb(ewkb)
+    parent = ET.Element("infrao:alue")
+
+    add_gml_geometry(parent, geometry_type, srid, parts, "Puu.1.geom_poly")
+
+    assert ET.tostring(parent, encoding="unicode") == (
+        '<infrao:alue><gml:Polygon srsName="EPSG:3067" gml:id="Puu.1.geom_poly"><gml:exterior><gml:LinearRing>'
+        '<gml:posList srsDimension="3">0 0 1 0.5 0 1 1 1 1 0 0 1</gml:posList>'
+        '</gml:LinearRing></gml:exterior></gml:Polygon></infrao:alue>'
+    )
+
+
+def test_table_emitter_emits_feature_from_compiled_steps():
+    columns = {key: i for i, key in enumerate(INFRAO_PUU_TAGS)}
+    values = [None] * len(columns)
+    values[columns["FID"]] = 7
+    values[columns["YKSILOINTITIETO"]] = "abc"
+    values[columns["KORKEUSMITTA"]] = 12.5
+    values[columns["PUULAJI"]] = "Tyhjä"
+    values[columns["METATIETO"]] = False
+    values[columns["KUULUUKATUALUEENOSAAN"]] = 3
+    area_memberships = {"viheralueenosa": {}, "katualueenosa": {"abc": "k1"}, "katualue": {}, "viheralue": {}}
+    area_contents = {key: {} for key in area_memberships}
+    emitter = TableEmitter("puu", INFRAO_PUU_TAGS, area_memberships, area_contents, {"puu": {}}, {})
+
+    feature = emitter.emit(FeatureRow(columns, values))
+
+    assert feature.get("gml:id") == "Puu.abc"
+    assert feature.find("infrao:korkeusMitta").text == "12.5"
+    assert feature.find("infrao:puulaji") is None
+    assert feature.find("infrao:kuuluuKatuAlueenOsaan").get("xlink:href") == "#Katualueenosa.k1"
+    assert [element.tag for element in feature.find("infrao:sijaintitieto").iter()] == ["infrao:sijaintitieto", "infrao:Sijainti", "infrao:tyhjaGeometria", "gml:Null"]
+
+
+def test_table_emitter_handles_empty_geometries_like_missing_ones():
+    columns = {key: i for i, key in enumerate(INFRAO_PUU_TAGS)}
+    values = [None] * len(columns)
+    values[columns["FID"]] = 7
+    values[columns["YKSILOINTITIETO"]] = "abc"
+    values[columns["GEOM_POINT"]] = struct.pack("<BII2d", 1, 1 | 0x20000000, 3067, float("nan"), float("nan"))
+    values[columns["GEOM_LINE"]] = struct.pack("<BIII", 1, 2 | 0x20000000, 3067, 0)
+    area_memberships = {"viheralueenosa": {}, "katualueenosa": {}, "katualue": {}, "viheralue": {}}
+    area_contents = {key: {} for key in area_memberships}
+    emitter = TableEmitter("puu", INFRAO_PUU_TAGS, area_memberships, area_contents, {"puu": {}}, {})
+
+    feature = emitter.emit(FeatureRow(columns, values))
+
+    assert [element.tag for element in feature.find("infrao:sijaintitieto").iter()] == ["infrao:sijaintitieto", "infrao:Sijainti", "infrao:tyhjaGeometria", "gml:Null"]
+    assert len(feature.findall("infrao:sijaintitieto")) == 1
+
+
+def test_add_gml_geometry_leaves_out_empty_members():
+    ewkb = struct.pack("<BII", 1, 4, 2) + struct.pack("<BI2d", 1, 1, 1, 2) + struct.pack("<BI2d", 1, 1, float("nan"), float("nan"))
+    geometry_type, srid, parts, _ = read_ewkb(ewkb)
+    parent = ET.Element("infrao:piste")
+
+    add_gml_geometry(parent, geometry_type, srid, parts)
+
+    assert "nan" not in ET.tostring(parent, encoding="unicode")
+    assert len(parent[0]) == 1
+
+
+@pytest.fixture
+def shipments(monkeypatch):
+    snapshot = "750:752:750"
+    stored = []
+
+    def write_table(schema, table, writer):
+        writer.write_text(f"<infrao:{table}/>")
+        if table == "puu":
+            raise ValueError("puu")
+
+    def store_shipment_information(shipment_information, conn_params, snapshot=None, exported=True):
+        stored.append((os.path.exists(conn_params["save_file"]), snapshot, exported))
+
+    monkeypatch.setattr(export_tools, "get_shipment_snapshots", lambda conn_params: (None, snapshot))
+    monkeypatch.setattr(export_tools, "write_table", write_table)
+    monkeypatch.setattr(export_tools, "store_shipment_information", store_shipment_information)
+    return snapshot, stored
+
+
+def test_xml_export_stores_partial_shipment_as_not_exported_after_writing_the_file(shipments, tmp_path):
+    snapshot, stored = shipments
+    save_file = str(tmp_path / "vienti.gml")
+
+    failed_tables = xml_export({"save_file": save_file}, save_file, {"aineistonnimi": "Toimitus"}, workers=1, database_xml=True)
+
+    assert failed_tables == ["puu"]
+    assert stored == [(True, snapshot, False)]
+    with open(save_file, encoding="utf-8") as document:
+        written = document.read()
+    assert "<infrao:katualue/>" in written
+    assert "<infrao:puu/>" not in written
+
+
+def test_xml_export_does_not_store_shipment_if_the_file_is_not_written(shipments, tmp_path, monkeypatch):
+    _, stored = shipments
+    save_file = str(tmp_path / "vienti.gml")
+
+    def replace(source, destination):
+        raise PermissionError(destination)
+
+    monkeypatch.setattr(export_tools.os, "replace", replace)
+
+    with pytest.raises(PermissionError):
+        xml_export({"save_file": save_file}, save_file, {"aineistonnimi": "Toimitus"}, workers=1, database_xml=True)
+
+    assert stored == []
+
+
+def test_get_changed_condition_selects_features_logged_by_transactions_not_visible_in_snapshot(render):
+    assert render(get_changed_condition("kasvillisuus", "puu", "750:752:750")) == (
+        " WHERE t.fid IN (SELECT l.fid FROM meta.muutosloki AS l WHERE l.skeema = 'kasvillisuus' AND l.taulu = 'puu'"
+        " AND l.transaktio >= pg_snapshot_xmin('750:752:750'::pg_snapshot) AND NOT pg_visible_in_snapshot(l.transaktio, '750:752:750'::pg_snapshot))"
+    )
+
+
+def test_get_tombstone_element_has_identifier_and_deletion_time():
+    feature = get_tombstone_element("puu", "abc", datetime(2024, 5, 1, 12, 30))
+
+    assert ET.tostring(feature, encoding="unicode") == (
+        '<infrao:Puu gml:id="Puu.abc"><infrao:yksilointitieto>abc</infrao:yksilointitieto><infrao:loppuHetki>2024-05-01T12:30:00</infrao:loppuHetki></infrao:Puu>'
+    )
+
+
+def test_xml_export_exports_tables_in_this_process_if_workers_fail(shipments, tmp_path, monkeypatch, broken_executor):
+    _, stored = shipments
+    save_file = str(tmp_path / "vienti.gml")
+    monkeypatch.setattr(export_tools, "create_export_executor", lambda workers, initargs: broken_executor)
+
+    failed_tables = xml_export({"save_file": save_file}, save_file, {"aineistonnimi": "Toimitus"}, workers=2, database_xml=True)
+
+    assert failed_tables == ["puu"]
+    assert len(stored) == 1
+
+
+@pytest.fixture
+def exported_puu():
+    """Adds a tree to the database given by INFRAO_TEST_DB (a libpq connection string) for the duration of a test."""
+    if not os.environ.get("INFRAO_TEST_DB"):
+        pytest.skip("INFRAO_TEST_DB is not set")
+    conn_params = parse_dsn(os.environ["INFRAO_TEST_DB"])
+    identifier = f"vientitesti-{uuid.uuid4()}"
+    conn = psycopg2.connect(**conn_params)
+    try:
+        with conn, conn.cursor() as curs:
+            curs.execute(
+                "INSERT INTO kasvillisuus.puu (identifier, alkuhetki, omistaja, korkeus, meta_muokkauspvm, geom_point)"
+                " VALUES (%s, '2024-05-01 12:30+03', 'Kaupunki', 12.5, '2024-05-02', ST_GeomFromText('POINT Z(385000.125 6672000.5 10)', 3067))",
+                (identifier,))
+        yield conn_params, identifier
+    finally:
+        with conn, conn.cursor() as curs:
+            curs.execute("DELETE FROM kasvillisuus.puu WHERE identifier = %s", (identifier,))
+        conn.close()
+
+
+def test_database_xml_matches_features_built_in_python(exported_puu, tmp_path):
+    conn_params, identifier = exported_puu
+    features = []
+    for database_xml in (False, True):
+        save_file = str(tmp_path / f"vienti_{database_xml}.gml")
+        assert xml_export(conn_params, save_file, {}, workers=1, database_xml=database_xml) == []
+        feature = ET.parse(save_file).getroot().find(f".//{{www.infra-o.fi/infrao}}Puu[@{{{GML_NS_LINK}}}id='Puu.{identifier}']")
+        assert feature is not None
+        features.append(ET.canonicalize(ET.tostring(feature, encoding="unicode"), strip_text=True))
+
+    assert features[0] == features[1]
@@ -0,0 +1,71 @@
+import struct
+
+import numpy as np
+from xml.etree import ElementTree as ET
+
+from infrao.infrao_xml.xml_tools.geometry import GeometryEncoder, is_empty_ewkb, read_ewkb, read_gml_geometry, transform_geometries
+
+GML_NS = 'xmlns:gml="http://www.opengis.net/gml/3.2"'
+
+
+class OffsetTransformation:
+    def __init__(self):
+        self.calls = 0
+
+    def TransformPoints(self, points):
+        self.calls += 1
+        return [(x + 1, y + 2, 0) for x, y in points]
+
+
+def test_read_gml_geometry_encodes_line_string_as_ewkb():
+    element = ET.fromstring(f'<gml:LineString {GML_NS}><gml:posList>1 2 3 4</gml:posList></gml:LineString>')
+    values = [{"geom": read_gml_geometry(element, None)}]
+
+    GeometryEncoder(3067).encode(values)
+
+    assert values[0]["geom"] == struct.pack("<BII4d", 1, 2, 2, 1, 2, 3, 4)
+
+
+def test_transform_geometries_transforms_all_rings_in_one_call():
+    point = read_gml_geometry(ET.fromstring(f'<gml:Point {GML_NS} srsDimension="3"><gml:pos>1 1 5</gml:pos></gml:Point>'), 3879)
+    polygon = read_gml_geometry(ET.fromstring(
+        f'<gml:Polygon {GML_NS}><gml:exterior><gml:LinearRing><gml:posList>0 0 1 0 1 1 0 0</gml:posList></gml:LinearRing></gml:exterior>'
+        '<gml:interior><gml:LinearRing><gml:posList>0 0 0 1 1 1 0 0</gml:posList></gml:LinearRing></gml:interior></gml:Polygon>'
+    ), 3879)
+    transformation = OffsetTransformation()
+
+    transform_geometries([point, polygon], transformation)
+
+    assert transformation.calls == 1
+    assert np.array_equal(point.rings[0], [[2, 3, 5]])
+    assert np.array_equal(polygon.rings[1], [[1, 2], [1, 3], [2, 3], [1, 2]])
+
+
+def test_geometry_encoder_keeps_source_srid_when_transforming_in_database():
+    element = ET.fromstring(f'<gml:Point {GML_NS}><gml:pos>1 2</gml:pos></gml:Point>')
+    values = [{"geom": read_gml_geometry(element, 3879)}]
+
+    GeometryEncoder(3067, transform_in_database=True).encode(values)
+
+    assert values[0]["geom"] == struct.pack("<BII2d", 1, 1 | 0x20000000, 3879, 1, 2)
+
+
+def test_read_ewkb_reads_multi_polygon_with_srid_and_drops_m():
+    line_string = struct.pack("<BII4d", 1, 2, 2, 1, 2, 3, 4)
+    ring = struct.pack("<I", 4) + struct.pack("<12d", 0, 0, 1, 1, 0, 1, 1, 1, 1, 0, 0, 1)
+    multi_polygon = struct.pack("<BIII", 1, 6 | 0x20000000, 3067, 1) + struct.pack("<BII", 1, 3 | 0x40000000, 1) + ring
+
+    assert read_ewkb(line_string)[2][0][0].tolist() == [[1, 2], [3, 4]]
+
+    geometry_type, srid, parts, offset = read_ewkb(multi_polygon)
+
+    assert (geometry_type, srid, offset) == (6, 3067, len(multi_polygon))
+    assert parts[0][0].tolist() == [[0, 0], [1, 0], [1, 1], [0, 0]]
+
+
+def test_is_empty_ewkb_detects_empty_geometries():
+    assert is_empty_ewkb(struct.pack("<BII2d", 1, 1 | 0x20000000, 3067, float("nan"), float("nan")))
+    assert is_empty_ewkb(struct.pack("<BII", 1, 3, 0))
+    assert is_empty_ewkb(struct.pack("<BII", 1, 6, 1) + struct.pack("<BII", 1, 3, 0))
+    assert not is_empty_ewkb(struct.pack("<BI2d", 1, 1, 1, 2))
+    assert not is_empty_ewkb(struct.pack("<BII4d", 1, 2, 2, 1, 2, 3, 4))
@@ -0,0 +1,120 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from infrao.infrao_xml.xml_tools.http_cache import HttpCache, create_session
+
+BODY = b'{"collections": [{"id": "infrao:Puu"}]}'
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    """Serves a fixed body with an ETag and answers conditional requests with 304. Paths under /slow/ send the end of the body only once the test allows it."""
+
+    def do_GET(self):
+        self.server.statuses.append(self.path)
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", '"v1"')
+        self.send_header("Link", f'<http://localhost:{self.server.server_port}/next>; rel="next"')
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        if self.path.startswith("/slow/"):
+            self.wfile.write(BODY[:10])
+            self.wfile.flush()
+            self.server.body_allowed.wait(5)
+            self.wfile.write(BODY[10:])
+        else:
+            self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("localhost", 0), ETagHandler)
+    server.statuses = []
+    server.body_allowed = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_caching_adapter_reads_unchanged_response_from_cache(server, tmp_path):
+    cache = HttpCache(str(tmp_path))
+    url = f"http://localhost:{server.server_port}/collections"
+    with create_session(cache) as session:
+        first = session.get(url)
+        second = session.get(url, stream=True)
+        second_body = second.raw.read()
+
+    assert first.content == second_body == BODY
+    assert second.links["next"]["url"].endswith("/next")
+    assert len(server.statuses) == 2
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_http_cache_evicts_least_recently_used_responses(server, tmp_path):
+    cache = HttpCache(str(tmp_path), max_size=2 * len(BODY) + 300, max_group_size=2 * len(BODY) + 300)
+    urls = [f"http://localhost:{server.server_port}/collections/{i}" for i in range(3)]
+    with create_session(cache) as session:
+        for i, url in enumerate(urls[:2]):
+            session.get(url)
+            os.utime(cache.get_path(url, "*/*"), (i, i))
+        session.get(urls[0])
+        session.get(urls[2])
+
+    cached = [os.path.exists(cache.get_path(url, "*/*")) for url in urls]
+
+    assert cached == [True, False, True]
+
+
+def test_caching_adapter_stores_response_as_it_is_read(server, tmp_path):
+    cache = HttpCache(str(tmp_path))
+    url = f"http://localhost:{server.server_port}/slow/collections"
+    with create_session(cache) as session:
+        response = session.get(url, stream=True)
+        start = response.raw.read(10)
+        cached_before_end = os.path.exists(cache.get_path(url, "*/*"))
+        server.body_allowed.set()
+        end = response.raw.read()
+
+    assert start + end == BODY
+    assert not cached_before_end
+    assert cache.get_headers(cache.get_path(url, "*/*"))["ETag"] == '"v1"'
+
+
+def test_caching_adapter_does_not_store_response_which_is_not_read_to_the_end(server, tmp_path):
+    cache = HttpCache(str(tmp_path))
+    url = f"http://localhost:{server.server_port}/slow/collections"
+    with create_session(cache) as session:
+        response = session.get(url, stream=True)
+        response.raw.read(10)
+        response.close()
+        server.body_allowed.set()
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_http_cache_removes_responses_of_the_same_url_first(server, tmp_path):
+    cache = HttpCache(str(tmp_path), max_size=10 * len(BODY) + 1500, max_group_size=2 * len(BODY) + 300)
+    other_url = f"http://localhost:{server.server_port}/collections"
+    page_urls = [f"http://localhost:{server.server_port}/collections/items?offset={i}" for i in range(4)]
+    with create_session(cache) as session:
+        session.get(other_url)
+        os.utime(cache.get_path(other_url, "*/*"), (0, 0))
+        for i, url in enumerate(page_urls):
+            session.get(url)
+            os.utime(cache.get_path(url, "*/*"), (i + 1, i + 1))
+
+    cached = [os.path.exists(cache.get_path(url, "*/*")) for url in [other_url] + page_urls]
+
+    assert cached == [True, False, False, True, True]
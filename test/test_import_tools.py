@@ -0,0 +1,67 @@
+import io
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree as ET
+
+from infrao.infrao_xml.xml_tools.import_tools import format_copy_value, get_key_match, get_parsed_features, init_parse_worker, iter_xml_features, parse_features, submit_parse
+from infrao.infrao_xml.xml_tools.koodistot import Koodistot
+
+GML = b"""<?xml version="1.0" encoding="utf-8"?>
+<infrao:InfraoKohteet xmlns:infrao="www.infra-o.fi/infrao" xmlns:gml="http://www.opengis.net/gml/3.2">
+    <gml:featureMembers>
+        <infrao:Puu gml:id="Puu.1"><infrao:yksilointitieto>1</infrao:yksilointitieto></infrao:Puu>
+        <infrao:Katualue gml:id="Katualue.2"><infrao:yksilointitieto>2</infrao:yksilointitieto></infrao:Katualue>
+    </gml:featureMembers>
+    <infrao:toimituksentiedot>
+        <infrao:Toimitus><infrao:aineistonnimi>testi</infrao:aineistonnimi></infrao:Toimitus>
+    </infrao:toimituksentiedot>
+</infrao:InfraoKohteet>
+"""
+
+
+def test_iter_xml_features_dispatches_features_by_tag():
+    features = [
+        (table, element.find("./{www.infra-o.fi/infrao}yksilointitieto").text)
+        for table, element in iter_xml_features(io.BytesIO(GML))
+        if table != "aineistotoimituksentiedot"
+    ]
+
+    assert features == [("puu", "1"), ("katualue", "2")]
+
+
+def test_iter_xml_features_clears_read_features():
+    elements = list(iter_xml_features(io.BytesIO(GML)))
+
+    assert [table for table, _ in elements][-1] == "aineistotoimituksentiedot"
+    assert all(len(element) == 0 for _, element in elements)
+
+
+def test_format_copy_value_escapes_text_format():
+    assert format_copy_value(None) == "\\N"
+    assert format_copy_value(-1) == "-1"
+    assert format_copy_value("a\tb\nc\\d") == "a\\tb\\nc\\\\d"
+    assert format_copy_value(b"\x01\x01\x00") == "010100"
+
+
+def test_get_key_match_compares_columns_nulls_included(render):
+    assert render(get_key_match("t", "i", ["katunimi", "postinumero"])) == "t.katunimi IS NOT DISTINCT FROM i.katunimi AND t.postinumero IS NOT DISTINCT FROM i.postinumero"
+
+
+def test_parse_features_returns_rows_of_serialised_features():
+    init_parse_worker(Koodistot({}, {}, ()), False)
+    features = [ET.tostring(element) for table, element in iter_xml_features(io.BytesIO(GML)) if table == "puu"]
+
+    columns, rows, plan_link_dicts, decree_information_dicts, area_references = parse_features("puu", features)
+
+    assert rows[0][columns.index("identifier")] == "1"
+    assert plan_link_dicts == decree_information_dicts == area_references == []
+
+
+def test_get_parsed_features_reads_features_in_this_process_if_workers_fail(broken_executor):
+    init_parse_worker(Koodistot({}, {}, ()), False)
+    features = [ET.tostring(element) for table, element in iter_xml_features(io.BytesIO(GML)) if table == "puu"]
+    future = Future()
+    future.set_exception(BrokenProcessPool("worker terminated abruptly"))
+
+    assert submit_parse(broken_executor, "puu", features) is None
+    assert get_parsed_features(future, "puu", features) == get_parsed_features(None, "puu", features) == parse_features("puu", features)
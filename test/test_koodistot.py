@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import pytest
+
+from infrao.infrao_xml.xml_tools import koodistot as koodistot_module
+from infrao.infrao_xml.xml_tools.koodistot import get_koodistot
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.query = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query):
+        self.query = self.conn.render(query)
+        if "cid, selite" in self.query:
+            self.conn.loads += 1
+
+    def fetchone(self):
+        if "to_regclass" in self.query:
+            return ("meta.koodistoversio" if self.conn.version is not None else None,)
+        return (self.conn.version,)
+
+    def fetchall(self):
+        if "pg_tables" in self.query:
+            return [("puutyyppi",)]
+        if "md5" in self.query:
+            return [("puutyyppi", str(self.conn.rows))]
+        return [("puutyyppi", cid, selite) for cid, selite in self.conn.rows]
+
+
+class FakeConnection:
+    def __init__(self, render, version=None):
+        self.render = render
+        self.info = SimpleNamespace(host="localhost", port=5432, dbname="infrao_test")
+        self.rows = [(1, "lehtipuu"), (2, "havupuu")]
+        self.version = version
+        self.loads = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+@pytest.fixture(autouse=True)
+def session_cache(monkeypatch):
+    monkeypatch.setattr(koodistot_module, "_KOODISTOT_CACHE", {})
+
+
+def test_get_koodistot_maps_both_directions_and_uses_cache(render, tmp_path):
+    conn = FakeConnection(render)
+
+    koodistot = get_koodistot(conn, ["puutyyppi"], str(tmp_path))
+    assert koodistot.cid("cid_puutyyppi", "havupuu") == 2
+    assert koodistot.selite("puutyyppi", 1) == "lehtipuu"
+    assert conn.loads == 1
+
+    assert get_koodistot(conn, ["puutyyppi"], str(tmp_path)) is koodistot
+    assert conn.loads == 1
+
+    conn.rows = [(1, "lehtipuu"), (2, "havupuu"), (3, "pensas")]
+    reloaded = get_koodistot(conn, ["puutyyppi"], str(tmp_path))
+    assert reloaded is not koodistot
+    assert reloaded.cid("cid_puutyyppi", "pensas") == 3
+    assert conn.loads == 2
+
+
+def test_get_koodistot_reads_saved_code_lists_while_version_is_unchanged(render, tmp_path, monkeypatch):
+    get_koodistot(FakeConnection(render, "v1"), ["puutyyppi"], str(tmp_path))
+    monkeypatch.setattr(koodistot_module, "_KOODISTOT_CACHE", {})
+    conn = FakeConnection(render, "v1")
+
+    koodistot = get_koodistot(conn, ["puutyyppi"], str(tmp_path))
+    assert koodistot.selite("cid_puutyyppi", 2) == "havupuu"
+    assert koodistot.cid("puutyyppi", "lehtipuu") == 1
+    assert conn.loads == 0
+
+    conn.version = "v2"
+    get_koodistot(conn, ["puutyyppi"], str(tmp_path))
+    assert conn.loads == 1